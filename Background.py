@@ -3,10 +3,18 @@ import matplotlib.pyplot as plt
 import numpy as np
 from scipy import signal
 import os
-import pickle
+import json
 import rp_scpi as scpi
 
 class Background:
+    # Factor by which chirp_sweep extends the excitation beyond the requested range
+    SWEEP_MARGIN = 1.2
+    # Full-scale input (V) per ACQ:SOURn:GAIN setting and the generator's output limit (V)
+    INPUT_RANGES = {'LV': 1.0, 'HV': 20.0}
+    AMPLITUDE_LIMIT = 1.0
+    # Low bins spectrum_quality treats as DC (Hann main lobe of an offset)
+    DC_BINS = 2
+
     def __init__(self, ip_address='rp-f05577.local', wave_form='sine', amplitude=40):
     #def __init__(self, ip_address='rp-f09afa.local', wave_form='sine', amplitude=40):
         """
@@ -38,6 +46,43 @@ class Background:
         self.i_list = []
         self.z_list = []
         self.timestamps = []
+
+        # Optional sweep_storage.RawWaveformArchive receiving every raw capture
+        self.archive = None
+        self.trigger_pos = None
+
+        # Frequency the generator is currently running at (None = not started by this instance),
+        # and whether it has been started with SOUR1:TRig:INT since the last GEN:RST
+        self.generator_frequency = None
+        self.generator_triggered = False
+
+        # Wait after the trigger before reading, lets the coil settle after a generator reset.
+        # Hot-switched captures skip it and rely on wait_until_settled instead.
+        self.post_trigger_delay = 1.0
+        self.settle_tolerance = 0.005
+        self.settle_max_captures = 10
+        self.settle_probe_samples = 4096
+        self.settle_captures = 0
+
+        # Input gain per channel (voltage, current); must match the LV/HV jumpers on a
+        # STEMlab 125-14, so auto_range only switches it when gain_switchable is set
+        self.input_gain = ['LV', 'LV']
+        self.gain_switchable = False
+        self.headroom_target = 0.7
+        self.clip_level = 0.98
+        self.amplitude_min = 0.01
+        self.auto_range_probes = 4
+        self.auto_range_span = 0.5
+        self.range_frequency = None
+        self.clip_list = []
+
+        # Per-capture spectrum quality (see calculate_impedance) and the limits a point must meet
+        self.quality_list = []
+        self.quality = {}
+        self.min_snr_db = 40.0
+        self.max_thd = 0.05
+        self.max_spur_dbc = -40.0
+        self.max_se_pct = 1.0
         
         # Connect to Red Pitaya
         self._connect()
@@ -105,16 +150,137 @@ class Background:
         # Enable output
         self.rp.tx_txt('OUTPUT1:STATE ON')
         #self.rp.tx_txt('SOUR1:TRig:INT')
+        self.generator_frequency = frequency
+        self.generator_triggered = False
         print(f"Generating {self.wave_form} signal at {frequency} Hz with {self.amplitude}V amplitude")
+
+    def _set_frequency(self, frequency):
+        """Retune the running generator with SOUR1:FREQ:FIX only (no GEN:RST, output stays on); starts it if needed"""
+        if self.generator_frequency is None:
+            self._generate_signal(frequency)
+            return
+        self.rp.tx_txt('SOUR1:FREQ:FIX ' + str(frequency))
+        self.generator_frequency = frequency
+        print(f"Generator retuned to {frequency} Hz")
+
+    def _ensure_signal(self, frequency):
+        """Run the generator at `frequency`, retuning it in place if it is already on"""
+        if self.generator_frequency != frequency:
+            self._set_frequency(frequency)
+
+    def wait_until_settled(self, frequency, tolerance=None, max_captures=None):
+        """
+        Take short captures until the impedance phasor stops changing
+
+        Each probe reads only `settle_probe_samples` samples per channel. The
+        response counts as settled when two successive phasors differ by less
+        than `tolerance` relative to their magnitude.
+
+        Returns:
+        --------
+        int
+            Number of probe captures taken (max_captures if it never settled)
+        """
+        tolerance = self.settle_tolerance if tolerance is None else tolerance
+        max_captures = self.settle_max_captures if max_captures is None else max_captures
+        read_data_size, self.read_data_size = self.read_data_size, min(self.read_data_size, self.settle_probe_samples)
+        previous = None
+        try:
+            for n in range(1, max_captures + 1):
+                self._setup_acquisition()
+                voltage, current = self.get_full_cycles(*self._acquire_data(frequency, post_trigger_delay=0, retrigger=False))
+                z = self.calculate_impedance(voltage, current, frequency)[0]
+                if previous is not None and abs(z - previous) <= tolerance * abs(z):
+                    print(f"Settled after {n} probe captures")
+                    return n
+                previous = z
+        finally:
+            self.read_data_size = read_data_size
+        print(f"Warning: response at {frequency} Hz did not settle within {max_captures} probe captures")
+        return max_captures
     
+    def _probe_peaks(self, frequency):
+        """Peak absolute value (V) of both channels in one short capture"""
+        read_data_size, self.read_data_size = self.read_data_size, min(self.read_data_size, self.settle_probe_samples)
+        try:
+            self._setup_acquisition()
+            voltage, current = self._acquire_data(frequency, post_trigger_delay=0, retrigger=False)
+        finally:
+            self.read_data_size = read_data_size
+        return float(np.max(np.abs(voltage))), float(np.max(np.abs(current)))
+
+    def clipped(self, voltage, current):
+        """(voltage_clipped, current_clipped) for a raw capture under the current input gain"""
+        return tuple(bool(np.max(np.abs(x)) >= self.clip_level * self.INPUT_RANGES[g]) for x, g in zip((voltage, current), self.input_gain))
+
+    def auto_range(self, frequency):
+        """
+        Choose input gain and generator amplitude from short probe captures
+
+        The generator is started (and settled) at `frequency` if needed. A
+        clipped channel is moved to HV when gain_switchable, otherwise the
+        amplitude is halved; an unclipped capture scales the amplitude so the
+        fuller channel peaks at `headroom_target` of its input range (within
+        amplitude_min..AMPLITUDE_LIMIT), and a switchable HV channel that would
+        fit LV moves back to LV. Stops when a probe needs no change.
+
+        Returns:
+        --------
+        dict
+            'gain', 'amplitude', 'peaks' (V, last probe), 'clipped' and 'probes'
+        """
+        self._select_acquisition_parameters(frequency)
+        if self.generator_frequency != frequency:
+            self._ensure_signal(frequency)
+            self.settle_captures = self.wait_until_settled(frequency)
+        for n in range(1, self.auto_range_probes + 1):
+            peaks = self._probe_peaks(frequency)
+            clipped = [bool(p >= self.clip_level * self.INPUT_RANGES[g]) for p, g in zip(peaks, self.input_gain)]
+            gain, amplitude = list(self.input_gain), self.amplitude
+            if any(clipped):
+                for ch in range(2):
+                    if clipped[ch] and self.gain_switchable and gain[ch] == 'LV':
+                        gain[ch] = 'HV'
+                if gain == self.input_gain:
+                    amplitude = max(self.amplitude / 2, self.amplitude_min)
+            else:
+                for ch in range(2):
+                    if self.gain_switchable and gain[ch] == 'HV' and peaks[ch] < self.headroom_target * self.INPUT_RANGES['LV']:
+                        gain[ch] = 'LV'
+                fill = max(p / self.INPUT_RANGES[g] for p, g in zip(peaks, gain))
+                if fill > 0:
+                    amplitude = min(max(self.amplitude * self.headroom_target / fill, self.amplitude_min), self.AMPLITUDE_LIMIT)
+                    if abs(amplitude / self.amplitude - 1) < 0.1:
+                        amplitude = self.amplitude
+            if gain == self.input_gain and amplitude == self.amplitude:
+                break
+            self.input_gain = gain
+            if amplitude != self.amplitude:
+                self.amplitude = amplitude
+                self.rp.tx_txt('SOUR1:VOLT ' + str(self.amplitude))
+        if any(clipped):
+            print(f"Warning: input still clipped at {frequency} Hz (gain {'/'.join(self.input_gain)}, amplitude {self.amplitude:.4f} V)")
+        self.range_frequency = frequency
+        print(f"Auto-range at {frequency} Hz: gain {'/'.join(self.input_gain)}, amplitude {self.amplitude:.4f} V, peaks {peaks[0]:.3f}/{peaks[1]:.3f} V after {n} probes")
+        return {'gain': list(self.input_gain), 'amplitude': self.amplitude, 'peaks': peaks, 'clipped': clipped, 'probes': n}
+
+    def _range_due(self, frequency):
+        """True when no auto_range has been done within auto_range_span decades of `frequency`"""
+        return self.range_frequency is None or abs(np.log10(frequency / self.range_frequency)) > self.auto_range_span
+
+    def _get_memory_region(self):
+        """Return start address and size (in bytes) of the reserved AXI memory region"""
+        start_address = int(self.rp.txrx_txt('ACQ:AXI:START?'))
+        size = int(self.rp.txrx_txt('ACQ:AXI:SIZE?'))
+        return start_address, size
+
     def _setup_acquisition(self):
         """Set up the acquisition parameters"""
         # Reset Acquisition
         self.rp.tx_txt('ACQ:RST')
         
         # Get Memory region
-        start_address = int(self.rp.txrx_txt('ACQ:AXI:START?'))
-        size = int(self.rp.txrx_txt('ACQ:AXI:SIZE?'))
+        start_address, size = self._get_memory_region()
         start_address2 = round(start_address + size/2)
         
         print("start_address: ", start_address, "size: ", size, "Checked Address: ", bool(start_address/16777216), ", Check Size: ", bool(size/2097152))
@@ -124,8 +290,10 @@ class Background:
         self.rp.tx_txt(f"ACQ:AXI:DEC {self.decimation}")
         print(f"Decimation set to {self.decimation}, Sample Rate: {self.sample_rate/1e6:.2f} MHz")
         
-        # Set units
+        # Set units and the input gain used to scale them
         self.rp.tx_txt('ACQ:AXI:DATA:Units VOLTS')
+        for channel, gain in enumerate(self.input_gain, 1):
+            self.rp.tx_txt(f"ACQ:SOUR{channel}:GAIN {gain}")
         
         # Set trigger delay for both channels
         self.rp.tx_txt(f"ACQ:AXI:SOUR1:Trig:Dly {self.data_size}")
@@ -144,8 +312,15 @@ class Background:
         
         print('Acquisition setup complete')
     
-    def _acquire_data(self, frequency):
-        """Acquire data from the Red Pitaya"""
+    def _trigger_and_wait(self, frequency, post_trigger_delay=None, trigger_source=None, retrigger=True):
+        """
+        Arm the trigger, wait until the DMA buffer is full and return the trigger positions
+
+        With `retrigger=False` (hot-switched captures) the running generator is
+        left alone: SOUR1:TRig:INT is only sent if it was never started, since it
+        restarts the waveform from the top of its buffer, and the capture
+        triggers NOW instead of on that restart.
+        """
         # Start acquisition
         self.rp.tx_txt('ACQ:START')
         #self.rp.tx_txt('ACQ:TRig CH1_PE') # รอจับสัญญาณที่ "ขอบขาขึ้น" (Positive Edge) ของสัญญาณที่เข้ามาทาง Channel 1
@@ -154,7 +329,11 @@ class Background:
         #self.rp.tx_txt('ACQ:TRig NOW')
         # 
         
-        if frequency < 1000:
+        if trigger_source is None and not retrigger:
+            trigger_source = 'NOW'
+        if trigger_source is not None:
+            self.rp.tx_txt(f"ACQ:TRig {trigger_source}")
+        elif frequency < 1000:
             print("Low frequency range detected. Using TRig AWG_PE.")
             # สำหรับความถี่ต่ำ: คำนวณพารามิเตอร์แบบไดนามิก
             self.rp.tx_txt('ACQ:TRig AWG_PE')
@@ -166,14 +345,16 @@ class Background:
          
         print("Waiting for trigger...")
         
-        self.rp.tx_txt('SOUR1:TRig:INT')
+        if retrigger or not self.generator_triggered:
+            self.rp.tx_txt('SOUR1:TRig:INT')
+            self.generator_triggered = True
 
         # Wait for trigger
         while True:
             self.rp.tx_txt("ACQ:TRig:STAT?")
             if self.rp.rx_txt() == 'TD':
                 print("Triggered")
-                time.sleep(1)
+                time.sleep(self.post_trigger_delay if post_trigger_delay is None else post_trigger_delay)
                 break
         
         # Wait for buffer to fill
@@ -189,6 +370,17 @@ class Background:
         # Get write pointer at trigger location
         pos_ch_a = int(self.rp.txrx_txt('ACQ:AXI:SOUR1:Trig:Pos?'))
         pos_ch_b = int(self.rp.txrx_txt('ACQ:AXI:SOUR2:Trig:Pos?'))
+        return pos_ch_a, pos_ch_b
+
+    def _read_axi_block(self, channel, position, count):
+        """Read `count` samples of one DMA channel starting at `position` into a float array"""
+        self.rp.tx_txt(f"ACQ:AXI:SOUR{channel}:DATA:Start:N? {position},{count}")
+        signal_str = self.rp.rx_txt()
+        return np.array(signal_str.strip('{}\n\r').replace("  ", "").split(','), dtype=float)
+
+    def _acquire_data(self, frequency, post_trigger_delay=None, retrigger=True):
+        """Acquire data from the Red Pitaya (see _trigger_and_wait for `retrigger`)"""
+        pos_ch_a, pos_ch_b = self._trigger_and_wait(frequency, post_trigger_delay, retrigger=retrigger)
         
         # Read data
         self.rp.tx_txt(f"ACQ:AXI:SOUR1:DATA:Start:N? {pos_ch_a},{self.read_data_size}")
@@ -200,18 +392,277 @@ class Background:
         buff_voltage = list(map(float, signal_str_a.strip('{}\n\r').replace("  ", "").split(',')))
         buff_current = list(map(float, signal_str_b.strip('{}\n\r').replace("  ", "").split(',')))
         
-        ## Processing
-        voltage_signal = np.array(buff_voltage)
-        current_signal = np.array(buff_current)
-
-        #time_data_to_save = {'voltage': voltage_signal, 'current': current_signal, 'sample_rate': self.sample_rate}
-        #timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-        #pickle_filename = f'waveformData/run_{frequency}_{timestamp}.pkl'
-        #with open(pickle_filename, 'wb') as pf:
-        #    pickle.dump(time_data_to_save, pf)
+        # Raw captures are kept through self.archive (see measure_impedance)
+        self.trigger_pos = (pos_ch_a, pos_ch_b)
 
         return np.array(buff_voltage), np.array(buff_current)
-    
+
+    def deep_capture(self, frequency, duration=None, num_samples=None, decimation=None, filename=None, chunk_size=16384):
+        """
+        Capture the full per-channel DMA buffer and stream it to disk in chunks
+
+        Parameters:
+        -----------
+        frequency : float
+            Generator frequency in Hz
+        duration : float, optional
+            Capture length in seconds (ignored when num_samples is given)
+        num_samples : int, optional
+            Samples per channel (default: everything the reserved memory holds)
+        decimation : int, optional
+            Decimation factor (default: chosen by _calculate_acquisition_parameters)
+        filename : str, optional
+            Path of the spill file (default: "deep_capture_f{frequency}_dec{decimation}.dat")
+        chunk_size : int
+            Number of samples requested per SCPI read
+
+        Returns:
+        --------
+        capture : np.memmap
+            float32 array shaped (2, num_samples); row 0 is voltage, row 1 is current.
+            Metadata is written next to it as "<filename>.json".
+        """
+        if decimation is None:
+            self._calculate_acquisition_parameters(frequency)
+        else:
+            self.decimation = int(decimation)
+            self.sample_rate = 125e6 / self.decimation
+
+        # ครึ่งหนึ่งของหน่วยความจำต่อ 1 ช่อง, 2 bytes ต่อ sample
+        _, size = self._get_memory_region()
+        capacity = int(size / 2 / 2)
+        if num_samples is None:
+            num_samples = int(duration * self.sample_rate) if duration else capacity
+        num_samples = min(int(num_samples), capacity)
+        self.data_size = num_samples
+        self.read_data_size = min(chunk_size, num_samples)
+
+        if filename is None:
+            filename = f"deep_capture_f{frequency}_dec{self.decimation}.dat"
+        print(f"Deep capture: {num_samples} samples/channel ({num_samples / self.sample_rate:.3f} s) -> {filename}")
+
+        self._generate_signal(frequency)
+        self._setup_acquisition()
+        pos_ch_a, pos_ch_b = self._trigger_and_wait(frequency)
+        capture = self._stream_capture(filename, (pos_ch_a, pos_ch_b), num_samples, capacity, chunk_size, {'frequency': frequency})
+        print('Deep capture complete')
+        return capture
+
+    def _stream_capture(self, filename, trigger_pos, num_samples, capacity, chunk_size, metadata):
+        """Copy `num_samples` per channel from the DMA ring into a float32 memmap and write "<filename>.json" next to it"""
+        # Stream chunk by chunk so only one chunk is ever held in Python memory
+        pos_ch_a, pos_ch_b = trigger_pos
+        capture = np.memmap(filename, dtype=np.float32, mode='w+', shape=(2, num_samples))
+        for offset in range(0, num_samples, chunk_size):
+            n = min(chunk_size, num_samples - offset)
+            capture[0, offset:offset + n] = self._read_axi_block(1, (pos_ch_a + offset) % capacity, n)
+            capture[1, offset:offset + n] = self._read_axi_block(2, (pos_ch_b + offset) % capacity, n)
+        capture.flush()
+
+        metadata = dict(metadata, **{
+            'sample_rate': self.sample_rate, 'decimation': self.decimation,
+            'num_samples': num_samples, 'trigger_pos': [pos_ch_a, pos_ch_b],
+            'timestamp': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+        })
+        with open(filename + '.json', 'w', encoding='utf-8') as fp:
+            json.dump(metadata, fp, indent=2)
+        return capture
+
+    @staticmethod
+    def open_deep_capture(filename):
+        """Re-open a spill file written by deep_capture; returns (capture, metadata)"""
+        with open(filename + '.json', encoding='utf-8') as fp:
+            metadata = json.load(fp)
+        capture = np.memmap(filename, dtype=np.float32, mode='r', shape=(2, metadata['num_samples']))
+        return capture, metadata
+
+    def process_deep_capture(self, capture, frequency, sample_rate=None, block_periods=50):
+        """
+        Compute the impedance block by block over a deep capture
+
+        Each block spans `block_periods` periods of the excitation and is demodulated
+        with a Hanning-windowed single-bin DFT, so only one block is read from disk
+        at a time.
+
+        Returns:
+        --------
+        result : dict
+            'time' (block start in s), 'v', 'i', 'z' (complex per block) and 'z_mean'
+        """
+        if sample_rate is None:
+            sample_rate = self.sample_rate
+        num_samples = capture.shape[1]
+        block_len = min(max(int(round(block_periods * sample_rate / frequency)), 2), num_samples)
+        num_blocks = num_samples // block_len
+
+        t = np.arange(block_len) / sample_rate
+        reference = np.hanning(block_len) * np.exp(-2j * np.pi * frequency * t)
+        v_blocks = np.empty(num_blocks, dtype=np.complex128)
+        i_blocks = np.empty(num_blocks, dtype=np.complex128)
+        for b in range(num_blocks):
+            start = b * block_len
+            v_blocks[b] = np.dot(capture[0, start:start + block_len], reference)
+            i_blocks[b] = np.dot(capture[1, start:start + block_len], reference)
+
+        z_blocks = v_blocks / i_blocks
+        return {'time': np.arange(num_blocks) * block_len / sample_rate, 'v': v_blocks, 'i': i_blocks, 'z': z_blocks, 'z_mean': np.mean(z_blocks)}
+
+    def chirp_sweep(self, f_start, f_stop, duration=2.0, method='sweep', filename=None, chunk_size=16384):
+        """
+        Excite the whole band in one phase-continuous sweep while DMA records both channels
+
+        Parameters:
+        -----------
+        f_start, f_stop : float
+            Range to measure in Hz. The excitation runs SWEEP_MARGIN beyond
+            both ends so the outermost bands of process_chirp_capture are
+            excited across their full width.
+        duration : float
+            Capture length in seconds, shortened to what the reserved memory holds
+            at the chosen decimation. The generator sweep takes 90% of it, so it
+            fits even though the output starts just after the trigger.
+        method : str
+            'sweep' uses the generator's logarithmic sweep (SOUR1:SWeep:*);
+            'arb' uploads one 16384-sample log chirp as an arbitrary waveform and
+            repeats it for the whole capture (short period, so the low end of the
+            band gets only a few cycles per repetition)
+        filename : str, optional
+            Path of the spill file (default: "chirp_capture_{f_start}-{f_stop}.dat")
+        chunk_size : int
+            Number of samples requested per SCPI read
+
+        Returns:
+        --------
+        capture : np.memmap
+            float32 array shaped (2, num_samples) as in deep_capture; pass it to
+            process_chirp_capture. Metadata is written as "<filename>.json".
+        """
+        f_start, f_stop = f_start / self.SWEEP_MARGIN, f_stop * self.SWEEP_MARGIN
+        # ความถี่สุ่มอย่างน้อย 4 เท่าของความถี่สูงสุด เลือก Decimation ที่ใหญ่ที่สุดที่ยังได้ค่านี้
+        valid_decimations = [256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536]
+        self.decimation = max([d for d in valid_decimations if 125e6 / d >= 4 * f_stop], default=min(valid_decimations))
+        self.sample_rate = 125e6 / self.decimation
+
+        _, size = self._get_memory_region()
+        capacity = int(size / 2 / 2)
+        num_samples = min(int(duration * self.sample_rate), capacity)
+        if num_samples < int(duration * self.sample_rate):
+            print(f"Warning: reserved memory holds {num_samples / self.sample_rate:.3f} s at decimation {self.decimation}, shortening the sweep")
+        duration = num_samples / self.sample_rate
+        self.data_size = num_samples
+        self.read_data_size = min(chunk_size, num_samples)
+        if filename is None:
+            filename = f"chirp_capture_{f_start:g}-{f_stop:g}.dat"
+
+        self.rp.tx_txt('GEN:RST')
+        if method == 'arb':
+            period = 16384 / (8 * f_stop)
+            if period * f_start < 2:
+                print(f"Warning: a {period * 1e3:.1f} ms chirp holds fewer than 2 cycles at {f_start} Hz")
+            t = np.arange(16384) / 16384 * period
+            self.rp.sour_set(1, func="arbitrary", volt=self.amplitude, freq=1 / period, data=signal.chirp(t, f_start, period, f_stop, method='logarithmic', phi=-90))
+        else:
+            sweep_time = 0.9 * duration
+            self.rp.tx_txt('SOUR1:FUNC ' + str(self.wave_form).upper())
+            self.rp.tx_txt('SOUR1:VOLT ' + str(self.amplitude))
+            self.rp.tx_txt('SOUR1:FREQ:FIX ' + str(f_start))
+            self.rp.tx_txt(f"SOUR1:SWeep:FREQ:START {f_start}")
+            self.rp.tx_txt(f"SOUR1:SWeep:FREQ:STOP {f_stop}")
+            self.rp.tx_txt(f"SOUR1:SWeep:TIME {int(sweep_time * 1e6)}")
+            self.rp.tx_txt('SOUR1:SWeep:MODE LOG')
+            self.rp.tx_txt('SOUR1:SWeep:DIR NORMAL')
+        print(f"Chirp sweep ({method}): {f_start}-{f_stop} Hz, {num_samples} samples/channel ({duration:.3f} s) at decimation {self.decimation} -> {filename}")
+
+        self._setup_acquisition()
+        if method != 'arb':
+            self.rp.tx_txt('SOUR1:SWeep:STATE ON')
+        self.rp.tx_txt('OUTPUT1:STATE ON')
+        try:
+            pos_ch_a, pos_ch_b = self._trigger_and_wait(f_start, post_trigger_delay=0, trigger_source='NOW')
+        finally:
+            if method != 'arb':
+                self.rp.tx_txt('SOUR1:SWeep:STATE OFF')
+            # The output no longer holds a fixed tone; the next capture restarts the generator
+            self.generator_frequency = None
+
+        capture = self._stream_capture(filename, (pos_ch_a, pos_ch_b), num_samples, capacity, chunk_size, {'f_start': f_start, 'f_stop': f_stop, 'duration': duration, 'method': method})
+        print('Chirp capture complete')
+        return capture
+
+    def process_chirp_capture(self, capture, frequencies, sample_rate=None, nperseg=None, overlap=0.75):
+        """
+        Impedance spectrum of a chirp capture from short-time transfer functions
+
+        Both channels go through one scipy.signal.stft. Per STFT bin the
+        cross- and auto-spectra are summed over all frames (H1 estimator,
+        Z = sum(V conj(I)) / sum(|I|^2)), so frames where the sweep is far from
+        a bin carry no weight and the timing between sweep and trigger does not
+        matter. Bins are then pooled into one band per requested frequency
+        (edges halfway between neighbours on a log axis); a band without any
+        bin takes the nearest bin.
+
+        Parameters:
+        -----------
+        capture : np.ndarray
+            (2, num_samples) voltage/current record from chirp_sweep
+        frequencies : np.ndarray
+            Output frequencies in Hz, sorted ascending (e.g. planned_frequencies)
+        nperseg : int, optional
+            STFT segment length (default: a power of two giving bins of at most
+            a quarter of the lowest frequency)
+        overlap : float
+            Fraction of a segment shared with the next one
+
+        Returns:
+        --------
+        result : dict
+            'freq', 'z', 'v', 'i' and 'coherence' per output frequency (the
+            phasors are referenced to the current, whose magnitude is the RMS
+            STFT amplitude in the band), plus the frame-by-frame tracking
+            'time', 'f_inst' (strongest current bin) and 'z_inst'
+        """
+        if sample_rate is None:
+            sample_rate = self.sample_rate
+        frequencies = np.asarray(frequencies, dtype=float)
+        num_samples = capture.shape[1]
+        if nperseg is None:
+            nperseg = 2 ** int(np.ceil(np.log2(4 * sample_rate / frequencies[0])))
+        nperseg = int(min(nperseg, max(num_samples // 4, 16)))
+        f, t, spectra = signal.stft(np.asarray(capture, dtype=float), fs=sample_rate, nperseg=nperseg, noverlap=int(nperseg * overlap), boundary=None, padded=False)
+        v_tf, i_tf = spectra[0], spectra[1]
+
+        cross = np.sum(v_tf * np.conj(i_tf), axis=1)
+        auto_v = np.sum(np.abs(v_tf) ** 2, axis=1)
+        auto_i = np.sum(np.abs(i_tf) ** 2, axis=1)
+
+        log_f = np.log10(frequencies)
+        if len(frequencies) > 1:
+            edges = 10 ** np.concatenate([[1.5 * log_f[0] - 0.5 * log_f[1]], (log_f[:-1] + log_f[1:]) / 2, [1.5 * log_f[-1] - 0.5 * log_f[-2]]])
+        else:
+            edges = frequencies[0] * np.array([0.9, 1.1])
+        band = np.searchsorted(edges, f, side='right') - 1
+        inside = (band >= 0) & (band < len(frequencies))
+        counts = np.bincount(band[inside], minlength=len(frequencies))
+        band_cross = np.bincount(band[inside], weights=cross.real[inside], minlength=len(frequencies)) + 1j * np.bincount(band[inside], weights=cross.imag[inside], minlength=len(frequencies))
+        band_v = np.bincount(band[inside], weights=auto_v[inside], minlength=len(frequencies))
+        band_i = np.bincount(band[inside], weights=auto_i[inside], minlength=len(frequencies))
+        empty = counts == 0
+        if empty.any():
+            nearest = np.clip(np.round(frequencies[empty] / (f[1] - f[0])).astype(np.int64), 0, len(f) - 1)
+            band_cross[empty], band_v[empty], band_i[empty], counts[empty] = cross[nearest], auto_v[nearest], auto_i[nearest], 1
+
+        z = band_cross / band_i
+        i_band = np.sqrt(band_i / (counts * len(t))).astype(np.complex128)
+        coherence = np.abs(band_cross) ** 2 / (band_v * band_i)
+
+        # Frames before or after the sweep hold no excitation and give NaN/inf
+        strongest = 1 + np.argmax(np.abs(i_tf[1:]), axis=0)
+        frames = np.arange(len(t))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_inst = v_tf[strongest, frames] / i_tf[strongest, frames]
+        return {'freq': frequencies, 'z': z, 'v': z * i_band, 'i': i_band, 'coherence': coherence,
+                'time': t, 'f_inst': f[strongest], 'z_inst': z_inst}
+
     def find_zero_crossings(self, data):
         """Find zero crossing indices to get full cycles"""
         return np.where(np.diff(np.signbit(data)))[0]
@@ -336,8 +787,60 @@ class Background:
         
         return avg_v, avg_i        
 
-    def calculate_impedance(self, voltage, current, frequency):
-        """Calculate impedance using FFT"""
+    def spectrum_quality(self, samples, freq_idx, n_harmonics=5, guard=8):
+        """
+        Quality of one channel's capture around the excitation bin
+
+        Uses a Hann-windowed rFFT of the same samples as the phasor (bin
+        `freq_idx` is the same), since the leakage of the unwindowed FFT would
+        hide everything but the strongest spurs. The noise floor is the median
+        bin power, leaving out the DC bins and `guard` bins around the
+        fundamental and each harmonic, so isolated spurs do not raise it.
+        Everything else, including 50/60 Hz mains pickup, counts as a spur.
+        The resolution limit is the bin width fs/N (about 30 Hz for the usual
+        16384 samples at decimation 256): tones closer than about 2 bins to DC
+        or `guard` bins to the fundamental or a harmonic cannot be told apart
+        from them and are not reported.
+
+        Returns:
+        --------
+        snr_db : float
+            Fundamental power over the noise floor
+        thd : float
+            RMS of harmonics 2..n_harmonics (below Nyquist) relative to the
+            fundamental, each summed over its Hann main lobe
+        spur_dbc : float
+            Strongest bin outside the fundamental and harmonics (e.g. mains
+            pickup or a glitch), relative to the fundamental
+        """
+        power = np.abs(np.fft.rfft(samples * np.hanning(len(samples)))) ** 2
+        fundamental = power[freq_idx]
+        if freq_idx == 0 or fundamental == 0: return np.nan, np.nan, np.nan
+        # Fundamental and harmonics are measured alike: power summed over the Hann main lobe
+        # (+-2 bins) around h times the fundamental's fractional bin, found from the lobe centroid
+        lobe = np.arange(-2, 3); window = power[np.clip(freq_idx + lobe, 0, len(power) - 1)]
+        position = freq_idx + np.dot(lobe, window) / window.sum()
+        others = np.ones(len(power), dtype=bool); others[:self.DC_BINS] = False
+        fundamental_band, harmonic_power = window.sum(), 0.0
+        for h in range(1, n_harmonics + 1):
+            k = int(round(h * position))
+            if k + 2 >= len(power): break
+            others[max(k - guard, 0):k + guard + 1] = False
+            if h > 1: harmonic_power += power[k - 2:k + 3].sum()
+        thd = float(np.sqrt(harmonic_power / fundamental_band))
+        if not others.any(): return np.nan, thd, np.nan
+        snr_db = 10 * np.log10(fundamental / max(np.median(power[others]), 1e-300))
+        spur_dbc = 10 * np.log10(max(power[others].max(), 1e-300) / fundamental)
+        return float(snr_db), thd, float(spur_dbc)
+
+    def calculate_impedance(self, voltage, current, frequency, with_quality=False):
+        """
+        Calculate impedance using FFT
+
+        With `with_quality` a dict of spectrum_quality metrics for both channels
+        ('snr_v_db', 'thd_v', 'spur_v_dbc', 'snr_i_db', ...) is appended to the
+        returned tuple, computed from the same samples and excitation bin.
+        """
         sample_rate = 125e6 / self.decimation
         
         v_fft = np.fft.fft(voltage)
@@ -357,9 +860,80 @@ class Background:
         z_real = np.real(z)
         z_imag = np.imag(z)
         
+        if with_quality:
+            quality = {}
+            for name, samples in (('v', voltage), ('i', current)):
+                quality[f'snr_{name}_db'], quality[f'thd_{name}'], quality[f'spur_{name}_dbc'] = self.spectrum_quality(np.asarray(samples, dtype=float), freq_idx)
+            return z, z_magnitude, z_phase, z_real, z_imag, v_fft[freq_idx], i_fft[freq_idx], quality
         return z, z_magnitude, z_phase, z_real, z_imag, v_fft[freq_idx], i_fft[freq_idx]
+
+    def point_quality(self):
+        """
+        Quality of the last measure_impedance call: worst SNR/THD/spur over its
+        captures, the number of clipped captures and the SE of Z in percent
+        """
+        def worst(key, fn):
+            return float(fn([c[key] for c in self.quality_list])) if self.quality_list else np.nan
+        n = len(self.z_list)
+        se_z_pct = float(np.std(self.z_list, ddof=1) / np.sqrt(n) / np.abs(np.mean(self.z_list)) * 100) if n > 1 else np.nan
+        return {'averages': n, 'snr_v_db': worst('snr_v_db', np.min), 'snr_i_db': worst('snr_i_db', np.min), 'thd_v': worst('thd_v', np.max), 'thd_i': worst('thd_i', np.max),
+                'spur_dbc': max(worst('spur_v_dbc', np.max), worst('spur_i_dbc', np.max)), 'clipped': sum(any(c) for c in self.clip_list), 'se_z_pct': se_z_pct}
+
+    def quality_failures(self, quality=None):
+        """Reasons (short strings) why a point_quality() result misses the limits; empty when it passes"""
+        q = self.quality if quality is None else quality
+        failures = []
+        if q.get('clipped'): failures.append(f"clipped {q['clipped']}/{q['averages']}")
+        for ch in ('v', 'i'):
+            if q.get(f'snr_{ch}_db', np.inf) < self.min_snr_db: failures.append(f"SNR {ch.upper()} {q[f'snr_{ch}_db']:.1f} dB")
+            if q.get(f'thd_{ch}', 0) > self.max_thd: failures.append(f"THD {ch.upper()} {q[f'thd_{ch}'] * 100:.1f}%")
+        if q.get('spur_dbc', -np.inf) > self.max_spur_dbc: failures.append(f"spur {q['spur_dbc']:.1f} dBc")
+        if q.get('se_z_pct', 0) > self.max_se_pct: failures.append(f"SE Z {q['se_z_pct']:.2f}%")
+        return failures
     
-    def measure_impedance(self, frequency, num_averages=3):
+    def _select_acquisition_parameters(self, frequency):
+        """Decimation and buffer size used by measure_impedance and capture_impedance"""
+        if frequency < 1000:
+            print("Low frequency range detected. Using dynamic parameters.")
+            # สำหรับความถี่ต่ำ: คำนวณพารามิเตอร์แบบไดนามิก
+            self._calculate_acquisition_parameters(frequency)
+        else:
+            print("High frequency range detected. Using fixed parameters.")
+            # สำหรับความถี่สูง: ใช้ค่าคงที่ที่ทำงานได้ดี
+            self.decimation = 256
+            self.data_size = 1024 * 16
+            self.read_data_size = 1024 * 16
+            self.sample_rate = 125e6 / self.decimation
+
+    def capture_impedance(self, frequency):
+        """
+        Single capture at `frequency` with the generator left running
+
+        Unlike measure_impedance, the generator is only retuned when the
+        frequency changes (followed by wait_until_settled), so repeated captures
+        at a fixed frequency (monitoring) neither reset the output nor wait for
+        the coil to settle again.
+
+        Returns:
+        --------
+        z, v_fft, i_fft : complex
+            Impedance and the voltage/current phasors of this capture
+        """
+        switched = self.generator_frequency != frequency
+        self._select_acquisition_parameters(frequency)
+        self._ensure_signal(frequency)
+        if switched:
+            self.settle_captures = self.wait_until_settled(frequency)
+        self._setup_acquisition()
+        raw_voltage, raw_current = self._acquire_data(frequency, post_trigger_delay=0, retrigger=False)
+        if self.archive is not None:
+            self.archive.append(frequency, 0, raw_voltage, raw_current, self.sample_rate, self.decimation, trigger_pos=self.trigger_pos)
+        self.clip_list = [self.clipped(raw_voltage, raw_current)]
+        voltage, current = self.get_full_cycles(raw_voltage, raw_current)
+        z, _, _, _, _, v_fft, i_fft = self.calculate_impedance(voltage, current, frequency)
+        return z, v_fft, i_fft
+
+    def measure_impedance(self, frequency, num_averages=3, hot_switch=False, auto_range=False, se_target=None, min_averages=2):
         """
         Measure impedance at a specific frequency with averaging
         
@@ -369,6 +943,19 @@ class Background:
             Frequency in Hz to measure impedance at
         num_averages : int
             Number of measurements to average
+        hot_switch : bool
+            Keep the generator running and only retune it (SOUR1:FREQ:FIX), then
+            wait_until_settled once instead of resetting the generator and
+            sleeping after every trigger. Use one instance for the whole sweep.
+        auto_range : bool
+            Run auto_range first when the last ranging was more than
+            auto_range_span decades away (one probe series per sweep segment).
+            To keep the range across per-point instances copy input_gain,
+            amplitude and range_frequency to the next one.
+        se_target : float, optional
+            Stop averaging once the standard error of Z is below this
+            percentage of |Z| (after at least `min_averages` captures);
+            num_averages is then the maximum
             
         Returns:
         --------
@@ -384,32 +971,41 @@ class Background:
         self.i_list = []
         self.z_list = []
         self.timestamps = []
+        self.clip_list = []
+        self.quality_list = []
         
+        if hot_switch:
+            self._select_acquisition_parameters(frequency)
+            self._ensure_signal(frequency)
+            self.settle_captures = self.wait_until_settled(frequency)
+        if auto_range and self._range_due(frequency):
+            self.auto_range(frequency)
+
         # Run multiple measurements for averaging
         for avg in range(num_averages):
             print(f"\nMeasurement {avg+1} of {num_averages}")
 
-            if frequency < 1000:
-                print("Low frequency range detected. Using dynamic parameters.")
-                # สำหรับความถี่ต่ำ: คำนวณพารามิเตอร์แบบไดนามิก
-                self._calculate_acquisition_parameters(frequency)
-            else:
-                print("High frequency range detected. Using fixed parameters.")
-                # สำหรับความถี่สูง: ใช้ค่าคงที่ที่ทำงานได้ดี
-                self.decimation = 256
-                self.data_size = 1024 * 16
-                self.read_data_size = 1024 * 16
-                self.sample_rate = 125e6 / self.decimation                
+            if not hot_switch:
+                self._select_acquisition_parameters(frequency)
 
-            # Generate signal
-            self._generate_signal(frequency)
+                # Generate signal
+                self._generate_signal(frequency)
             
             # Setup acquisition
             self._setup_acquisition()
             
             # Acquire data
-            raw_voltage, raw_current = self._acquire_data(frequency)
+            raw_voltage, raw_current = self._acquire_data(frequency, post_trigger_delay=0 if hot_switch else None, retrigger=not hot_switch)
+
+            # Keep the raw capture when an archive is attached
+            if self.archive is not None:
+                self.archive.append(frequency, avg, raw_voltage, raw_current, self.sample_rate, self.decimation, trigger_pos=self.trigger_pos)
             
+            # Flag captures that hit the ADC range
+            self.clip_list.append(self.clipped(raw_voltage, raw_current))
+            if any(self.clip_list[-1]):
+                print(f"Warning: clipped capture at {frequency} Hz (V: {self.clip_list[-1][0]}, I: {self.clip_list[-1][1]})")
+
             # Process data
             voltage, current = self.get_full_cycles(raw_voltage, raw_current)
             
@@ -436,9 +1032,10 @@ class Background:
             plt.show()
             '''
 
-            # Calculate impedance
-            z, z_magnitude, z_phase, z_real, z_imag, v_fft, i_fft = self.calculate_impedance(
-                voltage, current, frequency)
+            # Calculate impedance and the spectrum quality of this capture
+            z, z_magnitude, z_phase, z_real, z_imag, v_fft, i_fft, quality = self.calculate_impedance(
+                voltage, current, frequency, with_quality=True)
+            self.quality_list.append(quality)
             
             # Store results
             timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
@@ -456,6 +1053,12 @@ class Background:
             print(f"Impedance Imaginary Part: {z_imag:f} ohm")
             print(f"Voltage (V): {v_fft} V")
             print(f"Current (I): {i_fft} V")
+
+            if se_target is not None and len(self.z_list) >= max(min_averages, 2):
+                se_z_pct = np.std(self.z_list, ddof=1) / np.sqrt(len(self.z_list)) / np.abs(np.mean(self.z_list)) * 100
+                if se_z_pct < se_target:
+                    print(f"SE Z = {se_z_pct:.3f}% < {se_target}% after {len(self.z_list)} averages, stopping early")
+                    break
         
         # Calculate averages
         avg_v = np.mean(self.v_list)
@@ -486,6 +1089,9 @@ class Background:
         print(f"SE Voltage = {se_v:.4g}  →  {se_v_pct:.2f}% ของค่าเฉลี่ย")
         print(f"SD Current: {np.std(self.i_list):f}") 
         print(f"Error Current: {np.std(self.i_list) / np.sqrt(len(self.i_list)):f}")
+        self.quality = self.point_quality()
+        failures = self.quality_failures()
+        print(f"SNR V/I: {self.quality['snr_v_db']:.1f}/{self.quality['snr_i_db']:.1f} dB, THD V/I: {self.quality['thd_v'] * 100:.2f}/{self.quality['thd_i'] * 100:.2f}%, Spur: {self.quality['spur_dbc']:.1f} dBc" + (f"  -> FAILED: {', '.join(failures)}" if failures else ""))
         
         return avg_z, z_magnitude_avg, z_phase_avg, z_real_avg, z_imag_avg, v_real_avg, v_imag_avg, i_real_avg, i_imag_avg
     
@@ -619,6 +1225,11 @@ class Background:
         
         print(f"Saving results to: {txt_file}")
         
+        with open(txt_file, "w", encoding="utf-8") as fp:
+            fp.write(self.format_results(frequency))
+
+    def format_results(self, frequency):
+        """Return the per-frequency text report written by save_results"""
         # Calculate average Z
         avg_z = np.mean(self.z_list)
         #avg_z = np.max(self.z_list)
@@ -637,33 +1248,41 @@ class Background:
         
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
         
-        with open(txt_file, "w", encoding="utf-8") as fp:
-            fp.write(f"Timestamp: {timestamp}\n")
-            fp.write(f"Frequency: {frequency} Hz\n")
-            fp.write(f"Impedance Magnitude: {z_magnitude_avg:f} ohm\n")
-            fp.write(f"Impedance Phase: {z_phase_avg:f} degrees\n")
-            fp.write(f"Impedance Real Part: {z_real_avg:f} ohm\n")
-            fp.write(f"Impedance Imaginary Part: {z_imag_avg:f} ohm\n")
-            fp.write(f"Average Voltage: {avg_voltage:f} V\n")
-            fp.write(f"Average Current: {avg_current:f} A\n")
-            fp.write(f"Standard Deviation Voltage: {std_voltage:f} V\n")
-            fp.write(f"Standard Deviation Current: {std_current:f} A\n")
-            fp.write(f"Error Voltage: {err_voltage:f} V\n")
-            fp.write(f"Error Current: {err_current:f} A\n\n")
-            
-            
-            fp.write("Individual Measurements:\n")
-            for idx, (timestamp, z) in enumerate(zip(self.timestamps, self.z_list)):
-                mag = np.abs(z)
-                phase = np.angle(z, deg=True)
-                real = np.real(z)
-                imag = np.imag(z)
-                fp.write(f"Run {idx+1} [{timestamp}]:\n")
-                fp.write(f"  |Z| = {mag:f} ohm, Phase = {phase:f}°\n")
-                fp.write(f"  Re(Z) = {real:f} ohm, Im(Z) = {imag:f} ohm\n")
-                fp.write(f"  Voltage (V): {self.v_list[idx]}\n")
-                fp.write(f"  Current (I): {self.i_list[idx]}\n")
-                fp.write("\n")               
+        lines = [
+            f"Timestamp: {timestamp}\n",
+            f"Frequency: {frequency} Hz\n",
+            f"Impedance Magnitude: {z_magnitude_avg:f} ohm\n",
+            f"Impedance Phase: {z_phase_avg:f} degrees\n",
+            f"Impedance Real Part: {z_real_avg:f} ohm\n",
+            f"Impedance Imaginary Part: {z_imag_avg:f} ohm\n",
+            f"Average Voltage: {avg_voltage:f} V\n",
+            f"Average Current: {avg_current:f} A\n",
+            f"Standard Deviation Voltage: {std_voltage:f} V\n",
+            f"Standard Deviation Current: {std_current:f} A\n",
+            f"Error Voltage: {err_voltage:f} V\n",
+            f"Error Current: {err_current:f} A\n",
+            f"Input Gain: {'/'.join(self.input_gain)}\n",
+            f"Generator Amplitude: {self.amplitude:f} V\n",
+            f"Clipped Captures: {sum(any(c) for c in self.clip_list)} of {len(self.z_list)}\n",
+            f"SNR Voltage/Current: {self.quality.get('snr_v_db', np.nan):.1f} / {self.quality.get('snr_i_db', np.nan):.1f} dB\n",
+            f"THD Voltage/Current: {self.quality.get('thd_v', np.nan) * 100:.3f} / {self.quality.get('thd_i', np.nan) * 100:.3f} %\n",
+            f"Worst Spur: {self.quality.get('spur_dbc', np.nan):.1f} dBc\n",
+            f"Quality: {'; '.join(self.quality_failures()) or 'OK'}\n\n",
+            "Individual Measurements:\n",
+        ]
+        for idx, (timestamp, z) in enumerate(zip(self.timestamps, self.z_list)):
+            mag = np.abs(z)
+            phase = np.angle(z, deg=True)
+            real = np.real(z)
+            imag = np.imag(z)
+            clip_note = " (clipped)" if idx < len(self.clip_list) and any(self.clip_list[idx]) else ""
+            lines.append(f"Run {idx+1} [{timestamp}]{clip_note}:\n")
+            lines.append(f"  |Z| = {mag:f} ohm, Phase = {phase:f}°\n")
+            lines.append(f"  Re(Z) = {real:f} ohm, Im(Z) = {imag:f} ohm\n")
+            lines.append(f"  Voltage (V): {self.v_list[idx]}\n")
+            lines.append(f"  Current (I): {self.i_list[idx]}\n")
+            lines.append("\n")
+        return "".join(lines)
     
     def close(self):
         """Close the connection to Red Pitaya"""
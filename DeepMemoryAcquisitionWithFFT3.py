@@ -1,175 +1,52 @@
 import time
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy import signal
-import tkinter as tk
 import os
-import rp_scpi as scpi
+from Background import Background
+from plot_lod import minmax_envelope
 
 IP = 'rp-f05577.local'
 #IP = 'rp-f09afa.local'          # local IP of Red Pitaya
-rp = scpi.scpi(IP)            # open socket connection with Red Pitaya
+analyzer = Background(IP)       # open socket connection with Red Pitaya
 
 
 ## Generate signal----------------------------------------------------
 wave_form = 'sine'
 freq = 500  # Set your desired frequency
 ampl = 0.5   # Set your desired amplitude
+analyzer.wave_form = wave_form
+analyzer.amplitude = ampl
+
+## Acquisition parameters-----------------------------------------------
+## size in samples 16Bit (set DATA_SIZE = None to stream the whole reserved memory per channel to disk)
+DATA_SIZE = 4096 * 16          # ((1024 * 1024 * 128) / 2)        ## for 128 MB ##
+READ_DATA_SIZE = 4096 * 16     # (1024 * 256)                     ## for 128 MB ##
+dec = 625
 
 average = 3
+PLOT_BUCKETS = 2000            # min/max pairs drawn per trace (the captures themselves stay on disk)
 v_list = []
 i_list = []
 z_list = []
 timestamps = []
 
 for avg in range(average):
-    rp.tx_txt('GEN:RST')
-
-    rp.tx_txt('SOUR1:FUNC ' + str(wave_form).upper())
-    rp.tx_txt('SOUR1:FREQ:FIX ' + str(freq))
-    rp.tx_txt('SOUR1:VOLT ' + str(ampl))
-
-    # Enable output
-    rp.tx_txt('OUTPUT1:STATE ON')
-    rp.tx_txt('SOUR1:TRig:INT')
-
-    print("Generate signal")
-
-    ## Acquisition parameters-----------------------------------------------
-    ## size in samples 16Bit
-    DATA_SIZE = 4096 * 16          # ((1024 * 1024 * 128) / 2)        ## for 128 MB ##
-    READ_DATA_SIZE = 4096 * 16     # (1024 * 256)                     ## for 128 MB ##
-
-    dec = 625
-    trig_lvl = 0
-
     print("Start program")
-    ## Reset Acquisition
-    rp.tx_txt('ACQ:RST')
-
-    # Get Memory region
-    start_address = int(rp.txrx_txt('ACQ:AXI:START?'))
-    size = int(rp.txrx_txt('ACQ:AXI:SIZE?'))
-    start_address2 = round(start_address + size/2)
-
-    print(start_address)
-    print(size)
-
-    print("start_address: ", start_address, "size: ", size, "Checked Address: ", bool(start_address/16777216), ", Check Size: ", bool(size/2097152))
-    print(f"Reserved memory Start: {start_address:x} Size: {size:x}, Check Reserved memory: {bool(start_address / 0x1000000):.2f}, Check Size: {bool(size / 0x200000):.2f}\n")
-
-    # Set decimation
-    rp.tx_txt(f"ACQ:AXI:DEC {dec}")
-
-    # Set units
-    rp.tx_txt('ACQ:AXI:DATA:Units VOLTS')
-
-    # Set trigger delay for both channels
-    rp.tx_txt(f"ACQ:AXI:SOUR1:Trig:Dly {DATA_SIZE}")
-    rp.tx_txt(f"ACQ:AXI:SOUR2:Trig:Dly {DATA_SIZE}")
-
-    # Set-up the Channel 1 and channel 2 buffers to each work with half the available memory space.
-    rp.tx_txt(f"ACQ:AXI:SOUR1:SET:Buffer {start_address},{size/2}")
-    rp.tx_txt(f"ACQ:AXI:SOUR2:SET:Buffer {start_address2},{size/2}")
-
-    # Enable DMA
-    rp.tx_txt('ACQ:AXI:SOUR1:ENable ON')
-    rp.tx_txt('ACQ:AXI:SOUR2:ENable ON')
-    print('Enable CHA and CHB\n')
-
-    # Specify the acquisition trigger
-    rp.tx_txt(f"ACQ:TRig:LEV {trig_lvl}")
-
-
-    ## ACQUISITION
-
-    rp.tx_txt('ACQ:START')
-    rp.tx_txt('ACQ:TRig CH1_PE')
-
-
-    print("Waiting for trigger\n")
-
-    # Wait for trigger
-    while 1:
-        rp.tx_txt("ACQ:TRig:STAT?")
-        if rp.rx_txt() == 'TD':
-            print("Triggered")
-            time.sleep(0.5)
-            break
-
-    # wait for fill adc buffer
-    while 1:
-        rp.tx_txt('ACQ:AXI:SOUR1:TRig:FILL?')
-        if rp.rx_txt() == '1':
-            print('DMA buffer full\n')
-            break
-
-    # Stop Acquisition
-    rp.tx_txt('ACQ:STOP')
-
-    ## Get write pointer at trigger location
-    posChA = int(rp.txrx_txt('ACQ:AXI:SOUR1:Trig:Pos?'))
-    posChB = int(rp.txrx_txt('ACQ:AXI:SOUR2:Trig:Pos?'))
-    print(posChA, posChB)
-
-    ## Read & plot
-
-    rp.tx_txt(f"ACQ:AXI:SOUR1:DATA:Start:N? {posChA},{READ_DATA_SIZE}")
-    signal_str = rp.rx_txt()
-    rp.tx_txt(f"ACQ:AXI:SOUR2:DATA:Start:N? {posChB},{READ_DATA_SIZE}")
-    signal_str2 = rp.rx_txt()
-
+    capture = analyzer.deep_capture(freq, num_samples=DATA_SIZE, decimation=dec, chunk_size=READ_DATA_SIZE,
+                                    filename=f"deep_capture_f{freq}_dec{dec}_run{avg + 1}.dat")
+    sample_rate = analyzer.sample_rate
     print("Data Acquired\n")
 
-    buff1 = list(map(float, signal_str.strip('{}\n\r').replace("  ", "").split(',')))
-    buff2 = list(map(float, signal_str2.strip('{}\n\r').replace("  ", "").split(',')))
-
-    ## Acquisition and Processing Functions
-    def find_zero_crossings(data):
-        """Find zero crossing indices to get full cycles"""
-        return np.where(np.diff(np.signbit(data)))[0]
-
-    def get_full_cycles(voltage, current, sample_rate):
-        """Extract full cycles from the signals"""
-        zero_crossings = find_zero_crossings(voltage)
-        if len(zero_crossings) < 2:
-            return voltage, current
-        
-        # Get complete cycles
-        start_idx = zero_crossings[0]
-        end_idx = zero_crossings[-1]
-        if (end_idx - start_idx) % 2 != 0:  # Ensure we have complete cycles
-            end_idx = zero_crossings[-2]
-            
-        return voltage[start_idx:end_idx], current[start_idx:end_idx]
-
-    def calculate_impedance(voltage, current, freq):
-        """Calculate impedance using FFT"""
-        v_fft = np.fft.fft(voltage)
-        i_fft = np.fft.fft(current)
-        
-        # Find frequency index
-        freq_idx = int(len(v_fft) * freq / sample_rate)
-        
-        # Calculate impedance at the fundamental frequency
-        z = v_fft[freq_idx] / i_fft[freq_idx]
-        z_magnitude = np.abs(z)
-        z_phase = np.angle(z, deg=True)
-        z_real = np.real(z)
-        z_imag = np.imag(z)
-        print(f"Complex Voltage (V): {v_fft[freq_idx]}")
-        print(f"Complex Current (I): {i_fft[freq_idx]}")
-        print(f"Complex Impedance (Z): {z}")
-        return z, z_magnitude, z_phase, z_real, z_imag
-
-    # Modify sampling rate based on decimation
-    sample_rate = 125e6 / dec  # Red Pitaya's base sample rate is 125 MHz
-
-    # After acquiring data and converting to buff1 (voltage) and buff2 (current)
-    voltage, current = get_full_cycles(np.array(buff1), np.array(buff2), sample_rate)
-
-    # Calculate impedance
-    z, z_magnitude, z_phase, z_real, z_imag = calculate_impedance(voltage, current, freq)
+    # Block-wise phasors over the whole capture (reads the memmap one block at a time)
+    result = analyzer.process_deep_capture(capture, freq)
+    z = result['z_mean']
+    z_magnitude = np.abs(z)
+    z_phase = np.angle(z, deg=True)
+    z_real = np.real(z)
+    z_imag = np.imag(z)
+    print(f"Complex Voltage (V): {np.mean(result['v'])}")
+    print(f"Complex Current (I): {np.mean(result['i'])}")
+    print(f"Complex Impedance (Z): {z}")
 
     ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
     print(f"Timestamp: {ts}")
@@ -179,7 +56,14 @@ for avg in range(average):
     print(f"Impedance Real Part: {z_real:.2f} ohm") 
     print(f"Impedance Imaginary Part: {z_imag:.2f} ohm")
 
-
+    # Keep only the full cycles of the waveform, located from the first and last few periods;
+    # voltage/current stay views into the memmap, so nothing is loaded in full
+    span = min(int(3 * sample_rate / freq), capture.shape[1])
+    head = analyzer.find_zero_crossings(np.asarray(capture[0, :span]))
+    tail = analyzer.find_zero_crossings(np.asarray(capture[0, -span:]))
+    start = head[0] if len(head) else 0
+    end = capture.shape[1] - span + tail[-1] if len(tail) else capture.shape[1]
+    voltage, current = capture[0, start:end], capture[1, start:end]
 
     v_list.append(voltage)
     i_list.append(current)
@@ -219,17 +103,18 @@ screen_dpi = plt.rcParams['figure.dpi']
 fig = plt.figure(figsize=(12, 7))
 
 # Plot subplots for each measurement run
-for i, (v, i, z) in enumerate(zip(v_list, i_list, z_list)):
-    # Create time axis for this dataset
-    time_axis = np.arange(len(v)) / sample_rate
-    
+for n, (v, i, z) in enumerate(zip(v_list, i_list, z_list)):
+    # Min/max envelope per bucket instead of every sample
+    v_idx, v_env = minmax_envelope(v, PLOT_BUCKETS)
+    i_idx, i_env = minmax_envelope(i, PLOT_BUCKETS)
+
     # Plot voltage
     plt.subplot(3, 1, 1)
-    plt.plot(time_axis, v, label=f'Run {i+1}', alpha=0.7)
+    plt.plot(v_idx / sample_rate, v_env, label=f'Run {n+1}', alpha=0.7)
     
     # Plot current
     plt.subplot(3, 1, 2)
-    plt.plot(time_axis, i, label=f'Run {i+1}', alpha=0.7)
+    plt.plot(i_idx / sample_rate, i_env, label=f'Run {n+1}', alpha=0.7)
 
 plt.subplot(3, 1, 1)
 plt.title('Voltage Measurements')
@@ -305,10 +190,7 @@ with open(txt_file, "w", encoding="utf-8") as fp:
     fp.write(f"Average Impedance: {avg_impedance:f} ohm\n")
     fp.write("\n")
 
-# Move this code outside the loop:
-rp.tx_txt('ACQ:AXI:SOUR1:ENable OFF')
-rp.tx_txt('ACQ:AXI:SOUR2:ENable OFF')
 print('Releasing resources\n')
 print("End program")
-rp.close()
+analyzer.close()
 
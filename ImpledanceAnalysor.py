@@ -4,14 +4,23 @@ import tkinter
 from tkinter import filedialog, messagebox
 import customtkinter as ctk
 import os
+import json
 import time
 import numpy as np
 from datetime import datetime
 import pandas as pd
 from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import re # เพิ่ม import สำหรับ regular expression
 
+from measurement_catalog import MeasurementCatalog, TimestampIndex, DatasetCache
+from mpt_analysis import CALIBRATION_CACHE_DIRNAME, EIGENVALUE_COLUMNS, CalibrationCache, CalibrationEngine, LiveCalibration, MPTCalculator, calibrated_filename, label_from_path, update_cube, write_eigenvalue_csv
+from plot_lod import LineLOD
+from monitoring import MONITOR_COLUMNS, MONITOR_FILENAME, MonitorBuffer
+from spectral_index import SpectralIndex, frame_spectrum, results_spectrum
+from sweep_storage import BufferedCsvWriter, RawWaveformArchive, SweepWriter, QUALITY_COLUMNS, SUMMARY_COLUMNS, planned_frequencies, missing_frequencies, find_incomplete_run, read_completed_frequencies
+
 import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
@@ -39,77 +48,184 @@ class ToolTip(object):
 
 # --- คลาสสำหรับ Thread การวัด ---
 class MeasurementThread(Thread):
+    chirp_duration = 2.0
     def __init__(self, params, app_callback):
         super().__init__(); self.params = params; self.app_callback = app_callback; self.stop_event = Event()
     def run(self):
-        base_results_dir = self.params['output_path']; raw_freq_data_dir = os.path.join(base_results_dir, "raw_freq_data"); summary_filename = os.path.join(base_results_dir, "summary_results.csv")
-        os.makedirs(raw_freq_data_dir, exist_ok=True); self.app_callback('log', f"สร้างโฟลเดอร์สำหรับผลลัพธ์ที่: {base_results_dir}")
-        with open(summary_filename, 'w') as summary_file: summary_file.write("Timestamp,Frequency,Z_Magnitude,Z_Phase,Z_Real,Z_Imaginary,Voltage_Real,Voltage_Imaginary,Current_Real,Current_Imaginary\n")
-        self.app_callback('log', f"สร้างไฟล์สรุป: {summary_filename}"); frequencies = np.logspace(np.log10(self.params['min_freq']), np.log10(self.params['max_freq']), self.params['num_points']); ts_start = datetime.now()
-        for i, frequency in enumerate(frequencies):
-            if self.stop_event.is_set(): self.app_callback('cancelled', {}); return
-            try:
-                analyzer = Background(); z, z_mag, z_phase, z_real, z_imag, v_real, v_imag, i_real, i_imag = analyzer.measure_impedance(frequency, self.params['averages'])
-                analyzer.save_results(frequency, results_dir=raw_freq_data_dir, base_name=f"measurement_f_{frequency:.2f}", file_extension=".txt"); analyzer.close(); timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                with open(summary_filename, 'a') as summary_file: summary_file.write(f"{timestamp},{frequency},{z_mag},{z_phase},{z_real},{z_imag},{v_real},{v_imag},{i_real},{i_imag}\n")
-                elapsed = (datetime.now() - ts_start).total_seconds(); progress = (i + 1) / len(frequencies); eta = (elapsed / progress) - elapsed if progress > 0 else 0
-                update_data = {'progress': progress, 'status': f"วัดที่ความถี่: {frequency:.1f} Hz ({i+1}/{len(frequencies)})", 'eta': eta, 'point_data': {'freq': frequency, 'z_real': z_real, 'z_imag': z_imag}}
-                self.app_callback('update', update_data)
-            except Exception as e: self.app_callback('error', {'error': f"เกิดข้อผิดพลาดที่ {frequency:.1f} Hz: {e}"})
+        base_results_dir = self.params['output_path']; sweep_params = {k: self.params[k] for k in ('min_freq', 'max_freq', 'num_points', 'averages')}
+        if self.params.get('chirp'): sweep_params['chirp_duration'] = self.chirp_duration
+        writer = SweepWriter(base_results_dir, params=sweep_params, resume=self.params.get('resume', False), columnar=self.params.get('columnar', False)); summary_filename = writer.summary_path
+        self.app_callback('log', f"สร้างโฟลเดอร์สำหรับผลลัพธ์ที่: {base_results_dir}")
+        self.app_callback('log', f"สร้างไฟล์สรุป: {summary_filename}"); frequencies = planned_frequencies(self.params); ts_start = datetime.now()
+        done_rows = list(writer.rows); to_measure = missing_frequencies(frequencies, [row['Frequency'] for row in done_rows])
+        if done_rows:
+            self.app_callback('log', f"วัดต่อจากเดิม: มีอยู่แล้ว {len(done_rows)} จุด, เหลือ {len(to_measure)} จุด")
+        calibration = None
+        if self.params.get('calibrator'):
+            try: calibration = self.params['calibrator']()
+            except Exception as e: self.app_callback('log', f"เตรียม Calibrate ระหว่างวัดไม่สำเร็จ: {e}")
+            self.app_callback('live_calibration', calibration)
+        if done_rows:
+            for row in done_rows: self.app_callback('update', {'progress': len(done_rows) / len(frequencies), 'status': f"โหลดจุดเดิม: {row['Frequency']:.1f} Hz", 'eta': 0, 'point_data': self._point_data(calibration, row['Frequency'], row['Z_Real'], row['Z_Imaginary'])})
+        archive = RawWaveformArchive(os.path.join(base_results_dir, "raw_waveforms.npz"), mode='a') if self.params.get('archive_raw') else None
+        if archive: self.app_callback('log', f"เก็บ Raw waveform ที่: {archive.path}")
+        status = 'interrupted'; hot_switch = self.params.get('hot_switch', False); shared = None; self._ranging = None
+        try:
+            if self.params.get('chirp'):
+                try: self._run_chirp(writer, frequencies, calibration)
+                except Exception as e: self.app_callback('error', {'error': f"สแกนแบบ chirp ไม่สำเร็จ: {e}"}); return
+            else:
+                # hot switch: Background ตัวเดียวทั้ง sweep ให้ Generator ทำงานต่อเนื่องและเปลี่ยนแค่ความถี่
+                if hot_switch: shared = Background(); shared.archive = archive; self.app_callback('log', "โหมดสลับความถี่โดยไม่รีเซ็ต Generator (ตรวจจับการ settle อัตโนมัติ)")
+                retry = {}
+                for i, frequency in enumerate(to_measure):
+                    if self.stop_event.is_set(): status = 'cancelled'; self.app_callback('cancelled', {}); return
+                    try:
+                        row, report, quality, failures, n_avg = self._measure_point(frequency, shared, archive)
+                        writer.add_point(row, report=report, report_name=f"measurement_f_{frequency:.2f}.txt"); writer.add_quality(self._quality_row(row, quality, 1, failures))
+                        if failures: retry[frequency] = failures; self.app_callback('log', f"จุด {frequency:.1f} Hz ไม่ผ่านเกณฑ์คุณภาพ: {', '.join(failures)}")
+                        elapsed = (datetime.now() - ts_start).total_seconds(); progress = (len(done_rows) + i + 1) / len(frequencies); eta = elapsed / (i + 1) * (len(to_measure) - i - 1)
+                        update_data = {'progress': progress, 'status': f"วัดที่ความถี่: {frequency:.1f} Hz ({len(done_rows)+i+1}/{len(frequencies)}, เฉลี่ย {n_avg} ครั้ง)", 'eta': eta, 'point_data': self._point_data(calibration, frequency, row['Z_Real'], row['Z_Imaginary'])}
+                        self.app_callback('update', update_data)
+                    except Exception as e: self.app_callback('error', {'error': f"เกิดข้อผิดพลาดที่ {frequency:.1f} Hz: {e}"})
+                if retry and self.params.get('remeasure'):
+                    # วัดซ้ำเฉพาะจุดที่ไม่ผ่านเกณฑ์ แทนที่จะวัดใหม่ทั้ง Sweep
+                    self.app_callback('log', f"วัดซ้ำ {len(retry)} จุดที่ไม่ผ่านเกณฑ์คุณภาพ")
+                    for n, (frequency, old_failures) in enumerate(retry.items()):
+                        if self.stop_event.is_set(): status = 'cancelled'; self.app_callback('cancelled', {}); return
+                        try:
+                            row, report, quality, failures, n_avg = self._measure_point(frequency, shared, archive); writer.add_quality(self._quality_row(row, quality, 2, failures))
+                            replace = len(failures) < len(old_failures)
+                            if replace: writer.replace_point(row, report=report, report_name=f"measurement_f_{frequency:.2f}.txt")
+                            self.app_callback('log', f"วัดซ้ำ {frequency:.1f} Hz: " + ("ผ่านเกณฑ์" if not failures else ', '.join(failures)) + (" (ใช้ค่าใหม่)" if replace else " (คงค่าเดิม)"))
+                            point_data = dict(self._point_data(calibration, frequency, row['Z_Real'], row['Z_Imaginary']), replace=True) if replace else None
+                            self.app_callback('update', {'progress': (n + 1) / len(retry), 'status': f"วัดซ้ำ: {frequency:.1f} Hz ({n+1}/{len(retry)})", 'eta': 0, 'point_data': point_data})
+                        except Exception as e: self.app_callback('error', {'error': f"วัดซ้ำที่ {frequency:.1f} Hz ไม่สำเร็จ: {e}"})
+            # จุดที่วัดไม่สำเร็จ (เช่น การเชื่อมต่อหลุด) ทำให้ sweep ยังไม่ครบ จึงต้องเปิดให้วัดต่อได้
+            missing = missing_frequencies(frequencies, [row['Frequency'] for row in writer.rows])
+            status = 'incomplete' if missing else 'complete'
+            if missing: self.app_callback('log', f"Sweep ไม่ครบ: ขาด {len(missing)} จุด สามารถวัดต่อจากโฟลเดอร์นี้ได้")
+        finally:
+            writer.close(status=status)
+            if shared: shared.close()
+            if archive: archive.close()
+        if calibration and status == 'complete':
+            try: calibrated_path = calibration.write(summary_filename); self.app_callback('log', f"บันทึกไฟล์ Calibrated แล้ว: {calibrated_path}")
+            except Exception as e: calibrated_path = None; self.app_callback('log', f"ไม่สามารถบันทึกไฟล์ Calibrated: {e}")
+            # ให้ mpt_cube.npy ของโลหะนี้มีผลล่าสุดทันที ไม่ต้องรอ batch_pipeline
+            if calibrated_path:
+                try: update_cube(calibrated_path)
+                except Exception as e: self.app_callback('log', f"ไม่สามารถอัปเดต MPT cube: {e}")
         self.app_callback('finished', {'summary_path': summary_filename})
+    def _run_chirp(self, writer, frequencies, calibration):
+        """Screening sweep: one chirp capture of the whole band, then one summary row per planned frequency"""
+        capture_path = os.path.join(self.params['output_path'], "chirp_capture.dat"); analyzer = Background()
+        self.app_callback('log', f"สแกนเร็วแบบ chirp {self.params['min_freq']:g}-{self.params['max_freq']:g} Hz ({self.chirp_duration:g} วินาที) บันทึกสัญญาณที่: {capture_path}")
+        try: capture = analyzer.chirp_sweep(self.params['min_freq'], self.params['max_freq'], self.chirp_duration, filename=capture_path); result = analyzer.process_chirp_capture(capture, frequencies)
+        finally: analyzer.close()
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S"); low_coherence = int(np.sum(result['coherence'] < 0.9))
+        for n, (frequency, z, v, i) in enumerate(zip(frequencies, result['z'], result['v'], result['i'])):
+            writer.add_point(dict(zip(SUMMARY_COLUMNS, [timestamp, frequency, abs(z), np.angle(z, deg=True), z.real, z.imag, v.real, v.imag, i.real, i.imag])))
+            self.app_callback('update', {'progress': (n + 1) / len(frequencies), 'status': f"ผลสแกน chirp: {frequency:.1f} Hz ({n+1}/{len(frequencies)})", 'eta': 0, 'point_data': self._point_data(calibration, frequency, z.real, z.imag)})
+        if low_coherence: self.app_callback('log', f"คำเตือน: {low_coherence} จุดมี coherence < 0.9 ควรวัดซ้ำแบบปกติ")
+    def _measure_point(self, frequency, shared, archive):
+        """One averaged measurement; returns (summary row, report, quality, failed checks, averages used)"""
+        analyzer = None
+        try:
+            analyzer = shared or Background(); analyzer.archive = archive
+            # ค่า Gain/Amplitude จากการ auto-range ส่งต่อไปยัง Background ตัวใหม่ของจุดถัดไป
+            if self._ranging and not shared: analyzer.input_gain, analyzer.amplitude, analyzer.range_frequency = self._ranging
+            z, z_mag, z_phase, z_real, z_imag, v_real, v_imag, i_real, i_imag = analyzer.measure_impedance(frequency, self.params['averages'], hot_switch=self.params.get('hot_switch', False), auto_range=self.params.get('auto_range', False), se_target=self.params.get('se_target'))
+            if self.params.get('auto_range'): self._ranging = (list(analyzer.input_gain), analyzer.amplitude, analyzer.range_frequency)
+            n_clipped = sum(any(c) for c in analyzer.clip_list)
+            if n_clipped: self.app_callback('log', f"คำเตือน: สัญญาณถูกตัด (clipping) {n_clipped}/{len(analyzer.z_list)} ครั้งที่ {frequency:.1f} Hz")
+            report = analyzer.format_results(frequency); timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            row = dict(zip(SUMMARY_COLUMNS, [timestamp, frequency, z_mag, z_phase, z_real, z_imag, v_real, v_imag, i_real, i_imag]))
+            return row, report, analyzer.quality, analyzer.quality_failures(), len(analyzer.z_list)
+        finally:
+            if not shared and analyzer is not None: analyzer.close()
+    def _quality_row(self, row, quality, attempt, failures):
+        values = [quality.get(k, np.nan) for k in ('averages', 'snr_v_db', 'snr_i_db', 'thd_v', 'thd_i', 'spur_dbc', 'clipped', 'se_z_pct')]
+        return dict(zip(QUALITY_COLUMNS, [row['Timestamp'], row['Frequency'], attempt] + values + ['; '.join(failures) or 'ok']))
+    def _point_data(self, calibration, freq, z_real, z_imag):
+        point = {'freq': freq, 'z_real': z_real, 'z_imag': z_imag}
+        if calibration: z_cal = calibration.calibrate(freq, complex(z_real, z_imag)); point['cal_real'], point['cal_imag'] = z_cal.real, z_cal.imag
+        return point
     def stop(self): self.stop_event.set()
 
-# --- คลาสสำหรับคำนวณ MPT และ Eigenvalues ---
-class MPTCalculator:
-    def __init__(self):
-        C0, C1, C2, C3 = (0.927050983124842272, 1.330586997335501411, 2.152934986677507057, 2.427050983124842272)
-        self.H16 = np.array([[C2,C1,0],[1.5,1.5,1.5],[0,C0,C3],[-C1,0,C2],[-1.5,-1.5,1.5],[-C0,-C3,0],[0,-C2,-C1],[1.5,-1.5,-1.5],[C3,0,-C0],[C3,0,C0],[C1,0,C2],[0,-C0,C3],[0,-C2,C1],[C0,-C3,0],[C2,-C1,0],[1.5,-1.5,1.5]])
-    def calculate_eigenvalues(self, calibrated_data):
-        if len(calibrated_data) < 6: raise ValueError("ต้องมีข้อมูลอย่างน้อย 6 ทิศทางในการคำนวณ")
-        selected_dirs = sorted(list(calibrated_data.keys())); dir_indices = [d - 1 for d in selected_dirs]
-        h_selected = self.H16[dir_indices]; h_norm = h_selected / np.linalg.norm(h_selected, axis=1, keepdims=True)
-        A = np.array([[h[0]**2, 2*h[0]*h[1], 2*h[0]*h[2], h[1]**2, 2*h[1]*h[2], h[2]**2] for h in h_norm])
-        freqs = calibrated_data[selected_dirs[0]]['Frequency'].values; num_freqs = len(freqs)
-        V = np.zeros((num_freqs, len(selected_dirs)), dtype=np.complex128)
-        for i, direction in enumerate(selected_dirs):
-            df = calibrated_data[direction]
-            V[:, i] = df['Z_Calibrated_Real'].values + 1j * df['Z_Calibrated_Imag'].values
-        eig1, eig2, eig3 = [], [], []
-        for i in range(num_freqs):
-            m, *_ = np.linalg.lstsq(A, V[i].reshape(-1, 1), rcond=None)
-            M = np.array([[m[0,0],m[1,0],m[2,0]],[m[1,0],m[3,0],m[4,0]],[m[2,0],m[4,0],m[5,0]]], dtype=np.complex128)
-            ev_sorted = sorted(np.linalg.eigvals(M), key=lambda x: x.real)
-            eig1.append(ev_sorted[0]); eig2.append(ev_sorted[1]); eig3.append(ev_sorted[2])
-        eig1, eig2, eig3 = np.array(eig1), np.array(eig2), np.array(eig3)
-        return {'freq': freqs, 'eig1_real': eig1.real, 'eig1_imag': eig1.imag, 'eig2_real': eig2.real, 'eig2_imag': eig2.imag, 'eig3_real': eig3.real, 'eig3_imag': eig3.imag}
+class MonitorThread(Thread):
+    """Capture repeatedly at fixed frequencies until stopped, keeping the generator running; each value is one 'monitor' event"""
+    max_consecutive_failures = 5
+    def __init__(self, params, app_callback):
+        super().__init__(); self.params = params; self.app_callback = app_callback; self.stop_event = Event()
+    def run(self):
+        run_dir = self.params['output_path']; frequencies = self.params['frequencies']; averages = self.params['averages']; os.makedirs(run_dir, exist_ok=True)
+        with open(os.path.join(run_dir, "monitor_params.json"), 'w', encoding='utf-8') as fp: json.dump({'frequencies': frequencies, 'averages': averages, 'started': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}, fp, indent=2)
+        writer = BufferedCsvWriter(os.path.join(run_dir, MONITOR_FILENAME), MONITOR_COLUMNS); analyzer = None; error = None; failures = 0; t0 = time.monotonic()
+        self.app_callback('log', f"เริ่มติดตามค่าที่ {', '.join(f'{f:g}' for f in frequencies)} Hz บันทึกที่: {writer.path}")
+        try:
+            analyzer = Background()
+            while not self.stop_event.is_set():
+                for k, frequency in enumerate(frequencies):
+                    if self.stop_event.is_set(): break
+                    try: captures = [analyzer.capture_impedance(frequency) for _ in range(averages)]; failures = 0
+                    except Exception as e:
+                        failures += 1; self.app_callback('log', f"วัดไม่สำเร็จที่ {frequency:.1f} Hz: {e}")
+                        if failures >= self.max_consecutive_failures: raise RuntimeError(f"วัดไม่สำเร็จติดต่อกัน {failures} ครั้ง: {e}")
+                        continue
+                    z, v, i = (complex(np.mean([c[n] for c in captures])) for n in range(3)); elapsed = time.monotonic() - t0
+                    writer.write_row(dict(zip(MONITOR_COLUMNS, [datetime.now().strftime("%Y-%m-%d %H:%M:%S"), f"{elapsed:.3f}", frequency, z.real, z.imag, abs(z), np.angle(z, deg=True), v.real, v.imag, i.real, i.imag])))
+                    self.app_callback('monitor', {'k': k, 't': elapsed, 'z': z})
+        except Exception as e: error = str(e)
+        finally:
+            writer.close()
+            if analyzer is not None: analyzer.close()
+        self.app_callback('monitor_stopped', {'path': writer.path, 'error': error})
+    def stop(self): self.stop_event.set()
 
 # --- คลาสหลักของแอปพลิเคชัน ---
 class SweepApp(ctk.CTk):
+    live_plot_max_fps = 15
+
     def __init__(self):
         super().__init__()
         self.title("Impedance Analyser (v3.0 - Final)"); self.geometry("1400x850"); ctk.set_appearance_mode("System"); ctk.set_default_color_theme("blue")
         self.grid_columnconfigure(0, weight=3); self.grid_columnconfigure(1, weight=1); self.grid_rowconfigure(0, weight=1)
-        self.measurement_thread = None; self.data_points = []; self.current_results_dir = None
+        self.measurement_thread = None; self.current_results_dir = None
+        self._live_background = None; self._live_flush_id = None; self._live_last_draw = 0.0; self._reset_live_buffers()
         self.loaded_data_compare = {}; self.compare_select_all_var = tkinter.IntVar(value=0)
         self.loaded_data_calc = {}; self.calc_select_all_var = tkinter.IntVar(value=0)
         self.calc_results_cache = {}
+        self.catalog = None; self.timestamp_index = TimestampIndex("Measurement_Data"); self.dataset_cache = DatasetCache(); self.calibration_engine = CalibrationEngine(loader=self.dataset_cache.get, cache=CalibrationCache(os.path.join("Measurement_Data", CALIBRATION_CACHE_DIRNAME)))
+        self.calc_executor = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 2), thread_name_prefix="calibration"); self._calc_jobs = {'generation': 0, 'futures': {}, 'total': 0, 'done': 0}; self._calc_last_selected = None
+        self.load_executor = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 4), thread_name_prefix="dataset-load"); self._dataset_load = {tab: {'total': 0, 'done': 0, 'failed': 0, 'pending': set()} for tab in ('compare', 'calc')}; self._pending_redraws = {}; self._plot_lines = {'compare': {}, 'calc': {}, 'mpt': {}}
         self.mpt_calculator = MPTCalculator()
         self.mpt_samples = {}
         self.mpt_plot_options = {}
         self.color_cycle = plt.rcParams['axes.prop_cycle'].by_key()['color']
         self.compare_plot_type_var = tkinter.StringVar(value="แสดงทั้งหมด (Both)"); self.compare_metal_filter_var = tkinter.StringVar(value="All Metals"); self.compare_direction_filter_var = tkinter.StringVar(value="All Directions")
         self.calc_plot_type_var = tkinter.StringVar(value="แสดงทั้งหมด (Both)"); self.calc_metal_filter_var = tkinter.StringVar(value="All Metals"); self.calc_direction_filter_var = tkinter.StringVar(value="All Directions")
+        self.calc_match_mode_var = tkinter.StringVar(value="ใกล้ที่สุด (Nearest)"); self._calc_match_constraints = (False, None)
         self.metal_types = ["Aluminum", "Copper", "Brass"]
-        self.create_main_layout()
+        self.create_main_layout(); self.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self._plot_lod = {'compare': LineLOD(self.ax_compare), 'calc': LineLOD(self.ax_calc), 'mpt': LineLOD(self.ax_mpt)}
+
+    def on_closing(self):
+        self.load_executor.shutdown(wait=False, cancel_futures=True); self.calc_executor.shutdown(wait=False, cancel_futures=True)
+        if self.measurement_thread and self.measurement_thread.is_alive(): self.measurement_thread.stop()
+        if self.monitor_thread and self.monitor_thread.is_alive(): self.monitor_thread.stop()
+        self.destroy()
 
     def create_main_layout(self):
         self.tab_view = ctk.CTkTabview(self, corner_radius=10); self.tab_view.grid(row=0, column=0, padx=10, pady=10, sticky="nswe")
         self.live_tab = self.tab_view.add("🔴 Live Measurement")
+        self.monitor_tab = self.tab_view.add("📈 Monitoring")
         self.compare_tab = self.tab_view.add("📊 Compare Results")
         self.calc_tab = self.tab_view.add("🔬 Calculation")
         self.mpt_tab = self.tab_view.add("🧬 Eigenvalue Analysis")
         self.create_log_sidebar()
         self.create_live_measurement_tab()
+        self.create_monitor_tab()
         self.create_comparison_tab()
         self.create_calculation_tab()
         self.create_mpt_tab()
@@ -149,7 +265,17 @@ class SweepApp(ctk.CTk):
         ctk.CTkLabel(scrollable_params_frame, text="ความถี่เริ่มต้น (Hz):").pack(anchor="w", padx=10); self.min_freq_entry = ctk.CTkEntry(scrollable_params_frame, placeholder_text="เช่น 100"); self.min_freq_entry.insert(0, "100"); self.min_freq_entry.pack(fill="x", padx=10)
         ctk.CTkLabel(scrollable_params_frame, text="ความถี่สิ้นสุด (Hz):").pack(anchor="w", padx=10, pady=(5,0)); self.max_freq_entry = ctk.CTkEntry(scrollable_params_frame, placeholder_text="เช่น 100000"); self.max_freq_entry.insert(0, "100000"); self.max_freq_entry.pack(fill="x", padx=10)
         ctk.CTkLabel(scrollable_params_frame, text="จำนวนจุดวัด:").pack(anchor="w", padx=10, pady=(5,0)); self.num_points_entry = ctk.CTkEntry(scrollable_params_frame, placeholder_text="เช่น 30"); self.num_points_entry.insert(0, "30"); self.num_points_entry.pack(fill="x", padx=10)
-        ctk.CTkLabel(scrollable_params_frame, text="จำนวนครั้งเฉลี่ยต่อจุด:").pack(anchor="w", padx=10, pady=(5,0)); self.averages_entry = ctk.CTkEntry(scrollable_params_frame, placeholder_text="เช่น 5"); self.averages_entry.insert(0, "5"); self.averages_entry.pack(fill="x", padx=10, pady=(0, 15))
+        ctk.CTkLabel(scrollable_params_frame, text="จำนวนครั้งเฉลี่ยต่อจุด:").pack(anchor="w", padx=10, pady=(5,0)); self.averages_entry = ctk.CTkEntry(scrollable_params_frame, placeholder_text="เช่น 5"); self.averages_entry.insert(0, "5"); self.averages_entry.pack(fill="x", padx=10)
+        ctk.CTkLabel(scrollable_params_frame, text="SE เป้าหมาย (% ของ |Z|, เว้นว่าง = เฉลี่ยครบทุกครั้ง):").pack(anchor="w", padx=10, pady=(5,0)); self.se_target_entry = ctk.CTkEntry(scrollable_params_frame, placeholder_text="เช่น 0.1"); self.se_target_entry.pack(fill="x", padx=10, pady=(0, 15))
+        self.auto_range_var = tkinter.IntVar(value=0); auto_range_check = ctk.CTkCheckBox(scrollable_params_frame, text="ปรับ Amplitude/Gain อัตโนมัติ (auto-range)", variable=self.auto_range_var); auto_range_check.pack(anchor="w", padx=10, pady=(0, 5))
+        ToolTip(auto_range_check, "วัดสัญญาณสั้นๆ ก่อนแต่ละช่วงความถี่ (ครึ่ง decade) แล้วปรับ Amplitude ให้สัญญาณใช้ช่วง ADC ~70% โดยไม่ถูกตัด\nGain LV/HV ของ STEMlab 125-14 ตั้งด้วย jumper จึงไม่ถูกเปลี่ยนอัตโนมัติ")
+        self.remeasure_var = tkinter.IntVar(value=1); remeasure_check = ctk.CTkCheckBox(scrollable_params_frame, text="วัดซ้ำจุดที่ไม่ผ่านเกณฑ์คุณภาพเมื่อจบ Sweep", variable=self.remeasure_var); remeasure_check.pack(anchor="w", padx=10, pady=(0, 5))
+        ToolTip(remeasure_check, "เกณฑ์: ไม่มี clipping, SNR ≥ 40 dB, THD ≤ 5%, spur ≤ -40 dBc, SE ของ Z ≤ 1%\nผลทุกครั้งบันทึกใน point_quality.csv")
+        self.archive_raw_var = tkinter.IntVar(value=0); ctk.CTkCheckBox(scrollable_params_frame, text="เก็บ Raw waveform (raw_waveforms.npz)", variable=self.archive_raw_var).pack(anchor="w", padx=10, pady=(0, 5))
+        self.columnar_var = tkinter.IntVar(value=0); ctk.CTkCheckBox(scrollable_params_frame, text="บันทึก summary_results.npy เมื่อจบการวัด", variable=self.columnar_var).pack(anchor="w", padx=10, pady=(0, 5))
+        self.hot_switch_var = tkinter.IntVar(value=0); ctk.CTkCheckBox(scrollable_params_frame, text="สลับความถี่โดยไม่รีเซ็ต Generator (รอ settle อัตโนมัติ)", variable=self.hot_switch_var).pack(anchor="w", padx=10, pady=(0, 5))
+        self.chirp_var = tkinter.IntVar(value=0); chirp_check = ctk.CTkCheckBox(scrollable_params_frame, text="สแกนเร็วแบบ chirp (ไม่ใช้จำนวนครั้งเฉลี่ย)", variable=self.chirp_var); chirp_check.pack(anchor="w", padx=10, pady=(0, 15))
+        ToolTip(chirp_check, "กวาดความถี่ทั้งช่วงต่อเนื่องด้วย Sweep ของ Generator ขณะเก็บข้อมูล DMA ครั้งเดียว (~2 วินาที)\nเหมาะสำหรับคัดกรอง ความแม่นยำต่ำกว่าการวัดทีละจุด")
         control_frame = ctk.CTkFrame(self.setup_frame); control_frame.grid(row=1, column=0, sticky="sew", padx=10, pady=10); control_frame.grid_columnconfigure((0,1), weight=1)
         self.start_button = ctk.CTkButton(control_frame, text="▶️ เริ่มการวัด", command=self.start_measurement, font=ctk.CTkFont(size=14, weight="bold")); self.start_button.grid(row=0, column=0, padx=5, pady=5, sticky="ew")
         self.stop_button = ctk.CTkButton(control_frame, text="⏹️ ยกเลิก", command=self.stop_measurement, state="disabled", fg_color="tomato"); self.stop_button.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
@@ -162,9 +288,127 @@ class SweepApp(ctk.CTk):
         self.eta_label = ctk.CTkLabel(status_frame, text="ETA: --:--:--", anchor="e", font=ctk.CTkFont(size=14)); self.eta_label.grid(row=0, column=1, sticky="e")
         self.progress_bar = ctk.CTkProgressBar(status_frame, orientation="horizontal"); self.progress_bar.set(0); self.progress_bar.grid(row=1, column=0, columnspan=2, pady=(5,10), sticky="ew")
         self.save_graph_button = ctk.CTkButton(status_frame, text="💾 บันทึกกราฟ", command=self.save_graph, state="disabled"); self.save_graph_button.grid(row=2, column=0, columnspan=2, pady=0, sticky="ew")
-        self.fig_live = Figure(figsize=(5, 4), dpi=100); self.ax_live = self.fig_live.add_subplot(111); self.canvas_live = FigureCanvasTkAgg(self.fig_live, master=self.monitoring_frame)
+        self.fig_live = Figure(figsize=(5, 4), dpi=100); self.ax_live = self.fig_live.add_subplot(111); self.ax_live_cal = self.ax_live.twinx(); self.canvas_live = FigureCanvasTkAgg(self.fig_live, master=self.monitoring_frame)
         self.canvas_live.get_tk_widget().grid(row=2, column=0, padx=10, pady=10, sticky="nswe"); self._create_matplotlib_toolbar(self.canvas_live, self.monitoring_frame); self.init_plot(self.fig_live, self.ax_live, self.canvas_live, "Live Impedance")
+        self.canvas_live.mpl_connect('draw_event', self._on_live_draw)
+
+    def _reset_live_buffers(self, capacity=256):
+        # แถว: freq, Z real, Z imag, calibrated real, calibrated imag (NaN เมื่อไม่มี Reference)
+        self._live_data = np.full((5, capacity), np.nan); self._live_count = 0; self._live_drawn = 0
+
+    def _append_live_point(self, point):
+        """Store one sweep point in the live buffers and schedule a frame, at most live_plot_max_fps per second."""
+        values = (point['freq'], point['z_real'], point['z_imag'], point.get('cal_real', np.nan), point.get('cal_imag', np.nan))
+        # จุดที่วัดซ้ำ: เขียนทับค่าเดิมที่ความถี่เดียวกันแล้ววาดใหม่ทั้งหมด
+        match = np.flatnonzero(np.isclose(self._live_data[0, :self._live_count], point['freq'])) if point.get('replace') else []
+        if len(match): self._live_data[:, match[0]] = values; self._live_drawn = 0
+        else:
+            if self._live_count == self._live_data.shape[1]: self._live_data = np.concatenate([self._live_data, np.full_like(self._live_data, np.nan)], axis=1)
+            self._live_data[:, self._live_count] = values; self._live_count += 1
+        if self._live_flush_id is None:
+            delay = max(0, int(1000 * (self._live_last_draw + 1.0 / self.live_plot_max_fps - time.monotonic())))
+            self._live_flush_id = self.after(delay, self._flush_live_plot)
+
+    def _flush_live_plot(self):
+        """Push the buffered points to the live lines; blit unless the new points fall outside the current view."""
+        self._live_flush_id = None; n, start = self._live_count, self._live_drawn
+        freqs, z_reals, z_imags, cal_reals, cal_imags = self._live_data[:, :n]; self.line_real.set_data(freqs, z_reals); self.line_imag.set_data(freqs, z_imags); self.line_cal_real.set_data(freqs, cal_reals); self.line_cal_imag.set_data(freqs, cal_imags)
+        self._live_drawn = n; self._live_last_draw = time.monotonic()
+        (x_lo, x_hi), (y_lo, y_hi), (c_lo, c_hi) = self.ax_live.get_xlim(), self.ax_live.get_ylim(), self.ax_live_cal.get_ylim(); new = self._live_data[:, start:n]
+        outside = start == 0 or np.any((new[0] < x_lo) | (new[0] > x_hi)) or np.any((new[1:3] < y_lo) | (new[1:3] > y_hi)) or np.any((new[3:] < c_lo) | (new[3:] > c_hi))
+        if outside or self._live_background is None or not self.line_real.get_animated(): self._autoscale_live(); self.canvas_live.draw_idle(); return
+        self.canvas_live.restore_region(self._live_background); self._draw_live_lines(); self.canvas_live.blit(self.ax_live.bbox)
+
+    def _draw_live_lines(self):
+        for line in (self.line_real, self.line_imag, self.line_cal_real, self.line_cal_imag):
+            if line.get_animated() and line.axes.get_visible(): line.axes.draw_artist(line)
+
+    def _autoscale_live(self):
+        for ax in (self.ax_live, self.ax_live_cal): ax.relim(); ax.autoscale_view()
+
+    def _on_live_calibration(self, calibration):
+        if calibration is None: self.log("ไม่พบ Background/Ferrite ที่ตรงกัน: แสดงเฉพาะค่าดิบระหว่างวัด"); return
+        self.log("Calibrate ระหว่างวัดด้วย: " + ", ".join(self.get_label_from_path(calibration.paths[key]) for key in ('bg_metal', 'ferrite', 'bg_ferrite')))
+        self.ax_live_cal.set_visible(True); text_color = self.ax_live.title.get_color()
+        if self.ax_live.get_legend(): self.ax_live.get_legend().remove()
+        legend = self.ax_live_cal.legend(handles=[self.line_real, self.line_imag, self.line_cal_real, self.line_cal_imag], loc='upper left', fontsize='small')
+        for text in legend.get_texts(): text.set_color(text_color)
+        legend.get_frame().set_facecolor(self.ax_live.get_facecolor()); legend.get_frame().set_edgecolor('gray'); self.fig_live.tight_layout(); self.canvas_live.draw_idle()
+
+    def _on_live_draw(self, event):
+        # พื้นหลังสำหรับ blit ต้องจับใหม่ทุกครั้งที่วาดเต็ม (autoscale, zoom/pan, resize)
+        self._live_background = self.canvas_live.copy_from_bbox(self.ax_live.bbox); self._draw_live_lines()
+
+    def _finalize_live_plot(self):
+        """Flush pending points and turn the live lines back into normal artists so saved figures include them."""
+        if self._live_flush_id is not None: self.after_cancel(self._live_flush_id); self._flush_live_plot()
+        for line in (self.line_real, self.line_imag, self.line_cal_real, self.line_cal_imag): line.set_animated(False)
+        self._autoscale_live(); self.canvas_live.draw_idle()
     
+    def create_monitor_tab(self):
+        """แท็บติดตามค่าที่ความถี่คงที่ต่อเนื่อง: strip chart และสถิติแบบ rolling จาก MonitorBuffer (หน่วยความจำคงที่)"""
+        self.monitor_thread = None; self.monitor_buffer = None; self._monitor_lines = []
+        self.monitor_tab.grid_columnconfigure(1, weight=1); self.monitor_tab.grid_rowconfigure(0, weight=1)
+        control_frame = ctk.CTkFrame(self.monitor_tab, width=320, corner_radius=10); control_frame.grid(row=0, column=0, padx=10, pady=10, sticky="nswe"); control_frame.grid_propagate(False); control_frame.grid_columnconfigure(0, weight=1); control_frame.grid_rowconfigure(10, weight=1)
+        ctk.CTkLabel(control_frame, text="ติดตามค่าที่ความถี่คงที่", font=ctk.CTkFont(size=16, weight="bold")).grid(row=0, column=0, padx=10, pady=(10, 5), sticky="w")
+        self.monitor_entries = {}
+        for row, (key, text, default) in enumerate([('frequencies', "ความถี่ (Hz, คั่นด้วย ,):", "1000, 10000"), ('averages', "จำนวนครั้งเฉลี่ยต่อค่า:", "1"), ('window', "หน้าต่างสถิติ (จำนวนค่า):", "50"), ('capacity', "จำนวนค่าที่เก็บแสดงในกราฟ:", "2000")]):
+            ctk.CTkLabel(control_frame, text=text).grid(row=1 + 2 * row, column=0, padx=10, sticky="w")
+            entry = ctk.CTkEntry(control_frame); entry.insert(0, default); entry.grid(row=2 + 2 * row, column=0, padx=10, pady=(0, 5), sticky="ew"); self.monitor_entries[key] = entry
+        button_frame = ctk.CTkFrame(control_frame, fg_color="transparent"); button_frame.grid(row=9, column=0, padx=10, pady=10, sticky="ew"); button_frame.grid_columnconfigure((0, 1), weight=1)
+        self.monitor_start_button = ctk.CTkButton(button_frame, text="▶️ เริ่มติดตาม", command=self.start_monitoring); self.monitor_start_button.grid(row=0, column=0, padx=(0, 5), sticky="ew")
+        self.monitor_stop_button = ctk.CTkButton(button_frame, text="⏹️ หยุด", command=self.stop_monitoring, state="disabled", fg_color="tomato"); self.monitor_stop_button.grid(row=0, column=1, padx=(5, 0), sticky="ew")
+        self.monitor_stats_label = ctk.CTkLabel(control_frame, text="", justify="left", anchor="nw", font=ctk.CTkFont(family="Courier", size=12)); self.monitor_stats_label.grid(row=10, column=0, padx=10, pady=(0, 10), sticky="nsew")
+        graph_frame = ctk.CTkFrame(self.monitor_tab, corner_radius=10); graph_frame.grid(row=0, column=1, padx=(0, 10), pady=10, sticky="nswe"); graph_frame.grid_rowconfigure(1, weight=1); graph_frame.grid_columnconfigure(0, weight=1)
+        self.fig_monitor = Figure(figsize=(5, 4), dpi=100); self.ax_monitor = self.fig_monitor.add_subplot(111); self.canvas_monitor = FigureCanvasTkAgg(self.fig_monitor, master=graph_frame)
+        self.canvas_monitor.get_tk_widget().grid(row=1, column=0, padx=10, pady=10, sticky="nswe"); self._create_matplotlib_toolbar(self.canvas_monitor, graph_frame); self._init_monitor_plot()
+
+    def _init_monitor_plot(self, frequencies=()):
+        self.init_plot(self.fig_monitor, self.ax_monitor, self.canvas_monitor, "Monitoring"); text_color = self.ax_monitor.title.get_color()
+        self.ax_monitor.set_xscale('linear'); self.ax_monitor.set_xlabel('Time (s)', color=text_color); self._monitor_lines = []
+        for k, frequency in enumerate(frequencies):
+            color = self.color_cycle[k % len(self.color_cycle)]
+            line_real, = self.ax_monitor.plot([], [], '-', color=color, label=f"{frequency:g} Hz Real"); line_imag, = self.ax_monitor.plot([], [], '--', color=color, label=f"{frequency:g} Hz Imag"); self._monitor_lines.append((line_real, line_imag))
+        if frequencies:
+            legend = self.ax_monitor.legend(fontsize='small', loc='upper left')
+            for text in legend.get_texts(): text.set_color(text_color)
+            legend.get_frame().set_facecolor(self.ax_monitor.get_facecolor()); legend.get_frame().set_edgecolor('gray')
+        self.canvas_monitor.draw_idle()
+
+    def start_monitoring(self):
+        if self.measurement_thread and self.measurement_thread.is_alive(): messagebox.showwarning("เครื่องไม่ว่าง", "กำลังวัดแบบ Sweep อยู่ กรุณารอให้เสร็จหรือยกเลิกก่อน"); return
+        try:
+            frequencies = [float(f) for f in self.monitor_entries['frequencies'].get().split(',') if f.strip()]; averages, window, capacity = (int(self.monitor_entries[key].get()) for key in ('averages', 'window', 'capacity'))
+            if not frequencies or min(frequencies) <= 0 or averages < 1 or window < 2 or capacity < window: raise ValueError("ต้องมีความถี่ > 0 อย่างน้อย 1 ค่า, เฉลี่ย >= 1, หน้าต่าง >= 2 และจำนวนที่เก็บ >= หน้าต่าง")
+        except ValueError as e: messagebox.showerror("ข้อมูลผิดพลาด", f"กรุณาตรวจสอบข้อมูลที่ป้อน: {e}"); return
+        run_dir = os.path.join("Measurement_Data", "monitoring", time.strftime('%Y%m%d-%H%M%S'))
+        self.monitor_buffer = MonitorBuffer(frequencies, capacity=capacity, window=window); self._init_monitor_plot(frequencies); self.monitor_stats_label.configure(text="")
+        self.monitor_start_button.configure(state="disabled"); self.monitor_stop_button.configure(state="normal")
+        self.monitor_thread = MonitorThread({'frequencies': frequencies, 'averages': averages, 'output_path': run_dir}, self.queue_gui_update); self.monitor_thread.start()
+
+    def stop_monitoring(self):
+        if self.monitor_thread and self.monitor_thread.is_alive(): self.monitor_thread.stop(); self.log("กำลังหยุดการติดตามค่า (รอให้การวัดครั้งปัจจุบันเสร็จ)...")
+        self.monitor_stop_button.configure(state="disabled")
+
+    def _on_monitor_sample(self, data):
+        if self.monitor_buffer is None: return
+        self.monitor_buffer.append(data['k'], data['t'], data['z']); self._schedule_redraw('monitor', delay_ms=200)
+
+    def _on_monitor_stopped(self, data):
+        self.monitor_start_button.configure(state="normal"); self.monitor_stop_button.configure(state="disabled"); self.redraw_monitor_plot()
+        if data['error']: self.log(f"การติดตามค่าหยุดเนื่องจากข้อผิดพลาด: {data['error']}"); messagebox.showerror("เกิดข้อผิดพลาด", data['error'])
+        self.log(f"หยุดการติดตามค่าแล้ว ({len(self.monitor_buffer)} ค่า) ไฟล์: {data['path']}")
+
+    def redraw_monitor_plot(self):
+        buffer = self.monitor_buffer
+        if buffer is None: return
+        lines = []
+        for k, (line_real, line_imag) in enumerate(self._monitor_lines):
+            t, z = buffer.series(k); line_real.set_data(t, z.real); line_imag.set_data(t, z.imag)
+            mean, sd_real, sd_imag, n = buffer.stats(k)
+            if n: lines.append(f"{buffer.frequencies[k]:g} Hz (n={n})\n  Re {mean.real:.5g} ± {sd_real:.2g}\n  Im {mean.imag:.5g} ± {sd_imag:.2g}")
+        self.monitor_stats_label.configure(text="\n".join(lines)); self.ax_monitor.relim(); self.ax_monitor.autoscale_view(); self.canvas_monitor.draw_idle()
+
     def create_comparison_tab(self):
         self.compare_tab.grid_columnconfigure(1, weight=1); self.compare_tab.grid_rowconfigure(0, weight=1)
         compare_control_frame = ctk.CTkFrame(self.compare_tab, width=320, corner_radius=10); compare_control_frame.grid(row=0, column=0, padx=10, pady=10, sticky="nswe"); compare_control_frame.grid_propagate(False); compare_control_frame.grid_rowconfigure(3, weight=1); compare_control_frame.grid_columnconfigure(0, weight=1)
@@ -181,6 +425,7 @@ class SweepApp(ctk.CTk):
         directions = ["All Directions"] + [f"D{i}" for i in range(1, 17)]; ctk.CTkOptionMenu(filter_frame, variable=self.compare_direction_filter_var, values=directions, command=self._apply_compare_filters).grid(row=2, column=1, pady=(5, 0), sticky="ew")
         ctk.CTkCheckBox(compare_control_frame, text="Select All / Unselect All", variable=self.compare_select_all_var, command=self.toggle_all_compare).grid(row=2, column=0, padx=15, pady=10, sticky="w")
         self.compare_list_frame = ctk.CTkScrollableFrame(compare_control_frame, label_text="Loaded Datasets"); self.compare_list_frame.grid(row=3, column=0, padx=10, pady=10, sticky="nswe")
+        self.compare_load_label = ctk.CTkLabel(compare_control_frame, text="", anchor="w", text_color="gray"); self.compare_load_label.grid(row=4, column=0, padx=15, pady=(0, 10), sticky="ew")
         compare_graph_frame = ctk.CTkFrame(self.compare_tab, corner_radius=10); compare_graph_frame.grid(row=0, column=1, padx=(0, 10), pady=10, sticky="nswe"); compare_graph_frame.grid_rowconfigure(1, weight=1); compare_graph_frame.grid_columnconfigure(0, weight=1)
         self.fig_compare = Figure(figsize=(5, 4), dpi=100); self.ax_compare = self.fig_compare.add_subplot(111); self.canvas_compare = FigureCanvasTkAgg(self.fig_compare, master=compare_graph_frame)
         self.canvas_compare.get_tk_widget().grid(row=1, column=0, padx=10, pady=10, sticky="nswe"); self._create_matplotlib_toolbar(self.canvas_compare, compare_graph_frame); self.init_plot(self.fig_compare, self.ax_compare, self.canvas_compare, "Comparison Plot")
@@ -199,9 +444,19 @@ class SweepApp(ctk.CTk):
         ctk.CTkOptionMenu(filter_frame_calc, variable=self.calc_metal_filter_var, values=["All Metals"] + self.metal_types, command=self._apply_calc_filters).grid(row=1, column=1, pady=(5, 0), sticky="ew")
         ctk.CTkLabel(filter_frame_calc, text="Filter by Direction:").grid(row=2, column=0, padx=(0, 5), pady=(5, 0), sticky="w")
         directions = ["All Directions"] + [f"D{i}" for i in range(1, 17)]; ctk.CTkOptionMenu(filter_frame_calc, variable=self.calc_direction_filter_var, values=directions, command=self._apply_calc_filters).grid(row=2, column=1, pady=(5, 0), sticky="ew")
+        ctk.CTkLabel(filter_frame_calc, text="จับคู่ Reference:").grid(row=3, column=0, padx=(0, 5), pady=(5, 0), sticky="w")
+        ctk.CTkOptionMenu(filter_frame_calc, variable=self.calc_match_mode_var, values=["ใกล้ที่สุด (Nearest)", "ก่อนหน้าเท่านั้น (Before Only)"], command=self._on_calc_match_changed).grid(row=3, column=1, pady=(5, 0), sticky="ew")
+        ctk.CTkLabel(filter_frame_calc, text="Max Δ (นาที):").grid(row=4, column=0, padx=(0, 5), pady=(5, 0), sticky="w")
+        self.calc_match_window_entry = ctk.CTkEntry(filter_frame_calc, placeholder_text="ไม่จำกัด"); self.calc_match_window_entry.grid(row=4, column=1, pady=(5, 0), sticky="ew")
+        self.calc_match_window_entry.bind("<Return>", self._on_calc_match_changed); self.calc_match_window_entry.bind("<FocusOut>", self._on_calc_match_changed)
         ctk.CTkCheckBox(calc_control_frame, text="Select All / Unselect All", variable=self.calc_select_all_var, command=self.toggle_all_calc).grid(row=2, column=0, padx=15, pady=10, sticky="w")
         self.calc_list_frame = ctk.CTkScrollableFrame(calc_control_frame, label_text="Select Metal Measurement(s) to Calculate"); self.calc_list_frame.grid(row=3, column=0, padx=10, pady=(0, 10), sticky="nswe")
-        output_frame = ctk.CTkFrame(calc_control_frame); output_frame.grid(row=4, column=0, padx=10, pady=10, sticky="ew"); output_frame.grid_columnconfigure(0, weight=1)
+        calc_status_frame = ctk.CTkFrame(calc_control_frame, fg_color="transparent"); calc_status_frame.grid(row=4, column=0, padx=10, sticky="ew"); calc_status_frame.grid_columnconfigure(0, weight=1)
+        self.calc_load_label = ctk.CTkLabel(calc_status_frame, text="", anchor="w", text_color="gray"); self.calc_load_label.grid(row=0, column=0, columnspan=2, padx=5, sticky="ew")
+        self.calc_progress_label = ctk.CTkLabel(calc_status_frame, text="", anchor="w", text_color="gray"); self.calc_progress_label.grid(row=1, column=0, columnspan=2, padx=5, sticky="ew")
+        self.calc_progress_bar = ctk.CTkProgressBar(calc_status_frame, orientation="horizontal"); self.calc_progress_bar.set(0); self.calc_progress_bar.grid(row=2, column=0, padx=5, sticky="ew")
+        self.calc_cancel_button = ctk.CTkButton(calc_status_frame, text="⏹️ ยกเลิก", width=70, fg_color="tomato", state="disabled", command=self.cancel_calculations); self.calc_cancel_button.grid(row=2, column=1, padx=5)
+        output_frame = ctk.CTkFrame(calc_control_frame); output_frame.grid(row=5, column=0, padx=10, pady=10, sticky="ew"); output_frame.grid_columnconfigure(0, weight=1)
         self.associated_files_frame = ctk.CTkFrame(output_frame); self.associated_files_frame.grid(row=0, column=0, sticky="ew")
         ctk.CTkLabel(self.associated_files_frame, text="Auto-Detected Files (for last selected)", font=ctk.CTkFont(weight="bold")).pack(anchor="w", padx=5, pady=(5, 10))
         ctk.CTkLabel(self.associated_files_frame, text="Background for Metal:").pack(anchor="w", padx=5); self.bg_for_metal_label = ctk.CTkLabel(self.associated_files_frame, text="N/A", text_color="gray", wraplength=280); self.bg_for_metal_label.pack(anchor="w", padx=5, pady=(0, 5))
@@ -245,6 +500,7 @@ class SweepApp(ctk.CTk):
         self.mpt_calc_button.grid(row=1, column=0, sticky="ew", padx=(0,5))
         self.mpt_remove_button = ctk.CTkButton(top_button_frame, text="ลบรายการที่เลือก", fg_color="tomato", command=self.remove_selected_mpt_items)
         self.mpt_remove_button.grid(row=1, column=1, sticky="ew", padx=(5,0))
+        ctk.CTkButton(top_button_frame, text="ค้นหาวัสดุที่ใกล้เคียง", command=self.identify_mpt_samples).grid(row=2, column=0, columnspan=2, sticky="ew", pady=(5,0))
         
         # --- ส่วนแสดงรายการ ---
         self.mpt_samples_list_frame = ctk.CTkScrollableFrame(mpt_control_frame, label_text="เลือกข้อมูลสำหรับแสดงผล")
@@ -289,7 +545,7 @@ class SweepApp(ctk.CTk):
         self.fig_mpt = Figure(figsize=(5, 4), dpi=100); self.ax_mpt = self.fig_mpt.add_subplot(111); self.canvas_mpt = FigureCanvasTkAgg(self.fig_mpt, master=mpt_graph_frame)
         self.canvas_mpt.get_tk_widget().grid(row=1, column=0, padx=10, pady=10, sticky="nswe")
         self._create_matplotlib_toolbar(self.canvas_mpt, mpt_graph_frame)
-        self.init_plot(self.fig_mpt, self.ax_mpt, self.canvas_mpt, "Eigenvalue Analysis")
+        self.init_plot(self.fig_mpt, self.ax_mpt, self.canvas_mpt, "Eigenvalue Analysis"); self.ax_mpt.set_ylabel("Value", color=self.ax_mpt.title.get_color())
 
     def load_mpt_samples_folder(self):
         self.log("กำลังเปิดหน้าต่างเลือกโฟลเดอร์..."); initial_dir = os.path.join("Measurement_Data", "metal") if os.path.isdir(os.path.join("Measurement_Data", "metal")) else "."
@@ -305,10 +561,13 @@ class SweepApp(ctk.CTk):
                 item_path = os.path.join(folder, item)
                 if os.path.isdir(item_path) and item.lower().startswith("sample_"): samples_to_process.append(item_path)
         
+        if self._get_catalog(): self.catalog.invalidate()
         for item_path in samples_to_process:
             sample_name = f"{metal_name}_{os.path.basename(item_path)}"
             if sample_name in self.mpt_samples: continue # ข้ามถ้ามีอยู่แล้ว
-            found_directions = {int(m.group(1)): os.path.join(r, f) for r, _, fs in os.walk(item_path) for f in fs if (m := re.search(r"Direction_(\d+)", os.path.join(r, f))) and f.endswith("_CALIBRATED.csv")}
+            catalog = self._get_catalog()
+            if catalog and catalog.relative_prefix(item_path) is not None: found_directions = {run['direction']: run['calibrated_path'] for run in catalog.runs(under=item_path, calibrated_only=True) if run['direction'] is not None}
+            else: found_directions = {int(m.group(1)): os.path.join(r, f) for r, _, fs in os.walk(item_path) for f in fs if (m := re.search(r"Direction_(\d+)", os.path.join(r, f))) and f.endswith("_CALIBRATED.csv")}
             if not found_directions: self.log(f"ข้าม {sample_name}: ไม่พบไฟล์ _CALIBRATED.csv"); continue
 
             sample_frame = ctk.CTkFrame(self.mpt_samples_list_frame); sample_frame.pack(fill="x", pady=5, padx=5)
@@ -338,11 +597,10 @@ class SweepApp(ctk.CTk):
             if path in self.mpt_loaded_csvs: self.log(f"ข้ามไฟล์ที่โหลดแล้ว: {os.path.basename(path)}"); continue
             try:
                 df = pd.read_csv(path)
-                required_cols = ['Frequency', 'Eig1_Real', 'Eig1_Imag', 'Eig2_Real', 'Eig2_Imag', 'Eig3_Real', 'Eig3_Imag']
-                if not all(col in df.columns for col in required_cols): self.log(f"ไฟล์ {os.path.basename(path)} ไม่มีคอลัมน์ที่ถูกต้อง"); continue
+                if not all(col in df.columns for col in EIGENVALUE_COLUMNS): self.log(f"ไฟล์ {os.path.basename(path)} ไม่มีคอลัมน์ที่ถูกต้อง"); continue
                 
                 label = os.path.basename(path).replace("_Eigenvalues.csv", ""); var = tkinter.IntVar(value=1)
-                cb = ctk.CTkCheckBox(self.mpt_samples_list_frame, text=f"📄 {label}", variable=var, command=self.redraw_mpt_plot)
+                cb = ctk.CTkCheckBox(self.mpt_samples_list_frame, text=f"📄 {label}", variable=var, command=lambda: self._schedule_redraw('mpt', delay_ms=20))
                 cb.pack(anchor="w", padx=5, pady=2)
                 # *** เก็บ reference ของ checkbox ไว้ ***
                 self.mpt_loaded_csvs[path] = {'label': label, 'df': df, 'var': var, 'widget': cb}
@@ -404,78 +662,78 @@ class SweepApp(ctk.CTk):
         self.log("เริ่มการคำนวณ Eigenvalues..."); calculated_count = 0
         for sample_name, sample_data in self.mpt_samples.items():
             if not sample_data['widgets']['sample_var'].get(): sample_data['results'] = None; continue
-            calibrated_data, original_data_for_plot = {}, {}
-            for dir_num, dir_data in sample_data['directions'].items():
-                if dir_data['var'].get() == 1:
-                    df = pd.read_csv(dir_data['path']); calibrated_data[dir_num] = df; original_data_for_plot[dir_num] = df
-            if len(calibrated_data) < 6: self.log(f"ข้าม {sample_name}: เลือกทิศทางไม่ถึง 6"); sample_data['results'] = None; continue
+            direction_paths = {dir_num: dir_data['path'] for dir_num, dir_data in sample_data['directions'].items() if dir_data['var'].get() == 1}
+            if len(direction_paths) < 6: self.log(f"ข้าม {sample_name}: เลือกทิศทางไม่ถึง 6"); sample_data['results'] = None; continue
             try:
-                self.log(f"กำลังคำนวณ {sample_name}..."); results = self.mpt_calculator.calculate_eigenvalues(calibrated_data)
-                results['original_data'] = original_data_for_plot; sample_data['results'] = results
-                calculated_count += 1; self.log(f"คำนวณ {sample_name} สำเร็จ")
+                results, cached = self.mpt_calculator.eigenvalues_for_files(direction_paths, loader=self.calibration_engine.read_calibrated); sample_data['results'] = results
+                calculated_count += 1; self.log(f"ใช้ผลเดิมของ {sample_name} (ข้อมูลไม่เปลี่ยน)" if cached else f"คำนวณ {sample_name} สำเร็จ")
             except Exception as e: self.log(f"คำนวณ {sample_name} ล้มเหลว: {e}"); sample_data['results'] = None
         self.log(f"การคำนวณเสร็จสิ้น ({calculated_count} ชิ้นงาน)"); self.redraw_mpt_plot()
         save_state = "normal" if calculated_count > 0 else "disabled"
         self.mpt_save_source_button.configure(state=save_state); self.mpt_save_new_button.configure(state=save_state); self.mpt_save_graph_button.configure(state=save_state)
         
-    def redraw_mpt_plot(self, *args):
-        self.init_plot(self.fig_mpt, self.ax_mpt, self.canvas_mpt, "Eigenvalue Analysis")
-        self.ax_mpt.set_ylabel("Value")
+    def identify_mpt_samples(self):
+        """เทียบ spectrum ของชิ้นงาน/CSV ที่เลือกกับไฟล์ _Eigenvalues.csv ทั้งหมดใน Measurement_Data (ทำงานบน load_executor)"""
+        queries = [(name, results_spectrum(data['results']), os.path.join(data['path'], f"{name}_Eigenvalues.csv")) for name, data in self.mpt_samples.items() if data['widgets']['sample_var'].get() and data.get('results')]
+        queries += [(data['label'], frame_spectrum(data['df']), path) for path, data in self.mpt_loaded_csvs.items() if data['var'].get() == 1]
+        if not queries: messagebox.showwarning("ไม่มีข้อมูล", "กรุณาคำนวณชิ้นงานหรือเลือกไฟล์ Eigenvalue CSV ก่อนค้นหา"); return
+        if not os.path.isdir("Measurement_Data"): messagebox.showwarning("ไม่พบข้อมูลอ้างอิง", "ไม่พบโฟลเดอร์ Measurement_Data"); return
+        self.log(f"กำลังค้นหาวัสดุที่ใกล้เคียงสำหรับ {len(queries)} รายการ...")
+        catalog = self._get_catalog()
+        if catalog: catalog.invalidate()
+        def identify():
+            index = SpectralIndex.load_or_build("Measurement_Data", catalog=catalog)
+            return len(index), [(label, index.query(freq, eig, k=5, exclude=exclude)) for label, (freq, eig), exclude in queries]
+        self.load_executor.submit(identify).add_done_callback(lambda f: self.queue_gui_update('spectral_matches', f))
+
+    def _on_spectral_matches(self, future):
+        try: n_refs, results = future.result()
+        except Exception as e: self.log(f"ค้นหาวัสดุล้มเหลว: {e}"); return
+        if not n_refs: messagebox.showinfo("ไม่พบข้อมูลอ้างอิง", "ยังไม่มีไฟล์ _Eigenvalues.csv ใน Measurement_Data"); return
+        lines = []
+        for label, matches in results:
+            self.log(f"ผลการค้นหา {label} (เทียบกับ {n_refs} รายการ):")
+            for rank, (ref_label, _, distance) in enumerate(matches, 1): self.log(f"  {rank}. {ref_label}  d={distance:.4f}")
+            lines.append(f"{label} → {matches[0][0]} (d={matches[0][2]:.4f})" if matches else f"{label} → ไม่พบ")
+        messagebox.showinfo("วัสดุที่ใกล้เคียงที่สุด", "\n".join(lines))
 
+    def redraw_mpt_plot(self, *args):
         # ดึงค่าจาก Filter ทั้งหมด
         metal_filter = self.mpt_plot_options['metal_filter'].get()
         show_type = self.mpt_plot_options['show_type'].get()
         show_e1, show_e2, show_e3, show_orig = self.mpt_plot_options['show_e1'].get(), self.mpt_plot_options['show_e2'].get(), self.mpt_plot_options['show_e3'].get(), self.mpt_plot_options['show_orig'].get()
-        
-        color_idx, plotted_something = 0, False
+        plot_map = {1: show_e1, 2: show_e2, 3: show_e3}; color_idx, specs = 0, []
 
-        # พล็อตข้อมูลจากการคำนวณสด
+        # ข้อมูลจากการคำนวณสด
         for sample_name, sample_data in self.mpt_samples.items():
-            # *** เพิ่มเงื่อนไข Filter โลหะ ***
-            if metal_filter != "All Metals" and not sample_name.startswith(metal_filter):
-                continue
-
+            if metal_filter != "All Metals" and not sample_name.startswith(metal_filter): continue
             if sample_data.get('results'):
-                plotted_something = True
-                # ... (โค้ดพล็อตส่วนที่เหลือเหมือนเดิม) ...
                 results = sample_data['results']; freq = results['freq']; sample_label_short = sample_name.split('_')[-1].replace('Sample', 'S')
                 if show_orig and 'original_data' in results:
-                    for df in results['original_data'].values():
-                        if show_type != "เฉพาะค่า Imaginary": self.ax_mpt.plot(df['Frequency'], df['Z_Calibrated_Real'], color=self.color_cycle[color_idx % len(self.color_cycle)], linestyle='--', linewidth=0.8, alpha=0.5)
-                        if show_type != "เฉพาะค่า Real": self.ax_mpt.plot(df['Frequency'], df['Z_Calibrated_Imag'], color=self.color_cycle[color_idx % len(self.color_cycle)], linestyle=':', linewidth=0.8, alpha=0.5)
-                plot_map = {1: show_e1, 2: show_e2, 3: show_e3}
+                    for dir_num, df in results['original_data'].items():
+                        style = {'color': self.color_cycle[color_idx % len(self.color_cycle)], 'linewidth': 0.8, 'alpha': 0.5, 'label': '_nolegend_'}
+                        if show_type != "เฉพาะค่า Imaginary": specs.append(((sample_name, 'orig', dir_num, 'real'), df, df['Frequency'], df['Z_Calibrated_Real'], '--', style))
+                        if show_type != "เฉพาะค่า Real": specs.append(((sample_name, 'orig', dir_num, 'imag'), df, df['Frequency'], df['Z_Calibrated_Imag'], ':', style))
                 for i, color_offset in zip(plot_map.keys(), [0, 1, 2]):
                     if plot_map[i]:
                         current_color = self.color_cycle[(color_idx + color_offset) % len(self.color_cycle)]
-                        if show_type != "เฉพาะค่า Imaginary": self.ax_mpt.plot(freq, results[f'eig{i}_real'], '-', color=current_color, label=f'{sample_label_short} E{i} (Real)')
-                        if show_type != "เฉพาะค่า Real": self.ax_mpt.plot(freq, results[f'eig{i}_imag'], '--', color=current_color, label=f'{sample_label_short} E{i} (Imag)')
+                        if show_type != "เฉพาะค่า Imaginary": specs.append(((sample_name, 'eig', i, 'real'), results, freq, results[f'eig{i}_real'], '-', {'color': current_color, 'label': f'{sample_label_short} E{i} (Real)'}))
+                        if show_type != "เฉพาะค่า Real": specs.append(((sample_name, 'eig', i, 'imag'), results, freq, results[f'eig{i}_imag'], '--', {'color': current_color, 'label': f'{sample_label_short} E{i} (Imag)'}))
                 color_idx += 3
 
-        # พล็อตข้อมูลจากไฟล์ CSV
-        if hasattr(self, 'mpt_loaded_csvs'):
-            for path, csv_data in self.mpt_loaded_csvs.items():
-                # *** เพิ่มเงื่อนไข Filter โลหะ ***
-                if metal_filter != "All Metals" and not csv_data['label'].startswith(metal_filter):
-                    continue
-
-                if csv_data['var'].get() == 1:
-                    plotted_something = True
-                    # ... (โค้ดพล็อตส่วนที่เหลือเหมือนเดิม) ...
-                    df = csv_data['df']; freq = df['Frequency']; label_short = csv_data['label']
-                    plot_map = {1: show_e1, 2: show_e2, 3: show_e3}
-                    for i, color_offset in zip(plot_map.keys(), [0, 1, 2]):
-                         if plot_map[i]:
-                            current_color = self.color_cycle[(color_idx + color_offset) % len(self.color_cycle)]
-                            if show_type != "เฉพาะค่า Imaginary": self.ax_mpt.plot(freq, df[f'Eig{i}_Real'], '.-', color=current_color, label=f'{label_short} E{i} (Real)')
-                            if show_type != "เฉพาะค่า Real": self.ax_mpt.plot(freq, df[f'Eig{i}_Imag'], ':x', color=current_color, label=f'{label_short} E{i} (Imag)')
-                    color_idx += 3
-
-        if plotted_something:
-            legend = self.ax_mpt.legend(fontsize='small', loc='upper right')
-            if legend:
-                for text in legend.get_texts(): text.set_color("white" if ctk.get_appearance_mode() == "Dark" else "black")
-        
-        self.canvas_mpt.draw()
+        # ข้อมูลจากไฟล์ CSV
+        for path, csv_data in self.mpt_loaded_csvs.items():
+            if metal_filter != "All Metals" and not csv_data['label'].startswith(metal_filter): continue
+            if csv_data['var'].get() == 1:
+                df = csv_data['df']; freq = df['Frequency']; label_short = csv_data['label']
+                for i, color_offset in zip(plot_map.keys(), [0, 1, 2]):
+                    if plot_map[i]:
+                        current_color = self.color_cycle[(color_idx + color_offset) % len(self.color_cycle)]
+                        if show_type != "เฉพาะค่า Imaginary": specs.append(((path, 'eig', i, 'real'), df, freq, df[f'Eig{i}_Real'], '.-', {'color': current_color, 'label': f'{label_short} E{i} (Real)'}))
+                        if show_type != "เฉพาะค่า Real": specs.append(((path, 'eig', i, 'imag'), df, freq, df[f'Eig{i}_Imag'], ':x', {'color': current_color, 'label': f'{label_short} E{i} (Imag)'}))
+                color_idx += 3
+
+        self._sync_lines('mpt', self.ax_mpt, self.canvas_mpt, specs, live=set(self.mpt_samples) | set(self.mpt_loaded_csvs), legend_kwargs={'fontsize': 'small', 'loc': 'upper right'})
 
     def save_mpt_results(self, to_source=False):
         samples_to_save = [name for name, data in self.mpt_samples.items() if data.get('widgets', {}).get('sample_var', tkinter.IntVar(value=0)).get() and data.get('results')]
@@ -488,11 +746,10 @@ class SweepApp(ctk.CTk):
         for sample_name in samples_to_save:
             try:
                 results = self.mpt_samples[sample_name]['results']
-                df_to_save = pd.DataFrame({'Frequency': results['freq'], 'Eig1_Real': results['eig1_real'], 'Eig1_Imag': results['eig1_imag'], 'Eig2_Real': results['eig2_real'], 'Eig2_Imag': results['eig2_imag'], 'Eig3_Real': results['eig3_real'], 'Eig3_Imag': results['eig3_imag']})
                 filename = f"{sample_name}_Eigenvalues.csv"
                 destination_dir = self.mpt_samples[sample_name]['path'] if to_source else save_dir
                 save_path = os.path.join(destination_dir, filename)
-                df_to_save.to_csv(save_path, index=False, float_format='%.6f')
+                write_eigenvalue_csv(save_path, results)
                 self.log(f"บันทึกไฟล์สำเร็จ: {save_path}"); saved_count += 1
             except Exception as e: self.log(f"ไม่สามารถบันทึกไฟล์สำหรับ {sample_name}: {e}")
         if saved_count > 0: messagebox.showinfo("บันทึกสำเร็จ", f"บันทึกข้อมูล Eigenvalues จำนวน {saved_count} ไฟล์เรียบร้อยแล้ว")
@@ -513,18 +770,34 @@ class SweepApp(ctk.CTk):
 
     def init_plot(self, fig, ax, canvas, title):
         is_dark = ctk.get_appearance_mode() == "Dark"; face_color = "#2B2B2B" if is_dark else "#F9F9F9"; text_color = "#DCE4EE" if is_dark else "#333333"; grid_color = 'gray'
+        if ax == self.ax_live: self.ax_live_cal.clear() # ต้อง clear แกน twin ก่อน เพราะจะรีเซ็ตสเกลแกน x ที่ใช้ร่วมกัน
         fig.patch.set_facecolor(face_color); ax.clear(); ax.set_facecolor(face_color)
         ax.set_xscale('log'); ax.set_xlabel('Frequency (Hz)', color=text_color); ax.set_ylabel('Impedance (Ohm)', color=text_color); ax.set_title(title, color=text_color)
         ax.grid(True, which="both", ls="--", color=grid_color, alpha=0.5); ax.tick_params(axis='x', colors=text_color); ax.tick_params(axis='y', colors=text_color)
         for spine in ax.spines.values(): spine.set_edgecolor(grid_color)
-        if ax == self.ax_live: self.line_real, = self.ax_live.plot([], [], 'o-', label='Z Real'); self.line_imag, = self.ax_live.plot([], [], 'o-', label='Z Imaginary', color='r')
+        if ax == self.ax_live:
+            self.line_real, = self.ax_live.plot([], [], 'o-', label='Z Real', animated=True); self.line_imag, = self.ax_live.plot([], [], 'o-', label='Z Imaginary', color='r', animated=True); self._live_background = None
+            cal = self.ax_live_cal; cal.set_visible(False); cal.yaxis.tick_right(); cal.yaxis.set_label_position('right'); cal.set_ylabel('Calibrated (Z / Z Ferrite)', color=text_color); cal.tick_params(axis='y', colors=text_color)
+            for spine in cal.spines.values(): spine.set_edgecolor(grid_color)
+            self.line_cal_real, = cal.plot([], [], 's--', ms=4, label='Calibrated Real', color='tab:green', animated=True); self.line_cal_imag, = cal.plot([], [], 's--', ms=4, label='Calibrated Imag', color='tab:purple', animated=True)
         legend = ax.legend();
         if legend:
             for text in legend.get_texts(): text.set_color(text_color)
             legend.get_frame().set_facecolor(face_color); legend.get_frame().set_edgecolor(grid_color)
         fig.tight_layout(); canvas.draw()
 
+    def _get_catalog(self):
+        """คืนค่า MeasurementCatalog ของ Measurement_Data (None ถ้ายังไม่มีโฟลเดอร์)"""
+        if self.catalog is None and os.path.isdir("Measurement_Data"):
+            try: self.catalog = MeasurementCatalog("Measurement_Data")
+            except Exception as e: self.log(f"ไม่สามารถเปิด catalog ได้ ใช้การสแกนโฟลเดอร์แทน: {e}")
+        return self.catalog
+
     def _find_all_summaries(self, folder):
+        catalog = self._get_catalog()
+        if catalog: catalog.invalidate()
+        filepaths = catalog.find_summaries(folder) if catalog else None
+        if filepaths is not None: return filepaths
         filepaths = [];
         for root, dirs, files in os.walk(folder):
             if "summary_results.csv" in files: filepaths.append(os.path.join(root, "summary_results.csv"))
@@ -548,14 +821,54 @@ class SweepApp(ctk.CTk):
     def _add_to_compare_list(self, filepaths, clear_existing=False):
         if clear_existing:
             for widget in self.compare_list_frame.winfo_children(): widget.destroy()
-            self.loaded_data_compare.clear(); self.compare_select_all_var.set(0); self._reset_compare_filters()
+            self.loaded_data_compare.clear(); self.compare_select_all_var.set(0); self._reset_compare_filters(); self._dataset_load['compare'].update(total=0, done=0, failed=0, pending=set())
+        new_paths = []
         for path in filepaths:
             if path in self.loaded_data_compare: continue
             try:
-                label = self.get_label_from_path(path); cb = ctk.CTkCheckBox(self.compare_list_frame, text=label, command=self.redraw_comparison_plot)
-                self.loaded_data_compare[path] = {'label': label, 'enabled_var': cb.get, 'checkbox': cb}; ToolTip(cb, text=label)
+                label = self.get_label_from_path(path); cb = ctk.CTkCheckBox(self.compare_list_frame, text=label, command=lambda: self._schedule_redraw('compare', delay_ms=20))
+                self.loaded_data_compare[path] = {'label': label, 'enabled_var': cb.get, 'checkbox': cb, 'ready': False}; ToolTip(cb, text=label); new_paths.append(path)
             except Exception as e: self.log(f"เกิดข้อผิดพลาดในการเพิ่มไฟล์ {os.path.basename(path)}: {e}")
-        self._apply_compare_filters()
+        self._apply_compare_filters(); self._load_datasets_async('compare', new_paths)
+
+    def _load_datasets_async(self, tab, paths):
+        """Parse `paths` into the dataset cache on the loader pool; each result comes back as a 'dataset_loaded' event."""
+        if not paths: return
+        state = self._dataset_load[tab]
+        if not state['pending']: state.update(total=0, done=0, failed=0)
+        state['total'] += len(paths); state['pending'].update(paths); self._update_load_label(tab)
+        for path in paths:
+            future = self.load_executor.submit(self.dataset_cache.get, path)
+            future.add_done_callback(lambda f, p=path: self.queue_gui_update('dataset_loaded', {'tab': tab, 'path': p, 'error': None if f.cancelled() else f.exception()}))
+
+    def _update_load_label(self, tab):
+        state = self._dataset_load[tab]; label = self.compare_load_label if tab == 'compare' else self.calc_load_label
+        if state['total'] == 0: label.configure(text=""); return
+        text = f"โหลดข้อมูลแล้ว {state['done']}/{state['total']} ไฟล์" if state['pending'] else f"โหลดข้อมูลครบ {state['total']} ไฟล์"
+        if state['failed']: text += f" (ผิดพลาด {state['failed']})"
+        label.configure(text=text)
+
+    def _on_dataset_loaded(self, data):
+        tab, path, error = data['tab'], data['path'], data['error']; state = self._dataset_load[tab]
+        if path not in state['pending']: return
+        state['pending'].discard(path); state['done'] += 1
+        if error is not None: state['failed'] += 1; self.log(f"ไม่สามารถอ่านไฟล์ {os.path.basename(path)}: {error}")
+        self._update_load_label(tab)
+        if not state['pending']: self.log(f"โหลดข้อมูล {state['total']} ไฟล์เสร็จแล้ว")
+        entry = (self.loaded_data_compare if tab == 'compare' else self.loaded_data_calc).get(path)
+        if entry is None: return
+        entry['ready'] = True
+        if error is not None: entry['error'] = error
+        elif tab == 'compare' and entry['checkbox'].winfo_manager() and entry['enabled_var']() == 1: self._schedule_redraw('compare')
+
+    def _schedule_redraw(self, tab, delay_ms=100):
+        """Coalesce bursts of redraw requests for one tab into a single redraw."""
+        if tab in self._pending_redraws: return
+        self._pending_redraws[tab] = self.after(delay_ms, self._run_scheduled_redraw, tab)
+
+    def _run_scheduled_redraw(self, tab):
+        self._pending_redraws.pop(tab, None)
+        {'compare': self.redraw_comparison_plot, 'calc': self.redraw_calc_plot, 'mpt': self.redraw_mpt_plot, 'monitor': self.redraw_monitor_plot}[tab]()
         
     def _apply_compare_filters(self, *args):
         direction_filter = self.compare_direction_filter_var.get(); metal_filter = self.compare_metal_filter_var.get()
@@ -574,7 +887,7 @@ class SweepApp(ctk.CTk):
         if not paths_to_remove: messagebox.showinfo("ไม่มีรายการที่เลือก", "กรุณาเลือกรายการที่ต้องการลบ"); return
         if not messagebox.askyesno("ยืนยันการลบ", f"คุณต้องการลบ {len(paths_to_remove)} รายการที่เลือกใช่หรือไม่?"): return
         for path in paths_to_remove:
-            if path in self.loaded_data_compare: del self.loaded_data_compare[path]
+            if path in self.loaded_data_compare: self.loaded_data_compare[path]['checkbox'].destroy(); del self.loaded_data_compare[path]
         self.redraw_comparison_plot(); self.log(f"ลบ {len(paths_to_remove)} รายการออกจากลิสต์แล้ว")
 
     def toggle_all_compare(self):
@@ -586,22 +899,49 @@ class SweepApp(ctk.CTk):
         self.redraw_comparison_plot()
 
     def redraw_comparison_plot(self):
-        self.init_plot(self.fig_compare, self.ax_compare, self.canvas_compare, "Comparison Plot"); color_idx = 0; plot_type = self.compare_plot_type_var.get()
+        color_idx = 0; plot_type = self.compare_plot_type_var.get(); specs = []
         for path, data in self.loaded_data_compare.items():
-            if data['checkbox'].winfo_manager() and data['enabled_var']() == 1:
+            if data['checkbox'].winfo_manager() and data['enabled_var']() == 1 and data.get('ready', True) and 'error' not in data:
                 try:
-                    df = pd.read_csv(path); color = self.color_cycle[color_idx % len(self.color_cycle)]; label = data['label']
-                    if plot_type == "แสดงทั้งหมด (Both)":
-                        self.ax_compare.plot(df['Frequency'], df['Z_Real'], 'o-', color=color, label=f'{label} (Real)'); self.ax_compare.plot(df['Frequency'], df['Z_Imaginary'], 'x--', color=color, label=f'{label} (Imag)')
-                    elif plot_type == "เฉพาะค่า Real (Real Only)": self.ax_compare.plot(df['Frequency'], df['Z_Real'], 'o-', color=color, label=label)
-                    elif plot_type == "เฉพาะค่า Imaginary (Imag Only)": self.ax_compare.plot(df['Frequency'], df['Z_Imaginary'], 'x--', color=color, label=label)
+                    df = self.dataset_cache.get(path); color = self.color_cycle[color_idx % len(self.color_cycle)]; label = data['label']
+                    if plot_type in ["แสดงทั้งหมด (Both)", "เฉพาะค่า Real (Real Only)"]: specs.append(((path, 'real'), df, df['Frequency'], df['Z_Real'], 'o-', {'color': color, 'label': f'{label} (Real)' if plot_type == "แสดงทั้งหมด (Both)" else label}))
+                    if plot_type in ["แสดงทั้งหมด (Both)", "เฉพาะค่า Imaginary (Imag Only)"]: specs.append(((path, 'imag'), df, df['Frequency'], df['Z_Imaginary'], 'x--', {'color': color, 'label': f'{label} (Imag)' if plot_type == "แสดงทั้งหมด (Both)" else label}))
                     color_idx += 1
                 except Exception as e: self.log(f"ไม่สามารถพล็อตกราฟจาก {os.path.basename(path)}: {e}")
-        if color_idx > 0:
-            legend = self.ax_compare.legend(fontsize='small');
-            if legend:
-                for text in legend.get_texts(): text.set_color("white" if ctk.get_appearance_mode() == "Dark" else "black")
-        self.canvas_compare.draw()
+        self._sync_lines('compare', self.ax_compare, self.canvas_compare, specs, live=self.loaded_data_compare)
+
+    def _sync_lines(self, tab, ax, canvas, specs, live, legend_kwargs=None):
+        """
+        Reconcile the persistent Line2D artists of a plot tab with `specs`
+
+        `specs` is the ordered list of lines that should be visible, each given as
+        (key, source, x, y, fmt, style) where key[0] identifies the dataset and
+        `source` is the object the data came from. Existing artists are reused and
+        only restyled (their data is reset only when `source` changed), lines not in
+        `specs` are hidden, and artists whose dataset is no longer in `live` are
+        removed from the axes. Line data goes through the tab's LineLOD, so dense
+        curves are drawn at screen resolution. The canvas is redrawn with draw_idle.
+        """
+        lines = self._plot_lines[tab]; lod = self._plot_lod[tab]; wanted = set(); handles = []
+        for key, source, x, y, fmt, style in specs:
+            wanted.add(key); entry = lines.get(key)
+            if entry is None: line, = ax.plot([], [], fmt, **style); lod.set_data(line, x, y); lines[key] = [line, source]
+            else:
+                line = entry[0]
+                if entry[1] is not source: lod.set_data(line, x, y); entry[1] = source
+                line.update(style); line.set_visible(True)
+            if not line.get_label().startswith('_'): handles.append(line)
+        for key in list(lines):
+            if key in wanted: continue
+            if key[0] in live: lines[key][0].set_visible(False)
+            else: line = lines.pop(key)[0]; lod.discard(line); line.remove()
+        legend = ax.get_legend()
+        if legend: legend.remove()
+        if handles:
+            legend = ax.legend(handles=handles, **(legend_kwargs or {'fontsize': 'small'}))
+            for text in legend.get_texts(): text.set_color("white" if ctk.get_appearance_mode() == "Dark" else "black")
+        if wanted: ax.relim(visible_only=True); ax.autoscale_view()
+        canvas.draw_idle()
 
     def _reset_calc_filters(self):
         self.calc_direction_filter_var.set("All Directions"); self.calc_metal_filter_var.set("All Metals"); self.calc_plot_type_var.set("แสดงทั้งหมด (Both)")
@@ -621,14 +961,15 @@ class SweepApp(ctk.CTk):
     def _populate_calc_list(self, filepaths, clear_existing=False):
         if clear_existing:
             for widget in self.calc_list_frame.winfo_children(): widget.destroy()
-            self.loaded_data_calc.clear(); self.calc_results_cache.clear()
+            self.cancel_calculations(); self.loaded_data_calc.clear(); self.calc_results_cache.clear()
             self.bg_for_metal_label.configure(text="N/A"); self.ferrite_label.configure(text="N/A"); self.bg_for_ferrite_label.configure(text="N/A")
-            self.calc_select_all_var.set(0); self._reset_calc_filters()
+            self.calc_select_all_var.set(0); self._reset_calc_filters(); self._dataset_load['calc'].update(total=0, done=0, failed=0, pending=set())
+        new_paths = []
         for path in filepaths:
             if path in self.loaded_data_calc: continue
             label = self.get_label_from_path(path); cb = ctk.CTkCheckBox(self.calc_list_frame, text=label, command=lambda p=path: self.on_calc_checkbox_toggle(p))
-            self.loaded_data_calc[path] = {'label': label, 'enabled_var': cb.get, 'checkbox': cb}; ToolTip(cb, text=label)
-        self._apply_calc_filters()
+            self.loaded_data_calc[path] = {'label': label, 'enabled_var': cb.get, 'checkbox': cb, 'ready': False}; ToolTip(cb, text=label); new_paths.append(path)
+        self._apply_calc_filters(); self._load_datasets_async('calc', new_paths)
 
     def _apply_calc_filters(self, *args):
         direction_filter = self.calc_direction_filter_var.get(); metal_filter = self.calc_metal_filter_var.get()
@@ -646,7 +987,7 @@ class SweepApp(ctk.CTk):
         if not messagebox.askyesno("ยืนยันการลบ", f"คุณต้องการลบ {len(paths_to_remove)} รายการที่เลือกใช่หรือไม่?"): return
         for path in paths_to_remove:
             if path in self.loaded_data_calc:
-                self.loaded_data_calc[path]['checkbox'].destroy(); del self.loaded_data_calc[path]; self.calc_results_cache.pop(path, None)
+                self._cancel_calculation(path); self.loaded_data_calc[path]['checkbox'].destroy(); del self.loaded_data_calc[path]; self.calc_results_cache.pop(path, None)
         self.redraw_calc_plot(); self.log(f"ลบ {len(paths_to_remove)} รายการออกจากลิสต์การคำนวณแล้ว")
 
     def toggle_all_calc(self):
@@ -656,75 +997,133 @@ class SweepApp(ctk.CTk):
                 current_state = data['enabled_var']()
                 if new_state == 1 and current_state == 0: data['checkbox'].select(); paths_to_process.append(path)
                 elif new_state == 0 and current_state == 1: data['checkbox'].deselect()
-        if new_state == 0: self.calc_results_cache.clear()
-        else:
-            for path in paths_to_process: self._perform_calculation_for_path(path)
+        if new_state == 0: self.cancel_calculations(); self.calc_results_cache.clear()
+        else: self._submit_calculations([path for path in paths_to_process if path not in self.calc_results_cache])
         self.redraw_calc_plot()
 
     def on_calc_checkbox_toggle(self, path):
-        self._find_associated_files(path)
-        if self.loaded_data_calc[path]['enabled_var']() == 1 and path not in self.calc_results_cache: self._perform_calculation_for_path(path)
-        self.redraw_calc_plot()
-
-    def _perform_calculation_for_path(self, metal_path):
-        self.log(f"กำลังคำนวณสำหรับ: {self.get_label_from_path(metal_path)}")
+        self._calc_last_selected = path
+        if self.loaded_data_calc[path]['enabled_var']() == 1:
+            if path in self.calc_results_cache: self._show_associated_files(*self.calc_results_cache[path]['references'])
+            else: self._submit_calculations([path])
+        else: self._cancel_calculation(path)
+        self._schedule_redraw('calc', delay_ms=20)
+
+    def _calculate_calibration(self, metal_path, before_only, within):
+        """Worker-thread part of a calculation: match the references and calibrate (no Tk calls here)"""
+        paths, deltas = self._match_references(metal_path, before_only, within)
+        if not all([paths['bg_metal'], paths['ferrite'], paths['bg_ferrite']]): return paths, deltas, None
+        freq_axis, z_final = self.calibration_engine.calibrate_one(paths)
+        return paths, deltas, {'freq': freq_axis, 'z_final': z_final, 'references': (paths, deltas)}
+
+    def _submit_calculations(self, metal_paths):
+        """ส่งงานคำนวณไปที่ calc_executor; ผลลัพธ์กลับมาเป็น event 'calc_done' ผ่าน queue_gui_update"""
+        jobs = self._calc_jobs; before_only, within = self._get_calc_match_constraints()
+        if not jobs['futures']: jobs['total'] = jobs['done'] = 0
+        for path in metal_paths:
+            if path in jobs['futures']: continue
+            self.log(f"กำลังคำนวณสำหรับ: {self.get_label_from_path(path)}"); jobs['total'] += 1
+            future = self.calc_executor.submit(self._calculate_calibration, path, before_only, within); jobs['futures'][path] = future
+            future.add_done_callback(lambda f, p=path, g=jobs['generation']: self.queue_gui_update('calc_done', {'path': p, 'generation': g, 'future': f}))
+        self._update_calc_progress()
+
+    def _cancel_calculation(self, path):
+        future = self._calc_jobs['futures'].pop(path, None)
+        if future is not None: future.cancel(); self._calc_jobs['total'] -= 1; self._update_calc_progress()
+
+    def cancel_calculations(self):
+        jobs = self._calc_jobs; pending = list(jobs['futures'])
+        # การเลือกของผู้ใช้คงไว้ตามเดิม ยกเลิกเฉพาะงานที่ยังค้างอยู่
+        for future in jobs['futures'].values(): future.cancel()
+        jobs['generation'] += 1; jobs['futures'].clear(); jobs['total'] = jobs['done'] = 0; self._update_calc_progress()
+        if pending: self.log(f"ยกเลิกการคำนวณ {len(pending)} รายการ")
+
+    def _update_calc_progress(self):
+        jobs = self._calc_jobs; running = bool(jobs['futures'])
+        self.calc_progress_bar.set(jobs['done'] / jobs['total'] if jobs['total'] else 0)
+        self.calc_progress_label.configure(text=f"กำลังคำนวณ {jobs['done']}/{jobs['total']} รายการ" if running else (f"คำนวณเสร็จ {jobs['done']} รายการ" if jobs['done'] else ""))
+        self.calc_cancel_button.configure(state="normal" if running else "disabled")
+
+    def _on_calc_done(self, data):
+        jobs = self._calc_jobs; path, future = data['path'], data['future']
+        if data['generation'] != jobs['generation'] or jobs['futures'].get(path) is not future: return
+        del jobs['futures'][path]; jobs['done'] += 1; self._update_calc_progress()
+        entry = self.loaded_data_calc.get(path); label = self.get_label_from_path(path)
+        if entry is None or future.cancelled(): return
         try:
-            paths = self._find_associated_files(metal_path)
-            if not all([paths['bg_metal'], paths['ferrite'], paths['bg_ferrite']]): raise ValueError("ไม่พบไฟล์ที่เกี่ยวข้อง (Background/Ferrite) ครบถ้วน")
-            df_metal, df_bg_metal, df_ferrite, df_bg_ferrite = pd.read_csv(paths['metal']), pd.read_csv(paths['bg_metal']), pd.read_csv(paths['ferrite']), pd.read_csv(paths['bg_ferrite'])
-            freq_axis = np.logspace(np.log10(max(df_metal['Frequency'].min(), 1)), np.log10(df_metal['Frequency'].max()), 200)
-            def interpolate_z(df, freqs): return np.interp(freqs, df['Frequency'], df['Z_Real']) + 1j * np.interp(freqs, df['Frequency'], df['Z_Imaginary'])
-            z_metal, z_bg_metal, z_ferrite, z_bg_ferrite = interpolate_z(df_metal, freq_axis), interpolate_z(df_bg_metal, freq_axis), interpolate_z(df_ferrite, freq_axis), interpolate_z(df_bg_ferrite, freq_axis)
-            z_bg_removed, z_calibrated_ferrite = z_metal - z_bg_metal, z_ferrite - z_bg_ferrite
-            with np.errstate(divide='ignore', invalid='ignore'): z_final = np.divide(z_bg_removed, z_calibrated_ferrite); z_final[z_calibrated_ferrite == 0] = np.nan
-            self.calc_results_cache[metal_path] = {'freq': freq_axis, 'z_final': z_final}; self.log(f"คำนวณสำเร็จ: {self.get_label_from_path(metal_path)}")
-        except Exception as e:
-            self.log(f"คำนวณล้มเหลวสำหรับ {self.get_label_from_path(metal_path)}: {e}")
-            if metal_path in self.loaded_data_calc: self.loaded_data_calc[metal_path]['checkbox'].deselect()
+            paths, deltas, result = future.result()
+            if path == self._calc_last_selected: self._show_associated_files(paths, deltas)
+            if result is None: raise ValueError("ไม่พบไฟล์ที่เกี่ยวข้อง (Background/Ferrite) ครบถ้วน")
+        except Exception as e: self.log(f"คำนวณล้มเหลวสำหรับ {label}: {e}"); entry['checkbox'].deselect(); return
+        if entry['enabled_var']() == 1: self.calc_results_cache[path] = result; self.log(f"คำนวณสำเร็จ: {label}"); self._schedule_redraw('calc')
 
     def redraw_calc_plot(self):
-        self.init_plot(self.fig_calc, self.ax_calc, self.canvas_calc, "Calculation Result"); color_idx = 0; plot_type = self.calc_plot_type_var.get()
+        color_idx = 0; plot_type = self.calc_plot_type_var.get(); specs = []
         for path, data in self.loaded_data_calc.items():
             if data['checkbox'].winfo_manager() and data['enabled_var']() == 1 and path in self.calc_results_cache:
                 result = self.calc_results_cache[path]; color = self.color_cycle[color_idx % len(self.color_cycle)]
                 label_real, label_imag = f"{data['label']} (Real)", f"{data['label']} (Imag)"
-                if plot_type in ["แสดงทั้งหมด (Both)", "เฉพาะค่า Real (Real Only)"]: self.ax_calc.plot(result['freq'], result['z_final'].real, 'o-', ms=4, color=color, label=label_real)
-                if plot_type in ["แสดงทั้งหมด (Both)", "เฉพาะค่า Imaginary (Imag Only)"]: self.ax_calc.plot(result['freq'], result['z_final'].imag, 'x--', ms=4, color=color, label=label_imag)
+                if plot_type in ["แสดงทั้งหมด (Both)", "เฉพาะค่า Real (Real Only)"]: specs.append(((path, 'real'), result, result['freq'], result['z_final'].real, 'o-', {'ms': 4, 'color': color, 'label': label_real}))
+                if plot_type in ["แสดงทั้งหมด (Both)", "เฉพาะค่า Imaginary (Imag Only)"]: specs.append(((path, 'imag'), result, result['freq'], result['z_final'].imag, 'x--', {'ms': 4, 'color': color, 'label': label_imag}))
                 color_idx += 1
-        if color_idx > 0:
-            legend = self.ax_calc.legend(fontsize='small');
-            if legend:
-                for text in legend.get_texts(): text.set_color("white" if ctk.get_appearance_mode() == "Dark" else "black")
-        self.canvas_calc.draw()
-
-    def _find_closest_file(self, target_dt, search_dir):
+        self._sync_lines('calc', self.ax_calc, self.canvas_calc, specs, live=self.loaded_data_calc)
+
+    def _get_calc_match_constraints(self):
+        """อ่านเงื่อนไขการจับคู่ Reference จาก UI: (before_only, within_seconds)"""
+        before_only = self.calc_match_mode_var.get() == "ก่อนหน้าเท่านั้น (Before Only)"
+        try: within = float(self.calc_match_window_entry.get()) * 60 if self.calc_match_window_entry.get().strip() else None
+        except ValueError: within = None
+        return before_only, within
+
+    def _on_calc_match_changed(self, *args):
+        if self._get_calc_match_constraints() == self._calc_match_constraints: return
+        checked = [path for path, data in self.loaded_data_calc.items() if data['checkbox'].winfo_manager() and data['enabled_var']() == 1]
+        self.cancel_calculations(); self._calc_match_constraints = self._get_calc_match_constraints(); self.calc_results_cache.clear()
+        self._submit_calculations(checked); self.redraw_calc_plot()
+
+    def _find_closest_file(self, target_dt, search_dir, before_only=False, within=None):
         if not os.path.isdir(search_dir): return None, None
+        if self.timestamp_index.covers(search_dir): return self.timestamp_index.nearest(os.path.basename(search_dir), target_dt, before_only=before_only, within=within)
         closest_path, min_delta = None, float('inf')
         for root, _, files in os.walk(search_dir):
             if "summary_results.csv" in files:
                 timestamp_str = os.path.basename(root)
                 try:
                     current_dt = datetime.strptime(timestamp_str, '%Y%m%d-%H%M%S'); delta = abs((target_dt - current_dt).total_seconds())
+                    if before_only and current_dt > target_dt: continue
                     if delta < min_delta: min_delta, closest_path = delta, os.path.join(root, "summary_results.csv")
                 except ValueError: continue
+        if within is not None and min_delta > within: return None, None
         return closest_path, min_delta
 
-    def _find_associated_files(self, metal_path):
-        paths = {'metal': metal_path, 'bg_metal': None, 'ferrite': None, 'bg_ferrite': None}
+    def _match_references(self, metal_path, before_only=False, within=None):
+        """
+        Reference runs for a metal run, without touching any widget (safe on worker threads)
+
+        Returns (paths, deltas): paths has 'metal', 'bg_metal', 'ferrite' and 'bg_ferrite'
+        (None when not found), deltas the matching |Δt| in seconds. Raises ValueError if
+        the metal run folder has no valid timestamp.
+        """
+        paths = {'metal': metal_path, 'bg_metal': None, 'ferrite': None, 'bg_ferrite': None}; deltas = {'bg_metal': None, 'ferrite': None, 'bg_ferrite': None}
         try: metal_dt = datetime.strptime(os.path.basename(os.path.dirname(metal_path)), '%Y%m%d-%H%M%S')
-        except ValueError: self.log(f"รูปแบบวันที่-เวลาของโฟลเดอร์ไม่ถูกต้องสำหรับ: {metal_path}"); return paths
-        paths['bg_metal'], delta1 = self._find_closest_file(metal_dt, os.path.join("Measurement_Data", "background"))
-        self.bg_for_metal_label.configure(text=f"{self.get_label_from_path(paths['bg_metal'])} (Δ {delta1:.0f}s)" if paths['bg_metal'] else "Not found")
-        paths['ferrite'], delta2 = self._find_closest_file(metal_dt, os.path.join("Measurement_Data", "calibration"))
-        self.ferrite_label.configure(text=f"{self.get_label_from_path(paths['ferrite'])} (Δ {delta2:.0f}s)" if paths['ferrite'] else "Not found")
+        except ValueError: raise ValueError(f"รูปแบบวันที่-เวลาของโฟลเดอร์ไม่ถูกต้องสำหรับ: {metal_path}")
+        paths['bg_metal'], deltas['bg_metal'] = self._find_closest_file(metal_dt, os.path.join("Measurement_Data", "background"), before_only, within)
+        paths['ferrite'], deltas['ferrite'] = self._find_closest_file(metal_dt, os.path.join("Measurement_Data", "calibration"), before_only, within)
         if paths['ferrite']:
-            try:
-                ferrite_dt = datetime.strptime(os.path.basename(os.path.dirname(paths['ferrite'])), '%Y%m%d-%H%M%S')
-                paths['bg_ferrite'], delta3 = self._find_closest_file(ferrite_dt, os.path.join("Measurement_Data", "background"))
-                self.bg_for_ferrite_label.configure(text=f"{self.get_label_from_path(paths['bg_ferrite'])} (Δ {delta3:.0f}s)" if paths['bg_ferrite'] else "Not found")
-            except (ValueError, TypeError): self.bg_for_ferrite_label.configure(text="N/A (Error with Ferrite path)")
-        else: self.bg_for_ferrite_label.configure(text="N/A (No Ferrite found)")
-        return paths
+            ferrite_dt = datetime.strptime(os.path.basename(os.path.dirname(paths['ferrite'])), '%Y%m%d-%H%M%S')
+            paths['bg_ferrite'], deltas['bg_ferrite'] = self._find_closest_file(ferrite_dt, os.path.join("Measurement_Data", "background"), before_only, within)
+        return paths, deltas
+
+    def _live_calibration(self, summary_path, params, before_only, within):
+        """Worker-thread part of the live calibrated view: references for the run being measured, or None if any is missing"""
+        paths, _ = self._match_references(summary_path, before_only, within)
+        if not all(paths.values()): return None
+        return LiveCalibration(self.calibration_engine, paths, (params['min_freq'], params['max_freq'], params['num_points']))
+
+    def _show_associated_files(self, paths, deltas):
+        for key, label in (('bg_metal', self.bg_for_metal_label), ('ferrite', self.ferrite_label), ('bg_ferrite', self.bg_for_ferrite_label)):
+            label.configure(text=f"{self.get_label_from_path(paths[key])} (Δ {deltas[key]:.0f}s)" if paths[key] else "Not found")
+        if not paths['ferrite']: self.bg_for_ferrite_label.configure(text="N/A (No Ferrite found)")
 
     def save_calibrated_data(self, save_to_source=False):
         checked_paths = [path for path, data in self.loaded_data_calc.items() if data['checkbox'].winfo_manager() and data['enabled_var']() == 1 and path in self.calc_results_cache]
@@ -736,38 +1135,42 @@ class SweepApp(ctk.CTk):
         count = 0
         for path in checked_paths:
             try:
-                result = self.calc_results_cache[path]; original_label = self.get_label_from_path(path).replace(' ', '_').replace('(', '').replace(')', '').replace(':', '')
-                new_filename = f"{original_label}_CALIBRATED.csv"
+                result = self.calc_results_cache[path]; new_filename = calibrated_filename(path)
                 destination_dir = os.path.dirname(path) if save_to_source else save_dir
-                save_path = os.path.join(destination_dir, new_filename)
-                df_to_save = pd.DataFrame({'Frequency': result['freq'], 'Z_Calibrated_Real': result['z_final'].real, 'Z_Calibrated_Imag': result['z_final'].imag})
-                df_to_save.to_csv(save_path, index=False); self.log(f"บันทึกไฟล์ Calibrated แล้ว: {new_filename}"); count += 1
-            except Exception as e: self.log(f"ไม่สามารถบันทึกไฟล์สำหรับ {original_label}: {e}")
+                self.calibration_engine.write_calibrated(os.path.join(destination_dir, new_filename), result['freq'], result['z_final']); self.log(f"บันทึกไฟล์ Calibrated แล้ว: {new_filename}"); count += 1
+            except Exception as e: self.log(f"ไม่สามารถบันทึกไฟล์สำหรับ {self.get_label_from_path(path)}: {e}"); continue
+            # ไฟล์ที่บันทึกลงใน Measurement_Data/metal/... จะถูกนำเข้า mpt_cube.npy ของโลหะนั้นด้วย
+            try: update_cube(os.path.join(destination_dir, new_filename))
+            except Exception as e: self.log(f"ไม่สามารถอัปเดต MPT cube สำหรับ {new_filename}: {e}")
         if count > 0: messagebox.showinfo("บันทึกสำเร็จ", f"บันทึกข้อมูล Calibrated จำนวน {count} ไฟล์เรียบร้อยแล้ว")
         
     def save_calibrated_to_source(self): self.save_calibrated_data(save_to_source=True)
     def save_calibrated_to_new(self): self.save_calibrated_data(save_to_source=False)
     
-    def get_label_from_path(self, path):
-        if not path: return "N/A"
-        try:
-            parts = path.split(os.sep); base_index = parts.index('Measurement_Data'); info_parts = parts[base_index + 1:]
-            measurement_type = info_parts[0]; timestamp_str = info_parts[-2]; dt_obj = datetime.strptime(timestamp_str, '%Y%m%d-%H%M%S'); formatted_time = dt_obj.strftime('%d-%b %H:%M')
-            if measurement_type == 'metal' and len(info_parts) >= 5:
-                metal = info_parts[1].capitalize(); sample = info_parts[2].replace('Sample_', 'S'); direction = info_parts[3].replace('Direction_', 'D'); return f"{metal}_{sample}_{direction} ({formatted_time})"
-            else: return f"{measurement_type.capitalize()} ({formatted_time})"
-        except (ValueError, IndexError): return os.path.basename(os.path.dirname(path))
+    def get_label_from_path(self, path): return label_from_path(path)
 
     def start_measurement(self):
+        if self.monitor_thread and self.monitor_thread.is_alive(): messagebox.showwarning("เครื่องไม่ว่าง", "กำลังติดตามค่าในแท็บ Monitoring อยู่ กรุณาหยุดก่อน"); return
         if not self.validate_inputs(): return
-        self.log("กำลังตรวจสอบค่าที่ป้อน..."); self.data_points = []; self.init_plot(self.fig_live, self.ax_live, self.canvas_live, "Live Impedance"); self.save_graph_button.configure(state="disabled")
+        self.log("กำลังตรวจสอบค่าที่ป้อน...")
+        if self._live_flush_id is not None: self.after_cancel(self._live_flush_id); self._live_flush_id = None
+        self._reset_live_buffers(); self.init_plot(self.fig_live, self.ax_live, self.canvas_live, "Live Impedance"); self.save_graph_button.configure(state="disabled")
         run_timestamp = time.strftime('%Y%m%d-%H%M%S'); measurement_folder_name = self.measurement_type.get()
         if measurement_folder_name == 'metal':
             metal_type = self.metal_type_combo.get(); sample_number = self.sample_num_entry.get(); direction = self.direction_entry.get()
-            base_results_dir = os.path.join("Measurement_Data", measurement_folder_name, metal_type, f"Sample_{sample_number}", f"Direction_{direction}", run_timestamp)
-        else: base_results_dir = os.path.join("Measurement_Data", measurement_folder_name, run_timestamp)
+            run_parent_dir = os.path.join("Measurement_Data", measurement_folder_name, metal_type, f"Sample_{sample_number}", f"Direction_{direction}")
+        else: run_parent_dir = os.path.join("Measurement_Data", measurement_folder_name)
+        base_results_dir = os.path.join(run_parent_dir, run_timestamp)
+        params = {'min_freq': float(self.min_freq_entry.get()), 'max_freq': float(self.max_freq_entry.get()), 'num_points': int(self.num_points_entry.get()), 'averages': int(self.averages_entry.get()), 'output_path': base_results_dir, 'archive_raw': bool(self.archive_raw_var.get()), 'columnar': bool(self.columnar_var.get()), 'hot_switch': bool(self.hot_switch_var.get()), 'chirp': bool(self.chirp_var.get()), 'auto_range': bool(self.auto_range_var.get()), 'remeasure': bool(self.remeasure_var.get()), 'se_target': float(self.se_target_entry.get()) if self.se_target_entry.get().strip() else None}
+        incomplete_dir = None if params['chirp'] else find_incomplete_run(run_parent_dir, params)
+        if incomplete_dir:
+            done_count = len(read_completed_frequencies(incomplete_dir))
+            if messagebox.askyesno("พบการวัดที่ยังไม่เสร็จ", f"พบการวัดที่ค้างอยู่ ({done_count}/{params['num_points']} จุด):\n{incomplete_dir}\n\nต้องการวัดต่อเฉพาะจุดที่ขาดหรือไม่?"):
+                base_results_dir = incomplete_dir; params['output_path'] = incomplete_dir; params['resume'] = True
         self.current_results_dir = base_results_dir
-        params = {'min_freq': float(self.min_freq_entry.get()), 'max_freq': float(self.max_freq_entry.get()), 'num_points': int(self.num_points_entry.get()), 'averages': int(self.averages_entry.get()), 'output_path': base_results_dir}
+        if measurement_folder_name == 'metal':
+            before_only, within = self._get_calc_match_constraints(); summary_path = os.path.join(base_results_dir, "summary_results.csv")
+            params['calibrator'] = lambda: self._live_calibration(summary_path, params, before_only, within)
         self.set_ui_state_running(True); self.log(f"เริ่มการวัด: {measurement_folder_name}"); messagebox.showinfo("เริ่มต้นการวัด", f"ผลการวัดจะถูกบันทึกที่:\n{base_results_dir}")
         self.measurement_thread = MeasurementThread(params, self.queue_gui_update); self.measurement_thread.start()
         
@@ -779,12 +1182,12 @@ class SweepApp(ctk.CTk):
     def queue_gui_update(self, event_type, data): self.after(0, self.process_gui_update, event_type, data)
     
     def process_gui_update(self, event_type, data):
+        # run ที่เพิ่งเขียนเสร็จต้องปรากฏในทุกแท็บทันที ไม่ต้องรอ min_refresh_interval
+        if event_type in ['finished', 'cancelled', 'error'] and self.catalog: self.catalog.invalidate()
         if event_type == 'update':
             self.status_label.configure(text=data['status']); self.progress_bar.set(data['progress']); eta_seconds = data['eta']; hours, rem = divmod(eta_seconds, 3600); minutes, seconds = divmod(rem, 60)
-            self.eta_label.configure(text=f"ETA: {int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}"); point = data['point_data']; self.data_points.append(point)
-            freqs, z_reals, z_imags = [p['freq'] for p in self.data_points], [p['z_real'] for p in self.data_points], [p['z_imag'] for p in self.data_points]
-            self.line_real.set_data(freqs, z_reals); self.line_imag.set_data(freqs, z_imags)
-            self.ax_live.relim(); self.ax_live.autoscale_view(); self.canvas_live.draw()
+            self.eta_label.configure(text=f"ETA: {int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}")
+            if data['point_data']: self._append_live_point(data['point_data'])
         elif event_type == 'finished':
             self.log("การวัดเสร็จสมบูรณ์!"); self.status_label.configure(text="สถานะ: การวัดเสร็จสมบูรณ์!"); self.save_graph_button.configure(state="normal")
             messagebox.showinfo("เสร็จสิ้น", f"การวัดเสร็จสมบูรณ์!\nไฟล์สรุปถูกบันทึกที่:\n{data['summary_path']}"); self.set_ui_state_running(False)
@@ -792,9 +1195,16 @@ class SweepApp(ctk.CTk):
             if event_type == 'error': self.log(f"ข้อผิดพลาด: {data['error']}"); messagebox.showerror("เกิดข้อผิดพลาด", data['error'])
             self.log("การทำงานสิ้นสุดลง"); self.set_ui_state_running(False)
         elif event_type == 'log': self.log(data)
+        elif event_type == 'dataset_loaded': self._on_dataset_loaded(data)
+        elif event_type == 'calc_done': self._on_calc_done(data)
+        elif event_type == 'spectral_matches': self._on_spectral_matches(data)
+        elif event_type == 'live_calibration': self._on_live_calibration(data)
+        elif event_type == 'monitor': self._on_monitor_sample(data)
+        elif event_type == 'monitor_stopped': self._on_monitor_stopped(data)
 
     def set_ui_state_running(self, is_running):
         state = "disabled" if is_running else "normal"
+        if not is_running: self._finalize_live_plot()
         live_tab_name = "🔴 Live Measurement"
         running_tab_name = "⏳ Live (Running...)"
 
@@ -848,6 +1258,7 @@ class SweepApp(ctk.CTk):
         try:
             min_f = float(self.min_freq_entry.get()); max_f = float(self.max_freq_entry.get()); points = int(self.num_points_entry.get()); avgs = int(self.averages_entry.get())
             if not (min_f > 0 and max_f > min_f and points > 1 and avgs > 0): raise ValueError("ค่าพารามิเตอร์ไม่ถูกต้อง (e.g., Freq Min > 0, Freq Max > Freq Min)")
+            if self.se_target_entry.get().strip() and not float(self.se_target_entry.get()) > 0: raise ValueError("SE เป้าหมายต้องมากกว่า 0")
             if self.measurement_type.get() == "metal": 
                 if not self.metal_type_combo.get(): raise ValueError("กรุณาเลือกชนิดโลหะ")
                 if not self.sample_num_entry.get(): raise ValueError("กรุณาใส่หมายเลขชิ้นงาน")
@@ -869,15 +1280,23 @@ if __name__ == "__main__":
     try: from Background import Background
     except ImportError:
         class Background:
-            def measure_impedance(self, frequency, averages):
+            input_gain = ['LV', 'LV']; amplitude = 0.5; range_frequency = None; clip_list = []; quality = {}
+            def measure_impedance(self, frequency, averages, hot_switch=False, auto_range=False, se_target=None):
                 time.sleep(0.01) 
                 z_real = 50 * np.log10(frequency/100) + np.random.randn() * 2
                 z_imag = -30 * np.exp(-(frequency - 70000)**2 / (2*40000**2)) + np.random.randn() * 2
                 z_mag = np.sqrt(z_real**2 + z_imag**2)
                 z_phase = np.arctan2(z_imag, z_real)
-                v_real, v_imag, i_real, i_imag = (1, 0, 0.02, -0.01)
+                v_real, v_imag, i_real, i_imag = (1, 0, 0.02, -0.01); self.z_list = [complex(z_real, z_imag)]
                 return complex(z_real, z_imag), z_mag, z_phase, z_real, z_imag, v_real, v_imag, i_real, i_imag
             def save_results(self, *args, **kwargs): pass
+            def format_results(self, frequency): return f"Frequency: {frequency} Hz\n"
+            def quality_failures(self, quality=None): return []
+            def capture_impedance(self, frequency): z = complex(*self.measure_impedance(frequency, 1)[3:5]); return z, 1 + 0j, 1 / z
+            def chirp_sweep(self, f_start, f_stop, duration=2.0, method='sweep', filename=None): time.sleep(duration); return None
+            def process_chirp_capture(self, capture, frequencies):
+                z = np.array([complex(*self.measure_impedance(f, 1)[3:5]) for f in frequencies]); i = np.full(len(z), 0.02 + 0j)
+                return {'freq': np.asarray(frequencies), 'z': z, 'v': z * i, 'i': i, 'coherence': np.ones(len(z))}
             def close(self): pass
             
     app = SweepApp()
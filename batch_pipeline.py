@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Headless batch processing of a Measurement_Data tree
+
+Calibrates every metal run against its nearest background and ferrite runs and
+computes MPT eigenvalues for every sample with at least 6 calibrated directions,
+writing the same ``*_CALIBRATED.csv`` and ``<Metal>_Sample_N_Eigenvalues.csv``
+files as the Calculation and Eigenvalue tabs. Work is spread over a process
+pool, and outputs whose inputs (paths, mtimes and sizes) are unchanged since
+the previous run are skipped; that state lives in ``batch_manifest.json`` in
+the data root. Each metal folder also gets an ``mpt_cube.npy`` store of all its
+calibrated samples (see mpt_analysis.MPTCubeStore), updated incrementally.
+
+Usage:
+------
+python batch_pipeline.py Measurement_Data --workers 4
+python batch_pipeline.py Measurement_Data --before-only --within 30 --force
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from measurement_catalog import MeasurementCatalog, TimestampIndex, TIMESTAMP_FORMAT, timestamp_seconds
+from mpt_analysis import CALIBRATION_CACHE_DIRNAME, CALIBRATION_POINTS, CalibrationCache, CalibrationEngine, MPTCalculator, MPTCubeStore, calibrated_filename, file_fingerprint, write_eigenvalue_csv
+
+MANIFEST_FILENAME = "batch_manifest.json"
+
+
+class Manifest:
+    """Input signatures of every output written by the pipeline, used to skip unchanged work"""
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST_FILENAME)
+        try:
+            with open(self.path) as f: self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def _state(self, inputs, params):
+        return {'inputs': {os.path.relpath(p, self.root): list(file_fingerprint(p)) for p in inputs}, 'params': params}
+
+    def up_to_date(self, output, inputs, params):
+        return os.path.exists(output) and self.entries.get(os.path.relpath(output, self.root)) == self._state(inputs, params)
+
+    def record(self, output, inputs, params):
+        self.entries[os.path.relpath(output, self.root)] = self._state(inputs, params)
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f: json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def run_seconds(summary_path):
+    """Timestamp (seconds) of the run folder holding `summary_path`, NaN when missing"""
+    if not summary_path: return np.nan
+    return timestamp_seconds(datetime.strptime(os.path.basename(os.path.dirname(summary_path)), TIMESTAMP_FORMAT))
+
+
+def match_references(runs, index, before_only=False, within=None):
+    """
+    Reference files for many metal runs at once
+
+    Returns one dict per run with 'metal', 'bg_metal', 'ferrite' and 'bg_ferrite'
+    summary paths (None where no run matched), using the same nearest-in-time
+    rule as the Calculation tab.
+    """
+    metal_times = [run['timestamp'] for run in runs]
+    bg_metal, _ = index.nearest_many('background', metal_times, before_only, within)
+    ferrite, _ = index.nearest_many('calibration', metal_times, before_only, within)
+    bg_ferrite, _ = index.nearest_many('background', [run_seconds(p) for p in ferrite], before_only, within)
+    return [{'metal': run['summary_path'], 'bg_metal': b, 'ferrite': f, 'bg_ferrite': bf} for run, b, f, bf in zip(runs, bg_metal, ferrite, bg_ferrite)]
+
+
+def _calibrate_job(outputs, jobs, n_points, cache_dir):
+    """
+    Calibrate metal runs sharing one set of references ({metal_path: paths}) in a single 2-D pass
+
+    Returns {output: error message} for the outputs that could not be written.
+    """
+    engine = CalibrationEngine(n_points=n_points, cache=CalibrationCache(cache_dir))
+    try: results = engine.calibrate_many(jobs)
+    except Exception:
+        # One unreadable run must not fail the rest of the chunk: fall back to one run at a time
+        results = {}
+        for metal_path, paths in jobs.items():
+            try: results.update(engine.calibrate_many({metal_path: paths}))
+            except Exception as e: results[metal_path] = f"{type(e).__name__}: {e}"
+    errors = {}
+    for metal_path, output in outputs.items():
+        if isinstance(results[metal_path], str): errors[output] = results[metal_path]; continue
+        try: engine.write_calibrated(output, *results[metal_path])
+        except Exception as e: errors[output] = f"{type(e).__name__}: {e}"
+    return errors
+
+
+def _eigenvalue_job(output, direction_paths, cache_dir):
+    cache = CalibrationCache(cache_dir)
+    calibrated_data = {d: cache.read_calibrated(p) for d, p in direction_paths.items()}
+    base = np.asarray(calibrated_data[min(calibrated_data)]['Frequency'])
+    for d, df in calibrated_data.items():
+        freqs = np.asarray(df['Frequency'])
+        if len(freqs) != len(base) or not np.allclose(freqs, base):
+            calibrated_data[d] = pd.DataFrame({'Frequency': base, 'Z_Calibrated_Real': np.interp(base, freqs, df['Z_Calibrated_Real']), 'Z_Calibrated_Imag': np.interp(base, freqs, df['Z_Calibrated_Imag'])})
+    write_eigenvalue_csv(output, MPTCalculator().calculate_eigenvalues(calibrated_data))
+    return {}
+
+
+def _run_jobs(pool, fn, jobs, manifest, stage):
+    """
+    Run jobs on the pool, recording every written output in the manifest
+
+    Each job is (items, args): `items` lists the (output, inputs, params) the task
+    writes and `args` are passed to `fn`, which returns {output: error message}
+    for outputs it could not write. Returns the number of failed outputs.
+    """
+    failed, done, total = 0, 0, sum(len(items) for items, _ in jobs)
+    futures = {pool.submit(fn, *args): items for items, args in jobs}
+    for future in as_completed(futures):
+        items = futures[future]
+        try: errors = future.result()
+        except Exception as e: errors = {output: str(e) for output, _, _ in items}
+        for output, inputs, params in items:
+            done += 1
+            if output in errors: failed += 1; print(f"[{stage} {done}/{total}] FAILED {output}: {errors[output]}", file=sys.stderr); continue
+            manifest.record(output, inputs, params); print(f"[{stage} {done}/{total}] {output}")
+    manifest.save()
+    return failed
+
+
+def sample_groups(catalog):
+    """{sample_dir: (sample_name, {direction: calibrated_path})}, newest calibrated run per direction"""
+    groups = {}
+    for run in catalog.runs(type='metal', calibrated_only=True):
+        if run['direction'] is None or run['sample'] is None: continue
+        # Sample_N is the third level below the root, whether or not the run folder is timestamp-named
+        sample_dir = os.path.join(catalog.root, *os.path.relpath(run['run_dir'], catalog.root).split(os.sep)[:3])
+        sample_name = f"{os.path.basename(os.path.dirname(sample_dir)).capitalize()}_{os.path.basename(sample_dir)}"
+        groups.setdefault(sample_dir, (sample_name, {}))[1][run['direction']] = run['calibrated_path']
+    return groups
+
+
+def update_cubes(groups):
+    """Update the MPT cube store of every metal folder from sample_groups(); returns {metal_dir: slots rewritten}"""
+    metals = {}
+    for sample_dir, (_, directions) in groups.items():
+        metals.setdefault(os.path.dirname(sample_dir), {})[os.path.basename(sample_dir)] = directions
+    return {metal_dir: MPTCubeStore(metal_dir).update(samples) for metal_dir, samples in sorted(metals.items())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate every metal run and compute MPT eigenvalues for a Measurement_Data tree")
+    parser.add_argument("root", nargs="?", default="Measurement_Data", help="Measurement_Data root folder")
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size (default: CPU count)")
+    parser.add_argument("--before-only", action="store_true", help="Only match reference runs taken before the metal run")
+    parser.add_argument("--within", type=float, default=None, help="Maximum reference time difference in minutes")
+    parser.add_argument("--points", type=int, default=CALIBRATION_POINTS, help="Calibrated frequency grid size")
+    parser.add_argument("--force", action="store_true", help="Recompute outputs even if their inputs are unchanged")
+    parser.add_argument("--skip-eigen", action="store_true", help="Only write calibrated files")
+    parser.add_argument("--skip-cube", action="store_true", help="Do not update the per-metal MPT cube stores")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.root): parser.error(f"{args.root} is not a directory")
+
+    start = time.time(); root_name = os.path.basename(os.path.abspath(args.root))
+    catalog = MeasurementCatalog(args.root); index = TimestampIndex(args.root); manifest = Manifest(args.root)
+    within = args.within * 60 if args.within is not None else None
+    metal_runs = catalog.runs(type='metal', summary_only=True, timestamped_only=True)
+    print(f"Found {len(metal_runs)} metal runs under {args.root}")
+
+    groups, unmatched, skipped = {}, 0, 0
+    for paths in match_references(metal_runs, index, args.before_only, within):
+        if not all(paths.values()): unmatched += 1; print(f"No background/ferrite match for {paths['metal']}", file=sys.stderr); continue
+        output = os.path.join(os.path.dirname(paths['metal']), calibrated_filename(paths['metal'], root_name))
+        inputs, params = list(paths.values()), {'points': args.points}
+        if not args.force and manifest.up_to_date(output, inputs, params): skipped += 1; continue
+        group = groups.setdefault((paths['bg_metal'], paths['ferrite'], paths['bg_ferrite']), ([], {}, {}))
+        group[0].append((output, inputs, params)); group[1][paths['metal']] = output; group[2][paths['metal']] = paths
+    cache_dir = os.path.join(args.root, CALIBRATION_CACHE_DIRNAME)
+    # Split groups sharing one reference set into ~N/workers chunks so a single-session tree still uses every worker
+    n_calibrate = sum(len(items) for items, _, _ in groups.values()); chunk = max(1, -(-n_calibrate // (args.workers or os.cpu_count() or 1)))
+    cal_jobs = []
+    for items, outputs, jobs in groups.values():
+        metal_of = {output: metal for metal, output in outputs.items()}
+        for first in range(0, len(items), chunk):
+            part = items[first:first + chunk]; metals = [metal_of[output] for output, _, _ in part]
+            cal_jobs.append((part, ({m: outputs[m] for m in metals}, {m: jobs[m] for m in metals}, args.points, cache_dir)))
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        print(f"Calibration: {n_calibrate} to compute in {len(cal_jobs)} tasks ({len(groups)} reference groups), {skipped} unchanged, {unmatched} unmatched")
+        if cal_jobs: failed += _run_jobs(pool, _calibrate_job, cal_jobs, manifest, "calibrate")
+        if not args.skip_eigen:
+            eig_jobs, skipped = [], 0; catalog.refresh(force=True)
+            for sample_dir, (sample_name, directions) in sorted(sample_groups(catalog).items()):
+                if len(directions) < 6: print(f"Skipping {sample_name}: only {len(directions)} calibrated directions", file=sys.stderr); continue
+                output = os.path.join(sample_dir, f"{sample_name}_Eigenvalues.csv")
+                inputs = [directions[d] for d in sorted(directions)]
+                if not args.force and manifest.up_to_date(output, inputs, {}): skipped += 1; continue
+                eig_jobs.append(([(output, inputs, {})], (output, directions, cache_dir)))
+            print(f"Eigenvalues: {len(eig_jobs)} to compute, {skipped} unchanged")
+            if eig_jobs: failed += _run_jobs(pool, _eigenvalue_job, eig_jobs, manifest, "eigen")
+    if not args.skip_cube:
+        catalog.refresh(force=True)
+        for metal_dir, n_updated in update_cubes(sample_groups(catalog)).items():
+            print(f"Cube {os.path.join(metal_dir, MPTCubeStore.CUBE_FILENAME)}: {n_updated} slots updated")
+    catalog.close()
+    print(f"Done in {time.time() - start:.1f} s ({failed} failed)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Shared pytest fixtures: a simulated Red Pitaya so Background can run without hardware."""
+
+import numpy as np
+import pytest
+
+import rp_scpi
+
+
+class FakeRedPitaya:
+    """
+    Minimal SCPI stand-in for rp_scpi.scpi
+
+    Records every command in `log`, tracks the generator frequency/amplitude and
+    the input gain, and answers DMA reads with a sine on both channels scaled
+    by `kv` / `ki` (current lags by `phase` rad) plus a little noise.
+    """
+
+    def __init__(self, ip=None, kv=0.5, ki=0.05, phase=0.3, noise=1e-4, seed=0):
+        self.log = []
+        self.last = None
+        self.frequency = None
+        self.amplitude = 0.0
+        self.gain = {1: 'LV', 2: 'LV'}
+        self.kv, self.ki, self.phase, self.noise = kv, ki, phase, noise
+        self.rng = np.random.default_rng(seed)
+
+    def tx_txt(self, cmd):
+        self.log.append(cmd)
+        self.last = cmd
+        if cmd.startswith('SOUR1:FREQ:FIX'):
+            self.frequency = float(cmd.split()[1])
+        elif cmd.startswith('SOUR1:VOLT'):
+            self.amplitude = float(cmd.split()[1])
+        elif ':GAIN' in cmd:
+            self.gain[int(cmd[8])] = cmd.split()[1]
+
+    def txrx_txt(self, cmd):
+        self.tx_txt(cmd)
+        return {'ACQ:AXI:START?': '16777216', 'ACQ:AXI:SIZE?': '2097152'}.get(cmd, '0')
+
+    def rx_txt(self):
+        cmd = self.last
+        if cmd == 'ACQ:TRig:STAT?':
+            return 'TD'
+        if cmd.endswith('FILL?'):
+            return '1'
+        if 'DATA:Start:N?' in cmd:
+            n = int(cmd.split(',')[1])
+            decimation = next((int(c.split()[1]) for c in reversed(self.log) if c.startswith('ACQ:AXI:DEC')), 256)
+            t = np.arange(n) * decimation / 125e6
+            channel = 1 if 'SOUR1' in cmd else 2
+            scale, phase = (self.kv, 0.0) if channel == 1 else (self.ki, -self.phase)
+            x = scale * self.amplitude * np.sin(2 * np.pi * self.frequency * t + phase) + self.rng.normal(0, self.noise, n)
+            full_scale = {'LV': 1.0, 'HV': 20.0}[self.gain[channel]]
+            return '{' + ','.join(f"{v:.6f}" for v in np.clip(x, -full_scale, full_scale)) + '}'
+        return ''
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_rp(monkeypatch):
+    """Patch rp_scpi.scpi so Background() connects to a FakeRedPitaya; returns the instances created"""
+    created = []
+
+    def factory(*args, **kwargs):
+        rp = FakeRedPitaya(*args, **kwargs)
+        created.append(rp)
+        return rp
+
+    monkeypatch.setattr(rp_scpi, 'scpi', factory)
+    return created
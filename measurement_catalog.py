@@ -0,0 +1,482 @@
+"""Persistent index of the runs stored under Measurement_Data."""
+
+import bisect
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+RUN_DIR_PATTERN = re.compile(r"^\d{8}-\d{6}$")
+TIMESTAMP_FORMAT = '%Y%m%d-%H%M%S'
+EPOCH = datetime(1970, 1, 1)
+
+
+def timestamp_seconds(dt):
+    """Naive datetime -> seconds since 1970-01-01 (no timezone conversion, so it round-trips exactly)"""
+    return (dt - EPOCH).total_seconds()
+
+
+def parse_run_parts(parts):
+    """
+    Split the path of a run folder relative to Measurement_Data into its fields
+
+    Parameters:
+    -----------
+    parts : list of str
+        e.g. ['metal', 'aluminum', 'Sample_1', 'Direction_5', '20231027-144000']
+        or ['background', '20231027-143000']
+
+    Returns:
+    --------
+    info : dict
+        'type', 'metal', 'sample', 'direction' (None when not applicable) and 'timestamp'
+        (seconds, None when the folder name is not a run timestamp)
+    """
+    info = {'type': parts[0] if len(parts) > 1 else None, 'metal': None, 'sample': None, 'direction': None, 'timestamp': None}
+    if parts and RUN_DIR_PATTERN.match(parts[-1]):
+        info['timestamp'] = timestamp_seconds(datetime.strptime(parts[-1], TIMESTAMP_FORMAT))
+    if info['type'] == 'metal' and len(parts) >= 3:
+        info['metal'] = parts[1].lower()
+        sample = re.match(r"Sample_(\d+)$", parts[2], re.IGNORECASE)
+        info['sample'] = int(sample.group(1)) if sample else None
+        for part in parts[3:]:
+            direction = re.search(r"Direction_(\d+)", part)
+            if direction:
+                info['direction'] = int(direction.group(1))
+                break
+    return info
+
+
+class MeasurementCatalog:
+    """
+    SQLite catalog of every run folder under Measurement_Data
+
+    Every folder holding summary_results.csv or a ``*_CALIBRATED.csv`` file is
+    stored as a run with its type, metal, sample, direction, timestamp, point
+    count and the paths of its summary and calibrated files. Folders that are not
+    named like a run timestamp (e.g. a calibrated file saved to a new location)
+    are indexed too, with timestamp None. refresh() is incremental: every
+    directory's mtime is remembered and only directories whose mtime changed are
+    listed again, plus one stat of each summary_results.csv so appended points
+    update point_count. ``*_Eigenvalues.csv`` files are listed in a separate
+    table (eigenvalue_files). Hidden folders and raw_freq_data/ are never walked.
+    Queries refresh at most every `min_refresh_interval` seconds; call
+    invalidate() after writing new results so the next query sees them.
+
+    Paths are returned joined onto `root` exactly as it was given, matching the
+    relative "Measurement_Data/..." paths used throughout the GUI.
+
+    Example:
+    --------
+    catalog = MeasurementCatalog("Measurement_Data")
+    summaries = catalog.find_summaries(os.path.join("Measurement_Data", "metal", "aluminum"))
+    """
+
+    DB_FILENAME = "catalog.sqlite"
+    SCHEMA_VERSION = 3
+    SKIP_DIRS = ("raw_freq_data",)
+
+    def __init__(self, root="Measurement_Data", db_path=None, min_refresh_interval=2.0):
+        self.root = root
+        self.db_path = db_path or os.path.join(root, self.DB_FILENAME)
+        self.min_refresh_interval = min_refresh_interval
+        self._last_refresh = None
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+                # The catalog is only an index of the tree, so an old layout is simply rebuilt
+                self._conn.executescript("DROP TABLE IF EXISTS runs; DROP TABLE IF EXISTS dirs; DROP TABLE IF EXISTS files;")
+                self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_dir TEXT PRIMARY KEY, type TEXT, metal TEXT, sample INTEGER, direction INTEGER,
+                    timestamp REAL, point_count INTEGER, summary_path TEXT, calibrated_path TEXT, summary_mtime_ns INTEGER);
+                CREATE INDEX IF NOT EXISTS runs_type_time ON runs(type, timestamp);
+                CREATE INDEX IF NOT EXISTS runs_sample ON runs(metal, sample, direction);
+                CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER);
+                CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+                CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT, kind TEXT);
+                CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+            """)
+
+    # --- indexing ---
+    def _abs(self, rel):
+        return os.path.join(self.root, rel) if rel else self.root
+
+    def _count_points(self, summary_path):
+        try:
+            with open(summary_path, 'rb') as fp:
+                return max(sum(1 for line in fp if line.strip()) - 1, 0)
+        except OSError:
+            return 0
+
+    def _summary_mtime(self, rel):
+        try:
+            return os.stat(os.path.join(self._abs(rel), "summary_results.csv")).st_mtime_ns
+        except OSError:
+            return None
+
+    def _index_run(self, rel, names):
+        """Insert or update the run row of folder `rel` given its file names (drops it if it holds no results)"""
+        self._conn.execute("DELETE FROM files WHERE dir = ?", (rel,))
+        self._conn.executemany("INSERT INTO files VALUES (?, ?, 'eigenvalues')", [(os.path.join(rel, n), rel) for n in names if n.endswith("_Eigenvalues.csv")])
+        calibrated = sorted(n for n in names if n.endswith("_CALIBRATED.csv"))
+        has_summary = "summary_results.csv" in names
+        if not has_summary and not calibrated:
+            self._conn.execute("DELETE FROM runs WHERE run_dir = ?", (rel,))
+            return
+        info = parse_run_parts(rel.split(os.sep) if rel else [])
+        summary_rel = os.path.join(rel, "summary_results.csv") if has_summary else None
+        self._conn.execute(
+            "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (rel, info['type'], info['metal'], info['sample'], info['direction'], info['timestamp'],
+             self._count_points(self._abs(summary_rel)) if has_summary else 0, summary_rel,
+             os.path.join(rel, calibrated[-1]) if calibrated else None,
+             self._summary_mtime(rel) if has_summary else None))
+
+    def _forget(self, rel):
+        like = rel.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + os.sep + '%'
+        self._conn.execute("DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'", (rel, like))
+        self._conn.execute("DELETE FROM runs WHERE run_dir = ? OR run_dir LIKE ? ESCAPE '\\'", (rel, like))
+        self._conn.execute("DELETE FROM files WHERE dir = ? OR dir LIKE ? ESCAPE '\\'", (rel, like))
+
+    def invalidate(self):
+        """Make the next query refresh regardless of min_refresh_interval (cheap, no I/O)"""
+        with self._lock:
+            self._last_refresh = None
+
+    def refresh(self, force=False):
+        """Bring the catalog up to date with the directory tree; returns the number of directories re-listed"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._last_refresh is not None and now - self._last_refresh < self.min_refresh_interval:
+                return 0
+            known = {row['path']: row['mtime_ns'] for row in self._conn.execute("SELECT path, mtime_ns FROM dirs")}
+            children = {}
+            for row in self._conn.execute("SELECT path, parent FROM dirs WHERE parent IS NOT NULL"):
+                children.setdefault(row['parent'], []).append(row['path'])
+            summaries = {row['run_dir']: row['summary_mtime_ns'] for row in self._conn.execute("SELECT run_dir, summary_mtime_ns FROM runs WHERE summary_path IS NOT NULL")}
+            relisted = 0
+            stack = [""]
+            with self._conn:
+                while stack:
+                    rel = stack.pop()
+                    try:
+                        mtime_ns = os.stat(self._abs(rel)).st_mtime_ns
+                    except OSError:
+                        self._forget(rel)
+                        continue
+                    if known.get(rel) == mtime_ns:
+                        # Appending points rewrites the summary in place without touching the folder mtime
+                        if rel in summaries and self._summary_mtime(rel) != summaries[rel]:
+                            self._index_run(rel, os.listdir(self._abs(rel)))
+                        stack.extend(children.get(rel, []))
+                        continue
+                    relisted += 1
+                    self._conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (rel, os.path.dirname(rel) if rel else None, mtime_ns))
+                    current, names = set(), []
+                    with os.scandir(self._abs(rel)) as entries:
+                        for entry in entries:
+                            if entry.is_dir():
+                                if not entry.name.startswith('.') and entry.name not in self.SKIP_DIRS:
+                                    current.add(os.path.join(rel, entry.name) if rel else entry.name)
+                            else:
+                                names.append(entry.name)
+                    self._index_run(rel, names)
+                    for gone in set(children.get(rel, [])) - current:
+                        self._forget(gone)
+                    stack.extend(current)
+            self._last_refresh = time.monotonic()
+            return relisted
+
+    # --- queries ---
+    def _rows(self, sql, args=()):
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def _row_to_dict(self, row):
+        run = dict(row)
+        run['run_dir'] = self._abs(run['run_dir'])
+        run['summary_path'] = self._abs(run['summary_path']) if run['summary_path'] else None
+        run['calibrated_path'] = self._abs(run['calibrated_path']) if run['calibrated_path'] else None
+        run['datetime'] = EPOCH + timedelta(seconds=run['timestamp']) if run['timestamp'] is not None else None
+        return run
+
+    def relative_prefix(self, folder):
+        """Path of `folder` relative to the catalog root, or None if it lies outside the root"""
+        rel = os.path.relpath(os.path.abspath(folder), os.path.abspath(self.root))
+        if rel == os.curdir:
+            return ""
+        if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            return None
+        return rel
+
+    def runs(self, type=None, metal=None, sample=None, direction=None, under=None, calibrated_only=False, summary_only=False, timestamped_only=False):
+        """
+        Runs matching the given fields, ordered by timestamp (folders without one first)
+
+        `under` restricts to a folder, `calibrated_only` / `summary_only` to folders
+        holding that file and `timestamped_only` to timestamp-named run folders.
+        """
+        self.refresh()
+        clauses, args = [], []
+        for column, value in (('type', type), ('metal', metal.lower() if metal else None), ('sample', sample), ('direction', direction)):
+            if value is not None:
+                clauses.append(f"{column} = ?"); args.append(value)
+        if under is not None:
+            prefix = self.relative_prefix(under)
+            if prefix is None:
+                return []
+            if prefix:
+                like = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + os.sep + '%'
+                clauses.append("(run_dir = ? OR run_dir LIKE ? ESCAPE '\\')"); args.extend([prefix, like])
+        if calibrated_only:
+            clauses.append("calibrated_path IS NOT NULL")
+        if summary_only:
+            clauses.append("summary_path IS NOT NULL")
+        if timestamped_only:
+            clauses.append("timestamp IS NOT NULL")
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        return self._rows(f"SELECT * FROM runs{where} ORDER BY timestamp", args)
+
+    def find_summaries(self, folder):
+        """
+        summary_results.csv paths under `folder` (same result as walking it with os.walk,
+        except that hidden folders and raw_freq_data/ are skipped)
+
+        Returns None when `folder` is outside the catalog root so callers can fall back to a walk.
+        """
+        prefix = self.relative_prefix(folder)
+        if prefix is None:
+            return None
+        runs = self.runs(under=folder, summary_only=True)
+        root_abs = os.path.join(self.root, prefix) if prefix else self.root
+        return [os.path.join(folder, os.path.relpath(run['summary_path'], root_abs)) for run in runs]
+
+    def eigenvalue_files(self, folder=None):
+        """
+        Sorted *_Eigenvalues.csv paths under `folder` (default: the whole root)
+
+        Returns None when `folder` is outside the catalog root so callers can fall back to a walk.
+        """
+        folder = self.root if folder is None else folder
+        prefix = self.relative_prefix(folder)
+        if prefix is None:
+            return None
+        self.refresh()
+        clause, args = "", ()
+        if prefix:
+            like = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + os.sep + '%'
+            clause, args = " WHERE dir = ? OR dir LIKE ? ESCAPE '\\'", (prefix, like)
+        with self._lock:
+            rows = self._conn.execute(f"SELECT path FROM files{clause} ORDER BY path", args).fetchall()
+        return sorted(os.path.join(folder, os.path.relpath(row['path'], prefix) if prefix else row['path']) for row in rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TimestampIndex:
+    """
+    Sorted in-memory index of reference run timestamps (background / calibration)
+
+    Each run type keeps a sorted list of timestamps (seconds, see
+    timestamp_seconds) with the matching summary paths, so nearest-neighbour
+    matching is a bisect. A type is only re-listed when its folder's mtime
+    changes, i.e. when a run folder is added or removed; run folders that had
+    no summary_results.csv yet are re-checked on every refresh.
+
+    Example:
+    --------
+    index = TimestampIndex("Measurement_Data")
+    path, delta = index.nearest('background', metal_dt, before_only=True, within=30 * 60)
+    """
+
+    def __init__(self, root="Measurement_Data", types=('background', 'calibration')):
+        self.root = root
+        self.types = tuple(types)
+        self._lock = threading.RLock()
+        self._mtime = {}
+        self._pending = {t: set() for t in self.types}
+        self._times = {t: [] for t in self.types}
+        self._paths = {t: [] for t in self.types}
+
+    def _rebuild(self, run_type, folder):
+        entries, pending = [], set()
+        for name in os.listdir(folder):
+            if not RUN_DIR_PATTERN.match(name):
+                continue
+            summary_path = os.path.join(folder, name, "summary_results.csv")
+            if os.path.exists(summary_path):
+                entries.append((timestamp_seconds(datetime.strptime(name, TIMESTAMP_FORMAT)), summary_path))
+            elif os.path.isdir(os.path.join(folder, name)):
+                pending.add(name)
+        entries.sort()
+        self._times[run_type] = [t for t, _ in entries]
+        self._paths[run_type] = [p for _, p in entries]
+        self._pending[run_type] = pending
+
+    def refresh(self):
+        with self._lock:
+            for run_type in self.types:
+                folder = os.path.join(self.root, run_type)
+                try:
+                    mtime_ns = os.stat(folder).st_mtime_ns
+                except OSError:
+                    self._mtime.pop(run_type, None); self._times[run_type] = []; self._paths[run_type] = []
+                    continue
+                if self._mtime.get(run_type) != mtime_ns:
+                    self._rebuild(run_type, folder)
+                    self._mtime[run_type] = mtime_ns
+                    continue
+                for name in list(self._pending[run_type]):
+                    summary_path = os.path.join(folder, name, "summary_results.csv")
+                    if os.path.exists(summary_path):
+                        t = timestamp_seconds(datetime.strptime(name, TIMESTAMP_FORMAT))
+                        i = bisect.bisect_left(self._times[run_type], t)
+                        self._times[run_type].insert(i, t); self._paths[run_type].insert(i, summary_path)
+                        self._pending[run_type].discard(name)
+
+    def covers(self, search_dir):
+        """True if `search_dir` is one of the indexed reference folders"""
+        return os.path.abspath(os.path.dirname(search_dir)) == os.path.abspath(self.root) and os.path.basename(search_dir) in self.types
+
+    def nearest(self, run_type, target, before_only=False, within=None):
+        """
+        Nearest run of `run_type` to `target`
+
+        Parameters:
+        -----------
+        run_type : str
+            'background' or 'calibration'
+        target : datetime or float
+            Target time (datetime or seconds from timestamp_seconds)
+        before_only : bool
+            Only consider runs taken at or before the target
+        within : float, optional
+            Maximum allowed distance in seconds
+
+        Returns:
+        --------
+        path, delta : str, float
+            summary_results.csv of the match and |Δt| in seconds, or (None, None)
+        """
+        self.refresh()
+        t = timestamp_seconds(target) if isinstance(target, datetime) else float(target)
+        with self._lock:
+            times, paths = self._times[run_type], self._paths[run_type]
+            i = bisect.bisect_right(times, t)
+            best = None
+            for j in ((i - 1,) if before_only else (i - 1, i)):
+                if 0 <= j < len(times) and (best is None or abs(times[j] - t) < best[1]):
+                    best = (j, abs(times[j] - t))
+            if best is None or (within is not None and best[1] > within):
+                return None, None
+            return paths[best[0]], best[1]
+
+    def nearest_many(self, run_type, targets, before_only=False, within=None):
+        """
+        Vectorised nearest() for many targets at once (batch matching)
+
+        Returns:
+        --------
+        paths : list
+            Matched summary path (or None) per target
+        deltas : np.ndarray
+            |Δt| in seconds per target (NaN where unmatched)
+        """
+        self.refresh()
+        t = np.array([timestamp_seconds(x) if isinstance(x, datetime) else float(x) for x in targets], dtype=float)
+        with self._lock:
+            times, paths = np.asarray(self._times[run_type], dtype=float), list(self._paths[run_type])
+        if times.size == 0:
+            return [None] * len(t), np.full(len(t), np.nan)
+        right = np.searchsorted(times, t, side='right')
+        before = right - 1
+        delta_before = np.where(before >= 0, np.abs(t - times[np.clip(before, 0, None)]), np.inf)
+        if before_only:
+            idx, delta = before, delta_before
+        else:
+            delta_after = np.where(right < times.size, np.abs(times[np.clip(right, None, times.size - 1)] - t), np.inf)
+            use_after = delta_after < delta_before
+            idx, delta = np.where(use_after, right, before), np.where(use_after, delta_after, delta_before)
+        ok = np.isfinite(delta) & ((delta <= within) if within is not None else True)
+        return [paths[j] if ok[k] else None for k, j in enumerate(idx)], np.where(ok, delta, np.nan)
+
+
+class DatasetCache:
+    """
+    Shared cache of parsed CSV datasets (summary, calibrated and eigenvalue files)
+
+    Entries are keyed by path and validated against the file's mtime and size on
+    every lookup, so an edited or re-measured file is parsed again. Each entry
+    holds the numeric columns as read-only NumPy arrays; the least recently used
+    entries are evicted once the total array size exceeds `max_bytes`. Safe to
+    use from worker threads (parsing happens outside the lock).
+
+    Example:
+    --------
+    cache = DatasetCache()
+    data = cache.get("Measurement_Data/background/20231027-143000/summary_results.csv")
+    plt.plot(data['Frequency'], data['Z_Real'])
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse(path):
+        df = pd.read_csv(path)
+        data = {}
+        for column in df.columns:
+            if pd.api.types.is_numeric_dtype(df[column]):
+                values = df[column].to_numpy(dtype=np.float64, copy=True)
+                values.setflags(write=False)
+                data[column] = values
+        return data
+
+    def get(self, path):
+        """Parsed numeric columns of `path` as {column: np.ndarray}"""
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+        data = self._parse(path)
+        size = sum(values.nbytes for values in data.values())
+        with self._lock:
+            self.misses += 1
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self._entries[path] = (signature, data, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_size
+        return data
+
+    def invalidate(self, path=None):
+        """Drop one path (or everything when path is None)"""
+        with self._lock:
+            if path is None:
+                self._entries.clear(); self.nbytes = 0
+            elif path in self._entries:
+                self.nbytes -= self._entries.pop(path)[2]
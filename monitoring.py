@@ -0,0 +1,65 @@
+"""Fixed-frequency monitoring: bounded per-frequency history with rolling statistics."""
+
+import numpy as np
+
+MONITOR_COLUMNS = ["Timestamp", "Elapsed_s", "Frequency", "Z_Real", "Z_Imaginary", "Z_Magnitude", "Z_Phase", "Voltage_Real", "Voltage_Imaginary", "Current_Real", "Current_Imaginary"]
+MONITOR_FILENAME = "monitor_timeseries.csv"
+
+
+class MonitorBuffer:
+    """
+    Ring buffer of complex impedance samples per monitored frequency
+
+    Memory is allocated once, (frequencies x capacity) times and values, so a
+    session of any length holds at most the newest `capacity` samples per
+    frequency; the full record is the time-series file. Rolling statistics
+    cover the newest `window` samples.
+
+    Example:
+    --------
+    buffer = MonitorBuffer([1000, 10000], capacity=2000, window=50)
+    buffer.append(0, elapsed, z)
+    t, z = buffer.series(0)
+    mean, sd_real, sd_imag, n = buffer.stats(0)
+    """
+
+    def __init__(self, frequencies, capacity=2000, window=50):
+        self.frequencies = [float(f) for f in frequencies]
+        self.capacity = int(capacity)
+        self.window = int(window)
+        self._t = np.full((len(self.frequencies), self.capacity), np.nan)
+        self._z = np.full((len(self.frequencies), self.capacity), np.nan, dtype=np.complex128)
+        self._count = np.zeros(len(self.frequencies), dtype=np.int64)
+
+    def __len__(self):
+        return int(self._count.sum())
+
+    def append(self, k, t, z):
+        """Store sample `z` taken at time `t` (s) for frequency index `k`"""
+        i = self._count[k] % self.capacity
+        self._t[k, i] = t; self._z[k, i] = z; self._count[k] += 1
+
+    def _recent(self, k, n):
+        """Ring indices of the newest `n` samples of frequency `k`, oldest first"""
+        n = min(int(n), int(self._count[k]), self.capacity)
+        return (self._count[k] - n + np.arange(n)) % self.capacity
+
+    def series(self, k):
+        """(t, z) of the buffered samples of frequency `k`, oldest first"""
+        idx = self._recent(k, self.capacity)
+        return self._t[k, idx], self._z[k, idx]
+
+    def stats(self, k, window=None):
+        """
+        Rolling statistics over the newest `window` samples of frequency `k`
+
+        Returns:
+        --------
+        mean, sd_real, sd_imag, n
+            Complex mean, sample SD of the real and imaginary parts (NaN below
+            two samples) and the number of samples used
+        """
+        z = self._z[k, self._recent(k, window or self.window)]
+        if not len(z): return complex(np.nan, np.nan), np.nan, np.nan, 0
+        sd_real, sd_imag = (z.real.std(ddof=1), z.imag.std(ddof=1)) if len(z) > 1 else (np.nan, np.nan)
+        return complex(z.mean()), float(sd_real), float(sd_imag), len(z)
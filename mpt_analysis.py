@@ -0,0 +1,557 @@
+"""Tk-free calibration and MPT eigenvalue analysis shared by the GUI and batch_pipeline."""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+CALIBRATION_POINTS = 200
+CALIBRATION_CACHE_DIRNAME = ".calibration_cache"
+EIGENVALUE_COLUMNS = ['Frequency', 'Eig1_Real', 'Eig1_Imag', 'Eig2_Real', 'Eig2_Imag', 'Eig3_Real', 'Eig3_Imag']
+
+
+class MPTCalculator:
+    """
+    Magnetic polarizability tensor (MPT) eigenvalues from calibrated direction responses
+
+    Each measured direction d gives Z_d = h^T M h for the unit vector h = H16[d-1],
+    so the six independent entries of the symmetric tensor M follow from a
+    least-squares fit over at least 6 directions.
+    """
+
+    TENSOR_INDEX = np.array([[0, 1, 2], [1, 3, 4], [2, 4, 5]])
+
+    def __init__(self):
+        C0, C1, C2, C3 = (0.927050983124842272, 1.330586997335501411, 2.152934986677507057, 2.427050983124842272)
+        self.H16 = np.array([[C2,C1,0],[1.5,1.5,1.5],[0,C0,C3],[-C1,0,C2],[-1.5,-1.5,1.5],[-C0,-C3,0],[0,-C2,-C1],[1.5,-1.5,-1.5],[C3,0,-C0],[C3,0,C0],[C1,0,C2],[0,-C0,C3],[0,-C2,C1],[C0,-C3,0],[C2,-C1,0],[1.5,-1.5,1.5]])
+        self._pinv_cache = {}
+        self._memo = OrderedDict()
+        self.max_memo = 64
+
+    def design_pinv(self, selected_dirs):
+        """Pseudo-inverse (6, D) of the direction design matrix, cached per direction set."""
+        key = tuple(selected_dirs)
+        if key not in self._pinv_cache:
+            h = self.H16[[d - 1 for d in key]]; h = h / np.linalg.norm(h, axis=1, keepdims=True)
+            A = np.stack([h[:, 0]**2, 2*h[:, 0]*h[:, 1], 2*h[:, 0]*h[:, 2], h[:, 1]**2, 2*h[:, 1]*h[:, 2], h[:, 2]**2], axis=1)
+            self._pinv_cache[key] = np.linalg.pinv(A, rcond=np.finfo(float).eps * max(A.shape))
+        return self._pinv_cache[key]
+
+    def tensors(self, V, selected_dirs):
+        """Symmetric (..., 3, 3) tensors from direction responses V shaped (..., D), all frequencies/samples in one product."""
+        m = np.asarray(V, dtype=np.complex128) @ self.design_pinv(selected_dirs).T
+        return m[..., self.TENSOR_INDEX]
+
+    @staticmethod
+    def eigenvalues(M):
+        """Eigenvalues of a (..., 3, 3) stack (e.g. (S, N, 3, 3)), sorted by real part along the last axis."""
+        ev = np.linalg.eigvals(M)
+        return np.take_along_axis(ev, np.argsort(ev.real, axis=-1, kind='stable'), axis=-1)
+
+    def calculate_eigenvalues(self, calibrated_data):
+        if len(calibrated_data) < 6: raise ValueError("ต้องมีข้อมูลอย่างน้อย 6 ทิศทางในการคำนวณ")
+        selected_dirs = sorted(calibrated_data.keys()); freqs = np.asarray(calibrated_data[selected_dirs[0]]['Frequency'])
+        V = np.stack([np.asarray(calibrated_data[d]['Z_Calibrated_Real']) + 1j * np.asarray(calibrated_data[d]['Z_Calibrated_Imag']) for d in selected_dirs], axis=-1)
+        ev = self.eigenvalues(self.tensors(V, selected_dirs))
+        return {'freq': freqs, 'eig1_real': ev[:, 0].real, 'eig1_imag': ev[:, 0].imag, 'eig2_real': ev[:, 1].real, 'eig2_imag': ev[:, 1].imag, 'eig3_real': ev[:, 2].real, 'eig3_imag': ev[:, 2].imag}
+
+    def eigenvalues_for_files(self, direction_paths, loader=pd.read_csv):
+        """
+        calculate_eigenvalues for {direction: _CALIBRATED.csv path}, memoised
+
+        Results are keyed by the selected directions and each file's path, mtime
+        and size, so asking again for an unchanged selection returns the same dict
+        without reading anything; changing one direction of one sample only
+        recomputes that sample. The loaded datasets are kept under 'original_data'.
+
+        Returns:
+        --------
+        results, cached : dict, bool
+        """
+        key = tuple((d, p, *file_fingerprint(p)) for d, p in sorted(direction_paths.items()))
+        if key in self._memo:
+            self._memo.move_to_end(key); return self._memo[key], True
+        calibrated_data = {d: loader(p) for d, p in direction_paths.items()}
+        results = self.calculate_eigenvalues(calibrated_data); results['original_data'] = calibrated_data
+        self._memo[key] = results
+        while len(self._memo) > self.max_memo: self._memo.popitem(last=False)
+        return results, False
+
+    def calculate_eigenvalues_batch(self, V, selected_dirs):
+        """
+        Eigenvalues for many samples sharing one direction set
+
+        V is shaped (S, N, D) (samples, frequencies, directions in `selected_dirs`
+        order); returns complex eigenvalues shaped (S, N, 3), sorted by real part.
+        """
+        if len(selected_dirs) < 6: raise ValueError("ต้องมีข้อมูลอย่างน้อย 6 ทิศทางในการคำนวณ")
+        return self.eigenvalues(self.tensors(V, selected_dirs))
+
+
+def file_fingerprint(path):
+    """(mtime_ns, size) of a file, used to detect changed inputs"""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def label_from_path(path, root_name='Measurement_Data'):
+    """Short display label of a run file, e.g. 'Aluminum_S1_D5 (27-Oct 14:40)' or 'Background (27-Oct 14:30)'"""
+    if not path: return "N/A"
+    try:
+        parts = path.split(os.sep); base_index = parts.index(root_name); info_parts = parts[base_index + 1:]
+        measurement_type = info_parts[0]; timestamp_str = info_parts[-2]; dt_obj = datetime.strptime(timestamp_str, '%Y%m%d-%H%M%S'); formatted_time = dt_obj.strftime('%d-%b %H:%M')
+        if measurement_type == 'metal' and len(info_parts) >= 5:
+            metal = info_parts[1].capitalize(); sample = info_parts[2].replace('Sample_', 'S'); direction = info_parts[3].replace('Direction_', 'D'); return f"{metal}_{sample}_{direction} ({formatted_time})"
+        else: return f"{measurement_type.capitalize()} ({formatted_time})"
+    except (ValueError, IndexError): return os.path.basename(os.path.dirname(path))
+
+
+def calibrated_filename(metal_path, root_name='Measurement_Data'):
+    """File name the calibrated result of a metal summary is saved under"""
+    return label_from_path(metal_path, root_name).replace(' ', '_').replace('(', '').replace(')', '').replace(':', '') + "_CALIBRATED.csv"
+
+
+def cube_slot(calibrated_path, root_name='Measurement_Data'):
+    """(metal_dir, 'Sample_N', direction) of a _CALIBRATED.csv inside the data tree, for MPTCubeStore.update; None elsewhere"""
+    parts = os.path.abspath(calibrated_path).split(os.sep)
+    try: base_index = parts.index(root_name)
+    except ValueError: return None
+    info_parts = parts[base_index + 1:]
+    if len(info_parts) < 5 or info_parts[0] != 'metal' or not (m := re.fullmatch(r"Direction_(\d+)", info_parts[3])) or not re.fullmatch(r"Sample_\d+", info_parts[2]): return None
+    return os.sep.join(parts[:base_index + 3]), info_parts[2], int(m.group(1))
+
+
+def calibration_grid(freqs, n_points=CALIBRATION_POINTS):
+    """Log-spaced frequency axis spanning a metal sweep"""
+    freqs = np.asarray(freqs, dtype=float)
+    return np.logspace(np.log10(max(freqs.min(), 1)), np.log10(freqs.max()), n_points)
+
+
+def interpolate_z(data, freqs):
+    """Complex impedance of a summary dataset (DataFrame or column dict) interpolated onto `freqs`"""
+    return np.interp(freqs, data['Frequency'], data['Z_Real']) + 1j * np.interp(freqs, data['Frequency'], data['Z_Imaginary'])
+
+
+def calibrate(metal, bg_metal, ferrite, bg_ferrite, n_points=CALIBRATION_POINTS):
+    """
+    Background-removed, ferrite-normalised response of a metal run
+
+    Z_cal = (Z_metal - Z_bg_metal) / (Z_ferrite - Z_bg_ferrite) on a log grid of
+    `n_points` spanning the metal sweep; points where the ferrite reference is
+    zero are NaN.
+
+    Parameters:
+    -----------
+    metal, bg_metal, ferrite, bg_ferrite : DataFrame or dict
+        Summary datasets with 'Frequency', 'Z_Real' and 'Z_Imaginary' columns
+
+    Returns:
+    --------
+    freq_axis, z_final : np.ndarray
+    """
+    freq_axis = calibration_grid(metal['Frequency'], n_points)
+    z_bg_removed = interpolate_z(metal, freq_axis) - interpolate_z(bg_metal, freq_axis)
+    z_calibrated_ferrite = interpolate_z(ferrite, freq_axis) - interpolate_z(bg_ferrite, freq_axis)
+    with np.errstate(divide='ignore', invalid='ignore'): z_final = np.divide(z_bg_removed, z_calibrated_ferrite)
+    z_final[z_calibrated_ferrite == 0] = np.nan
+    return freq_axis, z_final
+
+
+def write_calibrated_csv(path, freq, z_final):
+    pd.DataFrame({'Frequency': freq, 'Z_Calibrated_Real': np.real(z_final), 'Z_Calibrated_Imag': np.imag(z_final)}).to_csv(path, index=False)
+
+
+def write_eigenvalue_csv(path, results):
+    pd.DataFrame({'Frequency': results['freq'], 'Eig1_Real': results['eig1_real'], 'Eig1_Imag': results['eig1_imag'], 'Eig2_Real': results['eig2_real'], 'Eig2_Imag': results['eig2_imag'], 'Eig3_Real': results['eig3_real'], 'Eig3_Imag': results['eig3_imag']}).to_csv(path, index=False, float_format='%.6f')
+
+
+class CalibrationCache:
+    """
+    On-disk, content-addressed cache of calibrated curves
+
+    Each entry is ``<sha256>.npz`` (freq float64, z_final complex128) where the
+    key hashes the contents of the four input summaries and the grid size, so a
+    result is reused no matter which tool produced it or where the files were
+    copied, and an edited input simply misses. A _CALIBRATED.csv saved through
+    write_calibrated() is also cached under the digest of its own contents, so
+    read_calibrated() (the Eigenvalue tab) skips parsing it while it is
+    unchanged. File digests are memoised per
+    path with its (mtime, size), keeping the `max_digests` most recently used
+    paths. Entries are touched on every hit and the least recently
+    used ones are deleted once the directory exceeds `max_bytes`. Writes are
+    atomic, so several processes can share one cache directory.
+
+    Example:
+    --------
+    cache = CalibrationCache(os.path.join("Measurement_Data", CALIBRATION_CACHE_DIRNAME))
+    engine = CalibrationEngine(cache=cache)
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, max_digests=1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_digests = max_digests
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+        self._approx_bytes = None
+
+    def file_digest(self, path):
+        st = os.stat(path); signature = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._digests.get(path)
+            if entry is not None and entry[0] == signature:
+                self._digests.move_to_end(path); return entry[1]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''): h.update(block)
+        with self._lock:
+            # A rewritten file replaces its old entry, and the oldest paths go once the bound is reached
+            self._digests[path] = (signature, h.hexdigest()); self._digests.move_to_end(path)
+            while len(self._digests) > self.max_digests: self._digests.popitem(last=False)
+        return h.hexdigest()
+
+    def key(self, paths, n_points=CALIBRATION_POINTS):
+        """Cache key of a calibration from its 'metal', 'bg_metal', 'ferrite' and 'bg_ferrite' files"""
+        h = hashlib.sha256(f"calibration-v1:{n_points}".encode())
+        for role in ('metal', 'bg_metal', 'ferrite', 'bg_ferrite'): h.update(f"{role}={self.file_digest(paths[role])};".encode())
+        return h.hexdigest()
+
+    def file_key(self, path):
+        """Cache key of the curve saved in the calibrated file `path`, from its contents"""
+        return hashlib.sha256(f"calibrated-file-v1:{self.file_digest(path)}".encode()).hexdigest()
+
+    def write_calibrated(self, path, freq, z_final):
+        """write_calibrated_csv, keeping the curve under the written file's digest for read_calibrated"""
+        write_calibrated_csv(path, freq, z_final)
+        self.put(self.file_key(path), freq, z_final)
+
+    def read_calibrated(self, path, loader=pd.read_csv):
+        """Columns of a _CALIBRATED.csv from the cache when its contents match, else loader(path)"""
+        cached = self.get(self.file_key(path))
+        if cached is None: return loader(path)
+        freq, z_final = cached
+        return {'Frequency': freq, 'Z_Calibrated_Real': z_final.real, 'Z_Calibrated_Imag': z_final.imag}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """(freq, z_final) for `key`, or None"""
+        path = self._path(key)
+        try:
+            with np.load(path) as data: freq, z_final = data['freq'], data['z_final']
+            os.utime(path)
+        except (OSError, KeyError, ValueError): return None
+        return freq, z_final
+
+    def put(self, key, freq, z_final):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f: np.savez(f, freq=np.asarray(freq, dtype=np.float64), z_final=np.asarray(z_final, dtype=np.complex128))
+        size = os.path.getsize(tmp_path); os.replace(tmp_path, self._path(key))
+        with self._lock:
+            if self._approx_bytes is not None: self._approx_bytes += size
+            needs_scan = self._approx_bytes is None or self._approx_bytes > self.max_bytes
+        if needs_scan: self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(".npz"):
+                        try: st = entry.stat(); entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                        except OSError: continue
+        except OSError: pass
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes: break
+            try: os.remove(path); total -= size
+            except OSError: continue
+        with self._lock: self._approx_bytes = total
+
+
+class CalibrationEngine:
+    """
+    Calibration of many metal runs that share reference files
+
+    Metal runs are grouped by their (bg_metal, ferrite, bg_ferrite) references and
+    frequency grid; each reference is read and interpolated once per grid (cached
+    by path, mtime and size), and every group is calibrated as one 2-D array
+    operation, so the cost grows with the number of unique references rather
+    than with the number of metal files. Safe to share between worker threads.
+
+    Example:
+    --------
+    engine = CalibrationEngine()
+    results = engine.calibrate_many({metal_path: paths, ...})   # paths from match_references
+    freq, z_final = results[metal_path]
+    """
+
+    def __init__(self, loader=pd.read_csv, n_points=CALIBRATION_POINTS, max_cached=256, cache=None):
+        """
+        Parameters:
+        -----------
+        loader : callable
+            path -> dataset with 'Frequency', 'Z_Real', 'Z_Imaginary' (pd.read_csv or DatasetCache.get)
+        n_points : int
+            Size of the log-spaced calibration grid
+        max_cached : int
+            Number of interpolated reference curves kept
+        cache : CalibrationCache, optional
+            Persistent result cache consulted before computing and filled afterwards
+        """
+        self.loader = loader
+        self.cache = cache
+        self.n_points = n_points
+        self.max_cached = max_cached
+        self._references = OrderedDict()
+        self._lock = threading.Lock()
+
+    def grid(self, metal):
+        freqs = np.asarray(metal['Frequency'], dtype=float)
+        return (float(max(freqs.min(), 1)), float(freqs.max()), self.n_points)
+
+    @staticmethod
+    def grid_axis(grid_key):
+        f_min, f_max, n_points = grid_key
+        return np.logspace(np.log10(f_min), np.log10(f_max), n_points)
+
+    def reference(self, path, grid_key):
+        """Complex impedance of a reference summary on the grid `grid_key`, interpolated once"""
+        st = os.stat(path); key = (path, st.st_mtime_ns, st.st_size, grid_key)
+        with self._lock:
+            if key in self._references:
+                self._references.move_to_end(key); return self._references[key]
+        z = interpolate_z(self.loader(path), self.grid_axis(grid_key)); z.setflags(write=False)
+        with self._lock:
+            self._references[key] = z
+            while len(self._references) > self.max_cached: self._references.popitem(last=False)
+        return z
+
+    def _calibrate_group(self, metals, grid_key, bg_metal, ferrite, bg_ferrite):
+        freq_axis = self.grid_axis(grid_key)
+        z_metal = np.stack([interpolate_z(metal, freq_axis) for metal in metals])
+        z_calibrated_ferrite = self.reference(ferrite, grid_key) - self.reference(bg_ferrite, grid_key)
+        with np.errstate(divide='ignore', invalid='ignore'): z_final = (z_metal - self.reference(bg_metal, grid_key)) / z_calibrated_ferrite
+        z_final[:, z_calibrated_ferrite == 0] = np.nan
+        return freq_axis, z_final
+
+    def write_calibrated(self, path, freq, z_final):
+        """Save a _CALIBRATED.csv, through the result cache when there is one"""
+        if self.cache is None: write_calibrated_csv(path, freq, z_final)
+        else: self.cache.write_calibrated(path, freq, z_final)
+
+    def read_calibrated(self, path):
+        """Columns of a _CALIBRATED.csv, from the result cache when the file is unchanged since write_calibrated"""
+        return self.loader(path) if self.cache is None else self.cache.read_calibrated(path, self.loader)
+
+    def calibrate_one(self, paths):
+        """(freq_axis, z_final) for one metal run; `paths` as returned by reference matching"""
+        return self.calibrate_many({paths['metal']: paths})[paths['metal']]
+
+    def calibrate_many(self, jobs):
+        """
+        Calibrate many metal runs
+
+        Parameters:
+        -----------
+        jobs : dict
+            {metal_path: paths} with 'bg_metal', 'ferrite' and 'bg_ferrite' summary paths
+
+        Returns:
+        --------
+        dict
+            {metal_path: (freq_axis, z_final)}
+        """
+        groups, results, keys = {}, {}, {}
+        for metal_path, paths in jobs.items():
+            if self.cache is not None:
+                keys[metal_path] = self.cache.key({**paths, 'metal': metal_path}, self.n_points); cached = self.cache.get(keys[metal_path])
+                if cached is not None: results[metal_path] = cached; continue
+            metal = self.loader(metal_path)
+            groups.setdefault((paths['bg_metal'], paths['ferrite'], paths['bg_ferrite'], self.grid(metal)), []).append((metal_path, metal))
+        for (bg_metal, ferrite, bg_ferrite, grid_key), members in groups.items():
+            freq_axis, z_final = self._calibrate_group([metal for _, metal in members], grid_key, bg_metal, ferrite, bg_ferrite)
+            for (metal_path, _), z in zip(members, z_final):
+                results[metal_path] = (freq_axis, z)
+                if self.cache is not None: self.cache.put(keys[metal_path], freq_axis, z)
+        return results
+
+
+class LiveCalibration:
+    """
+    Point-by-point calibration of a metal sweep while it is being measured
+
+    The reference runs are interpolated once onto the planned sweep frequencies
+    (through CalibrationEngine.reference, so they share its cache), which leaves
+    one dict lookup and one complex division per incoming point. write() saves
+    the usual _CALIBRATED.csv once the summary is complete.
+
+    Parameters:
+    -----------
+    engine : CalibrationEngine
+    paths : dict
+        'metal', 'bg_metal', 'ferrite' and 'bg_ferrite' summary paths
+    grid_key : tuple
+        (min_freq, max_freq, num_points) of the sweep; the grid is the same
+        log spacing as sweep_storage.planned_frequencies
+    """
+
+    def __init__(self, engine, paths, grid_key):
+        self.engine = engine
+        self.paths = paths
+        self.freqs = engine.grid_axis(grid_key)
+        self._bg_metal = engine.reference(paths['bg_metal'], grid_key)
+        self._ferrite = engine.reference(paths['ferrite'], grid_key) - engine.reference(paths['bg_ferrite'], grid_key)
+        self._index = {float(f): i for i, f in enumerate(self.freqs)}
+
+    def calibrate(self, freq, z):
+        """Calibrated value of one measured point; frequencies off the planned grid are interpolated"""
+        i = self._index.get(float(freq))
+        if i is not None: bg_metal, ferrite = self._bg_metal[i], self._ferrite[i]
+        else:
+            bg_metal = np.interp(freq, self.freqs, self._bg_metal.real) + 1j * np.interp(freq, self.freqs, self._bg_metal.imag)
+            ferrite = np.interp(freq, self.freqs, self._ferrite.real) + 1j * np.interp(freq, self.freqs, self._ferrite.imag)
+        return complex((z - bg_metal) / ferrite) if ferrite != 0 else complex(np.nan, np.nan)
+
+    def write(self, summary_path, root_name='Measurement_Data'):
+        """Calibrate the finished summary like the Calculation tab and save it next to it; returns the file path"""
+        freq_axis, z_final = self.engine.calibrate_one({**self.paths, 'metal': summary_path})
+        path = os.path.join(os.path.dirname(summary_path), calibrated_filename(summary_path, root_name))
+        self.engine.write_calibrated(path, freq_axis, z_final)
+        return path
+
+
+class MPTCubeStore:
+    """
+    Per-metal store of calibrated responses shaped (sample, direction, frequency)
+
+    ``mpt_cube.npy`` in the metal folder is a complex128 array opened with
+    np.load(mmap_mode=...), so a slice for one sample or a cross-sample study
+    over hundreds of samples is a single read of contiguous memory; directions
+    that were not measured are NaN. ``mpt_cube.json`` holds the sample order, the
+    common frequency axis and, per (sample, direction) slot, the source
+    _CALIBRATED.csv with its mtime and size. update() only reads calibrated
+    files whose fingerprint changed, and grows the cube by doubling its sample
+    capacity when new samples appear.
+
+    Example:
+    --------
+    store = MPTCubeStore("Measurement_Data/metal/aluminum")
+    store.update({'Sample_1': {1: path_d1, 2: path_d2, ...}})
+    cube = store.open()                      # (samples, 16, frequencies) memmap
+    names, freq, ev = store.eigenvalues(MPTCalculator(), directions=range(1, 7))
+    """
+
+    CUBE_FILENAME = "mpt_cube.npy"
+    META_FILENAME = "mpt_cube.json"
+    N_DIRECTIONS = 16
+
+    def __init__(self, metal_dir):
+        self.metal_dir = metal_dir
+        self.cube_path = os.path.join(metal_dir, self.CUBE_FILENAME)
+        self.meta_path = os.path.join(metal_dir, self.META_FILENAME)
+        try:
+            with open(self.meta_path) as f: self.meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta = {'samples': [], 'freq': None, 'sources': {}}
+
+    @property
+    def samples(self):
+        return list(self.meta['samples'])
+
+    @property
+    def freq(self):
+        return None if self.meta['freq'] is None else np.asarray(self.meta['freq'])
+
+    def directions(self, sample):
+        """Directions with data for `sample`"""
+        return sorted(int(key.split('/')[1]) for key in self.meta['sources'] if key.split('/')[0] == sample)
+
+    def open(self, mode='r'):
+        """Cube memmap shaped (len(samples), 16, len(freq)), or None before the first update"""
+        if not os.path.exists(self.cube_path): return None
+        return np.load(self.cube_path, mmap_mode=mode)[:len(self.meta['samples'])]
+
+    def _ensure_capacity(self, n_samples, n_freq):
+        cube = np.load(self.cube_path, mmap_mode='r+') if os.path.exists(self.cube_path) else None
+        if cube is not None and cube.shape[0] >= n_samples: return cube
+        capacity = max(8, 2 * n_samples); tmp_path = self.cube_path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.complex128, shape=(capacity, self.N_DIRECTIONS, n_freq))
+        grown[:] = np.nan
+        if cube is not None: grown[:cube.shape[0]] = cube; del cube
+        grown.flush(); del grown
+        os.replace(tmp_path, self.cube_path)
+        return np.load(self.cube_path, mmap_mode='r+')
+
+    def update(self, direction_files):
+        """
+        Bring the cube up to date with calibrated files
+
+        Parameters:
+        -----------
+        direction_files : dict
+            {sample_name: {direction: _CALIBRATED.csv path}}
+
+        Returns:
+        --------
+        int
+            Number of (sample, direction) slots rewritten or cleared
+        """
+        sources = self.meta['sources']; changed = []
+        for sample, dirs in direction_files.items():
+            for direction, path in dirs.items():
+                fingerprint = [os.path.relpath(path, self.metal_dir), *file_fingerprint(path)]
+                if sources.get(f"{sample}/{direction}") != fingerprint: changed.append((sample, int(direction), path, fingerprint))
+        # A slot whose file moved to a new path is rewritten, not cleared
+        updated = {f"{sample}/{direction}" for sample, direction, _, _ in changed}
+        gone = [key for key in sources if key not in updated and not os.path.exists(os.path.join(self.metal_dir, sources[key][0]))]
+        if not changed and not gone: return 0
+        loaded = [(sample, direction, fingerprint, pd.read_csv(path)) for sample, direction, path, fingerprint in changed]
+        if self.meta['freq'] is None: self.meta['freq'] = np.asarray(loaded[0][3]['Frequency'], dtype=float).tolist()
+        freq = self.freq
+        for sample, *_ in loaded:
+            if sample not in self.meta['samples']: self.meta['samples'].append(sample)
+        cube = self._ensure_capacity(len(self.meta['samples']), len(freq))
+        for sample, direction, fingerprint, df in loaded:
+            f = np.asarray(df['Frequency'], dtype=float); z = np.asarray(df['Z_Calibrated_Real']) + 1j * np.asarray(df['Z_Calibrated_Imag'])
+            if len(f) != len(freq) or not np.allclose(f, freq): z = np.interp(freq, f, z.real) + 1j * np.interp(freq, f, z.imag)
+            cube[self.meta['samples'].index(sample), direction - 1] = z; sources[f"{sample}/{direction}"] = fingerprint
+        for key in gone:
+            sample, direction = key.split('/'); cube[self.meta['samples'].index(sample), int(direction) - 1] = np.nan; del sources[key]
+        cube.flush(); del cube
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w') as f: json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+        return len(changed) + len(gone)
+
+    def eigenvalues(self, calculator, directions, samples=None):
+        """
+        Eigenvalues of every sample that has all `directions`, in one batched call
+
+        Returns:
+        --------
+        names, freq, ev : list, np.ndarray, np.ndarray
+            Sample names, frequency axis and complex eigenvalues shaped (S, N, 3)
+        """
+        directions = sorted(int(d) for d in directions); cube = self.open()
+        names = [s for s in (samples or self.meta['samples']) if set(directions) <= set(self.directions(s))]
+        if cube is None or not names: return [], self.freq, np.empty((0, 0 if self.freq is None else len(self.freq), 3), dtype=np.complex128)
+        rows = [self.meta['samples'].index(s) for s in names]
+        V = cube[rows][:, [d - 1 for d in directions], :].transpose(0, 2, 1)
+        return names, self.freq, calculator.calculate_eigenvalues_batch(V, directions)
+
+
+def update_cube(calibrated_path, root_name='Measurement_Data'):
+    """Put one freshly written _CALIBRATED.csv into its metal's MPTCubeStore; returns the slots rewritten, or None outside the data tree"""
+    slot = cube_slot(calibrated_path, root_name)
+    if slot is None: return None
+    metal_dir, sample, direction = slot
+    return MPTCubeStore(metal_dir).update({sample: {direction: calibrated_path}})
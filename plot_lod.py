@@ -0,0 +1,142 @@
+"""Level-of-detail downsampling for dense frequency-domain curves."""
+
+import numpy as np
+
+
+def minmax_downsample(x, y, n_buckets, x_range=None, log_x=True):
+    """
+    Indices of a min/max-per-bucket reduction of a curve
+
+    The visible x range is split into `n_buckets` equal buckets (in log10(x)
+    when `log_x`), and each bucket keeps its first, last, minimum and maximum
+    point, so peaks and the overall envelope survive at screen resolution.
+    Points outside `x_range` are reduced to their endpoints and extremes, which
+    keeps the curve's data limits (for relim/autoscale) unchanged.
+
+    Parameters:
+    -----------
+    x, y : np.ndarray
+        Curve data; x must be sorted ascending
+    n_buckets : int
+        Number of buckets across the visible range (about one per pixel column)
+    x_range : tuple or None
+        (x_min, x_max) of the current view; defaults to the data range
+    log_x : bool
+        Bucket in log10(x) (for log-frequency axes)
+
+    Returns:
+    --------
+    np.ndarray
+        Sorted indices into x/y of the points to draw
+    """
+    x = np.asarray(x, dtype=float); y = np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    if log_x: finite &= x > 0
+    idx = np.flatnonzero(finite)
+    if len(idx) <= 4 * n_buckets: return idx
+    xs, ys = x[idx], y[idx]
+    lo, hi = (xs[0], xs[-1]) if x_range is None else x_range
+    i0, i1 = np.searchsorted(xs, lo, side='left'), np.searchsorted(xs, hi, side='right')
+    keep = [_extremes(ys, 0, i0), _extremes(ys, i1, len(xs))]
+    if i1 - i0 > 4 * n_buckets:
+        u = np.log10(xs[i0:i1]) if log_x else xs[i0:i1]
+        u_lo, u_hi = (np.log10(lo), np.log10(hi)) if log_x else (lo, hi)
+        bucket = np.clip(((u - u_lo) / max(u_hi - u_lo, 1e-300) * n_buckets).astype(np.int64), 0, n_buckets - 1)
+        order = np.lexsort((ys[i0:i1], bucket)) + i0
+        starts = np.flatnonzero(np.r_[True, np.diff(bucket) != 0])
+        ends = np.r_[starts[1:], len(bucket)] - 1
+        group_starts = np.flatnonzero(np.r_[True, np.diff(bucket[order - i0]) != 0])
+        group_ends = np.r_[group_starts[1:], len(order)] - 1
+        keep += [starts + i0, ends + i0, order[group_starts], order[group_ends]]
+    else:
+        keep.append(np.arange(i0, i1))
+    return idx[np.unique(np.concatenate(keep))]
+
+
+def minmax_envelope(y, n_buckets):
+    """
+    Min/max-per-bucket reduction of a long, uniformly sampled signal
+
+    The samples are split into `n_buckets` equal buckets and each keeps its
+    minimum and maximum. Only one bucket is read at a time, so `y` can be an
+    np.memmap of a deep capture (or a slice of one) without loading it.
+
+    Returns:
+    --------
+    idx, values : np.ndarray
+        Sample indices and values of the kept points, in sample order
+    """
+    n = len(y)
+    if n <= 2 * n_buckets: return np.arange(n), np.asarray(y, dtype=float)
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    idx = np.empty(2 * n_buckets, dtype=np.int64); values = np.empty(2 * n_buckets)
+    for b in range(n_buckets):
+        segment = np.asarray(y[edges[b]:edges[b + 1]])
+        pair = np.sort([np.argmin(segment), np.argmax(segment)])
+        idx[2 * b:2 * b + 2] = pair + edges[b]; values[2 * b:2 * b + 2] = segment[pair]
+    return idx, values
+
+
+def _extremes(ys, start, stop):
+    if stop <= start: return np.empty(0, dtype=np.int64)
+    segment = ys[start:stop]
+    return np.array([start, stop - 1, start + np.argmin(segment), start + np.argmax(segment)], dtype=np.int64)
+
+
+class LineLOD:
+    """
+    Per-axes level-of-detail manager for Line2D artists
+
+    Lines registered with `set_data` keep their full-resolution arrays here and
+    only a min/max reduction sized to the axes' pixel width is handed to
+    matplotlib. The reduction is recomputed whenever the x limits change
+    (toolbar zoom/pan/home, autoscale) or the canvas is resized, so the visible
+    detail is the same as drawing every point while draw time stays bounded.
+    Curves shorter than the point budget, or with unsorted x, are drawn as-is.
+
+    Example:
+    --------
+    lod = LineLOD(ax)
+    line, = ax.plot([], [])
+    lod.set_data(line, freqs, z_real)
+    """
+
+    def __init__(self, ax, points_per_pixel=2, log_x=True):
+        self.ax = ax
+        self.points_per_pixel = points_per_pixel
+        self.log_x = log_x
+        self._full = {}
+        self._updating = False
+        ax.callbacks.connect('xlim_changed', self._on_xlim_changed)
+        if ax.figure.canvas is not None: ax.figure.canvas.mpl_connect('resize_event', lambda event: self.update())
+
+    def _n_buckets(self):
+        return max(int(self.ax.bbox.width * self.points_per_pixel / 4), 16)
+
+    def set_data(self, line, x, y):
+        """Give `line` new full-resolution data and draw its reduced version"""
+        x = np.asarray(x, dtype=float); y = np.asarray(y, dtype=float)
+        if len(x) > 1 and np.all(np.diff(x) >= 0): self._full[line] = (x, y); self._apply(line, x, y)
+        else: self._full.pop(line, None); line.set_data(x, y)
+
+    def discard(self, line):
+        self._full.pop(line, None)
+
+    def update(self):
+        """Recompute the reduction of every registered line for the current view"""
+        for line, (x, y) in self._full.items(): self._apply(line, x, y)
+
+    def _apply(self, line, x, y):
+        n_buckets = self._n_buckets()
+        if len(x) <= 4 * n_buckets: line.set_data(x, y); return
+        x_lo, x_hi = self.ax.get_xlim()
+        x_range = (min(x_lo, x_hi), max(x_lo, x_hi))
+        if self.log_x and x_range[0] <= 0: x_range = None
+        keep = minmax_downsample(x, y, n_buckets, x_range=x_range, log_x=self.log_x)
+        line.set_data(x[keep], y[keep])
+
+    def _on_xlim_changed(self, ax):
+        if self._updating: return
+        self._updating = True
+        try: self.update()
+        finally: self._updating = False
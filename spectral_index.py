@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Nearest-neighbour index of MPT eigenvalue spectra for material identification
+
+Every reference ``*_Eigenvalues.csv`` is resampled onto a common log-frequency
+grid and its six curves (E1-E3, real and imaginary) are concatenated into one
+feature vector scaled to unit length, so matching compares spectral shape
+rather than object size. A query ranks all references by Euclidean distance
+in one matrix-vector product; when scikit-learn is installed, indexes with at
+least `ball_tree_min` references use a BallTree instead.
+
+Usage:
+------
+python spectral_index.py build Measurement_Data
+python spectral_index.py query Measurement_Data/metal/aluminum/Sample_3/Aluminum_Sample_3_Eigenvalues.csv -k 5
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from measurement_catalog import MeasurementCatalog
+from mpt_analysis import EIGENVALUE_COLUMNS, file_fingerprint
+
+try: from sklearn.neighbors import BallTree
+except ImportError: BallTree = None
+
+INDEX_FILENAME = "spectral_index.npz"
+FEATURE_POINTS = 64
+
+
+def spectrum_features(freq, eig, n_points=FEATURE_POINTS, f_range=(1e2, 1e5)):
+    """
+    Unit-length feature vector of an eigenvalue spectrum
+
+    Parameters:
+    -----------
+    freq : np.ndarray
+        Frequency axis (Hz), sorted ascending
+    eig : np.ndarray
+        Complex eigenvalues shaped (N, 3)
+    n_points : int
+        Points per curve on the log-spaced grid over `f_range`; outside the
+        measured range the end values are held
+
+    Returns:
+    --------
+    np.ndarray
+        float64 vector of length 6 * n_points
+    """
+    grid = np.log10(np.geomspace(f_range[0], f_range[1], n_points)); log_f = np.log10(np.asarray(freq, dtype=float)); eig = np.asarray(eig)
+    v = np.concatenate([np.interp(grid, log_f, part[:, i]) for part in (eig.real, eig.imag) for i in range(3)])
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+
+def read_eigenvalue_csv(path):
+    """(freq, eig (N, 3) complex) from an _Eigenvalues.csv"""
+    df = pd.read_csv(path)
+    if not all(col in df.columns for col in EIGENVALUE_COLUMNS): raise ValueError(f"{os.path.basename(path)} is missing eigenvalue columns")
+    return frame_spectrum(df)
+
+
+def frame_spectrum(df):
+    """(freq, eig (N, 3) complex) from a DataFrame with EIGENVALUE_COLUMNS"""
+    return np.asarray(df['Frequency'], dtype=float), np.stack([np.asarray(df[f'Eig{i}_Real']) + 1j * np.asarray(df[f'Eig{i}_Imag']) for i in (1, 2, 3)], axis=1)
+
+
+def results_spectrum(results):
+    """(freq, eig (N, 3) complex) from an MPTCalculator.calculate_eigenvalues() result"""
+    return np.asarray(results['freq'], dtype=float), np.stack([np.asarray(results[f'eig{i}_real']) + 1j * np.asarray(results[f'eig{i}_imag']) for i in (1, 2, 3)], axis=1)
+
+
+class SpectralIndex:
+    """
+    Library of reference eigenvalue spectra with nearest-neighbour search
+
+    Example:
+    --------
+    index = SpectralIndex.load_or_build("Measurement_Data")
+    for label, path, distance in index.query(*read_eigenvalue_csv(new_csv), k=5):
+        print(label, distance)
+    """
+
+    def __init__(self, n_points=FEATURE_POINTS, f_range=(1e2, 1e5), ball_tree_min=5000):
+        self.n_points = n_points
+        self.f_range = tuple(f_range)
+        self.ball_tree_min = ball_tree_min
+        self.labels, self.paths, self.fingerprints = [], [], []
+        self.features = np.empty((0, 6 * n_points))
+        self._norms = None
+        self._tree = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _invalidate(self):
+        self._norms = None; self._tree = None
+
+    def add(self, label, freq, eig, path=None):
+        """Add one reference spectrum"""
+        self.features = np.vstack([self.features, spectrum_features(freq, eig, self.n_points, self.f_range)])
+        self.labels.append(label); self.paths.append(path or ""); self.fingerprints.append(file_fingerprint(path) if path else (0, 0)); self._invalidate()
+
+    def update_from_tree(self, root, catalog=None):
+        """
+        Index every *_Eigenvalues.csv under `root`
+
+        The files are listed by `catalog` (a MeasurementCatalog; one is opened
+        on `root` when None) and only walked when `root` lies outside it. Rows of
+        files whose mtime and size are unchanged are kept as-is, so only new or
+        modified files are read. Returns (n_read, n_failed).
+        """
+        own_catalog = catalog is None
+        if own_catalog: catalog = MeasurementCatalog(root)
+        try: found = catalog.eigenvalue_files(root)
+        finally:
+            if own_catalog: catalog.close()
+        if found is None:
+            found = []
+            for r, dirs, fs in os.walk(root):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                found += [os.path.join(r, f) for f in fs if f.endswith("_Eigenvalues.csv")]
+        found.sort(); known = {p: (fp, row) for row, (p, fp) in enumerate(zip(self.paths, self.fingerprints))}
+        labels, paths, fingerprints, rows, n_read, n_failed = [], [], [], [], 0, 0
+        for path in found:
+            try:
+                fingerprint = file_fingerprint(path); cached = known.get(path)
+                if cached is not None and tuple(cached[0]) == fingerprint: row = self.features[cached[1]]
+                else: row = spectrum_features(*read_eigenvalue_csv(path), self.n_points, self.f_range); n_read += 1
+            except (OSError, ValueError, KeyError) as e:
+                n_failed += 1; print(f"Skipping {path}: {e}", file=sys.stderr); continue
+            labels.append(os.path.basename(path)[:-len("_Eigenvalues.csv")]); paths.append(path); fingerprints.append(fingerprint); rows.append(row)
+        self.labels, self.paths, self.fingerprints = labels, paths, fingerprints
+        self.features = np.array(rows) if rows else np.empty((0, 6 * self.n_points)); self._invalidate()
+        return n_read, n_failed
+
+    def query(self, freq, eig, k=5, exclude=None):
+        """
+        The `k` references closest to a spectrum
+
+        Parameters:
+        -----------
+        freq, eig : np.ndarray
+            Frequency axis and complex eigenvalues (N, 3) of the unknown sample
+        exclude : str or None
+            Path to leave out of the ranking (the query file itself)
+
+        Returns:
+        --------
+        list of (label, path, distance)
+            Nearest first; distance is between unit vectors, so 0 is identical
+            shape and 2 is the maximum
+        """
+        if not len(self): return []
+        q = spectrum_features(freq, eig, self.n_points, self.f_range); n = min(len(self), k + (1 if exclude else 0))
+        if BallTree is not None and len(self) >= self.ball_tree_min:
+            if self._tree is None: self._tree = BallTree(self.features)
+            dist, idx = self._tree.query(q[None, :], k=n); dist, idx = dist[0], idx[0]
+        else:
+            if self._norms is None: self._norms = np.einsum('ij,ij->i', self.features, self.features)
+            d2 = np.maximum(self._norms - 2 * self.features @ q + q @ q, 0)
+            idx = np.argpartition(d2, n - 1)[:n] if n < len(self) else np.arange(len(self)); idx = idx[np.argsort(d2[idx])]; dist = np.sqrt(d2[idx])
+        exclude = os.path.abspath(exclude) if exclude else None
+        matches = [(self.labels[i], self.paths[i], float(d)) for i, d in zip(idx, dist) if not (exclude and self.paths[i] and os.path.abspath(self.paths[i]) == exclude)]
+        return matches[:k]
+
+    def save(self, path):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, features=self.features, labels=np.array(self.labels, dtype=str), paths=np.array(self.paths, dtype=str), fingerprints=np.array(self.fingerprints, dtype=np.int64).reshape(-1, 2), n_points=self.n_points, f_range=np.array(self.f_range))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with np.load(path) as data:
+            index = cls(n_points=int(data['n_points']), f_range=tuple(data['f_range']), **kwargs)
+            index.features = data['features']; index.labels = data['labels'].tolist(); index.paths = data['paths'].tolist(); index.fingerprints = [tuple(fp) for fp in data['fingerprints'].tolist()]
+        return index
+
+    @classmethod
+    def load_or_build(cls, root, catalog=None, **kwargs):
+        """Load ``<root>/spectral_index.npz``, refresh it from the tree (see update_from_tree) and save it back"""
+        path = os.path.join(root, INDEX_FILENAME)
+        try: index = cls.load(path, **kwargs)
+        except (OSError, ValueError, KeyError): index = cls(**kwargs)
+        n_read, _ = index.update_from_tree(root, catalog)
+        if n_read or not os.path.exists(path): index.save(path)
+        return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the eigenvalue spectrum index of a Measurement_Data tree")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Index every *_Eigenvalues.csv under the root")
+    build.add_argument("root", nargs="?", default="Measurement_Data")
+    query = sub.add_parser("query", help="Rank references by similarity to eigenvalue CSVs")
+    query.add_argument("csv", nargs="+", help="_Eigenvalues.csv files to identify")
+    query.add_argument("--root", default="Measurement_Data", help="Measurement_Data root holding the index")
+    query.add_argument("-k", type=int, default=5, help="Number of matches per file")
+    args = parser.parse_args(argv)
+
+    start = time.time(); index = SpectralIndex.load_or_build(args.root)
+    print(f"Index: {len(index)} reference spectra ({time.time() - start:.2f} s)")
+    if args.command == "query":
+        for path in args.csv:
+            start = time.time(); matches = index.query(*read_eigenvalue_csv(path), k=args.k, exclude=path)
+            print(f"{path} ({(time.time() - start) * 1000:.1f} ms)")
+            for rank, (label, _, distance) in enumerate(matches, 1): print(f"  {rank}. {label}  d={distance:.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,532 @@
+"""On-disk storage helpers for frequency sweeps."""
+
+import io
+import json
+import os
+import shutil
+import time
+import zipfile
+import numpy as np
+
+
+class RawWaveformArchive:
+    """
+    Compact archive of every raw capture in a sweep
+
+    All captures of one sweep end up in a single zip container (``raw_waveforms.npz``).
+    Each capture is stored as one deflate-compressed int16 ``.npy`` member shaped
+    (2, N) (row 0 voltage, row 1 current) plus a small JSON member holding the
+    per-channel scale, decimation, sample rate, trigger position and timestamp.
+    During a sweep every capture is first written as its own pair of files in
+    ``raw_waveforms.npz.parts/`` (each renamed into place atomically, JSON last),
+    and close() merges them into a copy of the container that then replaces it.
+    A crash therefore never leaves a half-written container: the captures of an
+    interrupted sweep stay readable from the parts folder and are merged by the
+    next close() in append mode. Members are only decompressed when requested.
+
+    Example:
+    --------
+    with RawWaveformArchive("raw_waveforms.npz") as archive:
+        for f in archive.frequencies():
+            voltage, current, meta = archive.load(f, average=0)
+    """
+
+    INT16_MAX = 32767
+
+    def __init__(self, path, mode='r'):
+        """
+        Parameters:
+        -----------
+        path : str
+            Archive file path
+        mode : str
+            'r' to read an existing archive, 'a' to create or append to one
+        """
+        if mode not in ('r', 'a'):
+            raise ValueError("mode must be 'r' or 'a'")
+        self.path = path
+        self.parts_dir = path + ".parts"
+        self.mode = mode
+        self._zip = None
+        self._index = []
+        self._parts = set()
+        if os.path.exists(path) or os.path.isdir(self.parts_dir):
+            self._load_index()
+        elif mode == 'r':
+            raise FileNotFoundError(path)
+
+    def _load_index(self):
+        members = set()
+        if os.path.exists(self.path):
+            with zipfile.ZipFile(self.path, 'r') as zf:
+                for name in sorted(zf.namelist()):
+                    if name.endswith('.json'):
+                        meta = json.loads(zf.read(name).decode('utf-8'))
+                        self._index.append(meta); members.add(meta['member'])
+        if os.path.isdir(self.parts_dir):
+            # A part only counts once its JSON exists; one already merged is left for close() to delete
+            for name in sorted(os.listdir(self.parts_dir)):
+                if name.endswith('.json') and name[:-5] not in members:
+                    with open(os.path.join(self.parts_dir, name), encoding='utf-8') as fp:
+                        meta = json.load(fp)
+                    self._index.append(meta); self._parts.add(meta['member'])
+
+    def _open_reader(self):
+        if self._zip is None:
+            self._zip = zipfile.ZipFile(self.path, 'r')
+        return self._zip
+
+    def _write_part(self, name, data):
+        os.makedirs(self.parts_dir, exist_ok=True)
+        part_path = os.path.join(self.parts_dir, name); tmp_path = part_path + ".tmp"
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, part_path)
+
+    def _merge_parts(self):
+        """Append the part files to a copy of the container, swap it in and delete the parts"""
+        if not os.path.isdir(self.parts_dir):
+            return
+        if self._parts:
+            tmp_path = self.path + ".tmp"
+            if os.path.exists(self.path):
+                shutil.copyfile(self.path, tmp_path)
+            with zipfile.ZipFile(tmp_path, 'a', compression=zipfile.ZIP_DEFLATED) as zf:
+                for member in sorted(self._parts):
+                    zf.write(os.path.join(self.parts_dir, f"{member}.npy"), f"{member}.npy")
+                    zf.write(os.path.join(self.parts_dir, f"{member}.json"), f"{member}.json")
+            with open(tmp_path, 'rb') as fp:
+                os.fsync(fp.fileno())
+            os.replace(tmp_path, self.path)
+            self._parts = set()
+        for name in os.listdir(self.parts_dir):
+            os.remove(os.path.join(self.parts_dir, name))
+        os.rmdir(self.parts_dir)
+
+    @classmethod
+    def _quantize(cls, data):
+        data = np.asarray(data, dtype=np.float64)
+        peak = float(np.max(np.abs(data))) if data.size else 0.0
+        scale = peak / cls.INT16_MAX if peak > 0 else 1.0 / cls.INT16_MAX
+        return np.round(data / scale).astype(np.int16), scale
+
+    def append(self, frequency, average, voltage, current, sample_rate, decimation, trigger_pos=None, timestamp=None):
+        """
+        Append one raw capture
+
+        Parameters:
+        -----------
+        frequency : float
+            Excitation frequency in Hz
+        average : int
+            Index of the capture within the averages of this frequency
+        voltage, current : array_like
+            Raw channel data in volts (same length)
+        sample_rate : float
+            Sample rate in S/s
+        decimation : int
+            Decimation used for the capture
+        trigger_pos : tuple of int, optional
+            DMA write pointer at trigger for channel 1 and 2
+        timestamp : str, optional
+            Capture time (default: now)
+        """
+        if self.mode != 'a':
+            raise IOError("archive was opened read-only")
+        q_voltage, scale_v = self._quantize(voltage)
+        q_current, scale_i = self._quantize(current)
+        member = f"c{len(self._index):06d}"
+        meta = {
+            'member': member, 'frequency': float(frequency), 'average': int(average),
+            'scale': [scale_v, scale_i], 'sample_rate': float(sample_rate), 'decimation': int(decimation),
+            'trigger_pos': [int(p) for p in trigger_pos] if trigger_pos is not None else None,
+            'timestamp': timestamp or time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+            'num_samples': int(q_voltage.size),
+        }
+        buffer = io.BytesIO()
+        np.lib.format.write_array(buffer, np.vstack([q_voltage, q_current]))
+        self._write_part(f"{member}.npy", buffer.getvalue())
+        self._write_part(f"{member}.json", json.dumps(meta).encode('utf-8'))
+        self._index.append(meta); self._parts.add(member)
+
+    def frequencies(self):
+        """Sorted unique frequencies present in the archive"""
+        return sorted({meta['frequency'] for meta in self._index})
+
+    def entries(self, frequency=None):
+        """Metadata of every capture, optionally only those at `frequency`"""
+        if frequency is None:
+            return list(self._index)
+        return [meta for meta in self._index if np.isclose(meta['frequency'], frequency, rtol=1e-9)]
+
+    def load(self, frequency, average=0):
+        """
+        Decompress a single capture
+
+        Returns:
+        --------
+        voltage, current : np.ndarray
+            Channel data in volts (float64)
+        meta : dict
+            Capture metadata
+        """
+        matches = [meta for meta in self.entries(frequency) if meta['average'] == average]
+        if not matches:
+            raise KeyError(f"no capture at {frequency} Hz, average {average}")
+        meta = matches[-1]
+        if meta['member'] in self._parts:
+            raw = np.load(os.path.join(self.parts_dir, f"{meta['member']}.npy"))
+        else:
+            raw = np.lib.format.read_array(io.BytesIO(self._open_reader().read(f"{meta['member']}.npy")))
+        return raw[0] * meta['scale'][0], raw[1] * meta['scale'][1], meta
+
+    def close(self):
+        """Release the reader and, in append mode, merge the captured parts into the container"""
+        if self._zip is not None:
+            self._zip.close(); self._zip = None
+        if self.mode == 'a':
+            self._merge_parts()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+SUMMARY_COLUMNS = ["Timestamp", "Frequency", "Z_Magnitude", "Z_Phase", "Z_Real", "Z_Imaginary", "Voltage_Real", "Voltage_Imaginary", "Current_Real", "Current_Imaginary"]
+JOURNAL_FILENAME = "sweep_journal.json"
+QUALITY_COLUMNS = ["Timestamp", "Frequency", "Attempt", "Averages", "SNR_V_dB", "SNR_I_dB", "THD_V", "THD_I", "Spur_dBc", "Clipped", "SE_Z_pct", "Status"]
+QUALITY_FILENAME = "point_quality.csv"
+
+
+def _atomic_write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as fp:
+        json.dump(data, fp, indent=2)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+
+def planned_frequencies(params):
+    """Log-spaced sweep frequencies for params with min_freq, max_freq and num_points"""
+    return np.logspace(np.log10(params['min_freq']), np.log10(params['max_freq']), int(params['num_points']))
+
+
+def _row_from_report(path):
+    """Rebuild a summary row from a raw_freq_data report written by Background.format_results"""
+    fields = {}
+    with open(path, encoding='utf-8') as fp:
+        for line in fp:
+            if line.startswith("Individual Measurements"):
+                break
+            key, sep, value = line.partition(":")
+            if sep:
+                fields[key.strip()] = value.strip()
+    try:
+        voltage = complex(fields['Average Voltage'].split()[0].strip('()'))
+        current = complex(fields['Average Current'].split()[0].strip('()'))
+        values = [fields['Timestamp'], float(fields['Frequency'].split()[0]), float(fields['Impedance Magnitude'].split()[0]), float(fields['Impedance Phase'].split()[0]), float(fields['Impedance Real Part'].split()[0]), float(fields['Impedance Imaginary Part'].split()[0]), voltage.real, voltage.imag, current.real, current.imag]
+    except (KeyError, ValueError, IndexError):
+        return None
+    return dict(zip(SUMMARY_COLUMNS, values))
+
+
+def read_run_rows(run_dir):
+    """
+    Collect the points already measured in a run folder
+
+    Rows come from summary_results.csv; frequencies that only have a report in
+    raw_freq_data/ (e.g. the process died before the summary was flushed) are
+    rebuilt from that report. Malformed lines are skipped.
+
+    Returns:
+    --------
+    rows : dict
+        Frequency (float) -> row dict keyed by SUMMARY_COLUMNS
+    """
+    rows = {}
+    summary_path = os.path.join(run_dir, "summary_results.csv")
+    if os.path.exists(summary_path):
+        with open(summary_path, encoding='utf-8') as fp:
+            header = fp.readline().strip().split(",")
+            for line in fp:
+                parts = line.rstrip("\n").split(",")
+                if len(parts) != len(header) or not line.endswith("\n"):
+                    continue
+                row = dict(zip(header, parts))
+                try:
+                    row = {col: (row[col] if col == 'Timestamp' else float(row[col])) for col in SUMMARY_COLUMNS}
+                except (KeyError, ValueError):
+                    continue
+                rows[row['Frequency']] = row
+    raw_dir = os.path.join(run_dir, "raw_freq_data")
+    if os.path.isdir(raw_dir):
+        known = np.array(sorted(rows))
+        for name in os.listdir(raw_dir):
+            if not (name.startswith("measurement_f_") and name.endswith(".txt")):
+                continue
+            try:
+                frequency = float(name[len("measurement_f_"):-len(".txt")])
+            except ValueError:
+                continue
+            if known.size and np.any(np.abs(known - frequency) <= 0.005 + 1e-9 * frequency):
+                continue
+            row = _row_from_report(os.path.join(raw_dir, name))
+            if row is not None:
+                rows[row['Frequency']] = row
+    return rows
+
+
+def read_completed_frequencies(run_dir):
+    """Sorted frequencies already on disk in a run folder"""
+    return sorted(read_run_rows(run_dir))
+
+
+def missing_frequencies(frequencies, done, rtol=1e-6):
+    """Entries of `frequencies` that have no match in `done`"""
+    done = np.asarray(sorted(done), dtype=float)
+    if done.size == 0:
+        return list(frequencies)
+    return [f for f in frequencies if not np.any(np.isclose(done, f, rtol=rtol))]
+
+
+def find_incomplete_run(parent_dir, params):
+    """
+    Return the newest run folder under `parent_dir` that can be resumed with `params`
+
+    A run qualifies when its journal status is not 'complete' and its sweep
+    parameters match, or (for runs written before the journal existed) when it
+    has fewer points than planned and all of them lie on the planned grid.
+    Chirp screening runs (journal with 'chirp_duration') are never resumed, so
+    their STFT points cannot be mixed with stepped measurements.
+    Returns None if there is nothing to resume.
+    """
+    if not os.path.isdir(parent_dir):
+        return None
+    planned = planned_frequencies(params)
+    for name in sorted(os.listdir(parent_dir), reverse=True):
+        run_dir = os.path.join(parent_dir, name)
+        if not os.path.isdir(run_dir):
+            continue
+        journal_path = os.path.join(run_dir, JOURNAL_FILENAME)
+        if os.path.exists(journal_path):
+            try:
+                with open(journal_path, encoding='utf-8') as fp:
+                    journal = json.load(fp)
+            except (OSError, ValueError):
+                continue
+            if journal.get('status') == 'complete':
+                continue
+            old = journal.get('params', {})
+            if 'chirp_duration' in old:
+                continue
+            if not all(k in old and np.isclose(float(old[k]), float(params[k])) for k in ('min_freq', 'max_freq', 'num_points', 'averages')):
+                continue
+            done = read_completed_frequencies(run_dir)
+        elif os.path.exists(os.path.join(run_dir, "summary_results.csv")):
+            done = read_completed_frequencies(run_dir)
+            if not done or len(done) >= len(planned) or missing_frequencies(done, planned):
+                continue
+        else:
+            continue
+        if missing_frequencies(planned, done):
+            return run_dir
+    return None
+
+
+class BufferedCsvWriter:
+    """
+    Append-only CSV writer that keeps its file open
+
+    Rows are buffered in memory and written (and fsync'ed) once `flush_rows`
+    rows are pending or `flush_interval` seconds have passed since the last
+    flush, whichever comes first.
+    """
+
+    def __init__(self, path, columns, append=False, flush_rows=10, flush_interval=5.0):
+        self.path = path
+        self.columns = list(columns)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        write_header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        self._fp = open(path, 'a' if append else 'w', encoding='utf-8')
+        self._pending = []
+        self._last_flush = time.monotonic()
+        if write_header:
+            self._fp.write(",".join(self.columns) + "\n")
+            self.flush()
+
+    def write_row(self, row):
+        """Buffer one row (dict keyed by column name); returns True if this triggered a flush"""
+        self._pending.append(",".join(str(row[col]) for col in self.columns) + "\n")
+        if len(self._pending) >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        if self._pending:
+            self._fp.writelines(self._pending)
+            self._pending = []
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._fp is not None:
+            self.flush()
+            self._fp.close()
+            self._fp = None
+
+
+class SweepWriter:
+    """
+    Crash-safe writer for one sweep run folder
+
+    Holds ``summary_results.csv`` open through a BufferedCsvWriter, queues the
+    per-frequency text reports for ``raw_freq_data/`` and writes them on the
+    same flush policy, and keeps a small ``sweep_journal.json`` (status, sweep
+    parameters and frequencies already on disk) so an interrupted run can be
+    resumed. The journal is only updated after the data it refers to has been
+    flushed. With `columnar=True` the whole table is also written once as a
+    NumPy structured array (``summary_results.npy``) when the sweep closes.
+    Per-attempt quality metrics go to ``point_quality.csv`` (add_quality), and
+    a re-measured point replaces its summary row (replace_point).
+
+    Example:
+    --------
+    with SweepWriter(run_dir, params) as writer:
+        for ...:
+            writer.add_point(row, report=analyzer.format_results(f), report_name=f"measurement_f_{f:.2f}.txt")
+    """
+
+    def __init__(self, run_dir, params=None, resume=False, columnar=False, flush_rows=10, flush_interval=5.0):
+        self.run_dir = run_dir
+        self.raw_freq_data_dir = os.path.join(run_dir, "raw_freq_data")
+        self.summary_path = os.path.join(run_dir, "summary_results.csv")
+        self.journal_path = os.path.join(run_dir, JOURNAL_FILENAME)
+        self.columnar = columnar
+        os.makedirs(self.raw_freq_data_dir, exist_ok=True)
+
+        self.journal = {'status': 'running', 'params': params or {}, 'completed': [], 'started': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}
+        if resume and os.path.exists(self.journal_path):
+            with open(self.journal_path, encoding='utf-8') as fp:
+                self.journal.update(json.load(fp))
+            self.journal['status'] = 'running'
+        self.resumed = resume
+        self.rows = []
+        if resume:
+            # Start from a clean, sorted copy of what is already on disk (also drops a torn last line)
+            self.rows = [row for _, row in sorted(read_run_rows(run_dir).items())]
+            self._rewrite_summary(self.rows)
+            self.journal['completed'] = [float(row['Frequency']) for row in self.rows]
+        self._pending_reports = []
+        self._csv = BufferedCsvWriter(self.summary_path, SUMMARY_COLUMNS, append=resume, flush_rows=flush_rows, flush_interval=flush_interval)
+        self._quality = None
+        self._replaced = False
+        self._write_journal()
+
+    def _rewrite_summary(self, rows):
+        tmp_path = self.summary_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            fp.write(",".join(SUMMARY_COLUMNS) + "\n")
+            fp.writelines(",".join(str(row[col]) for col in SUMMARY_COLUMNS) + "\n" for row in rows)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self.summary_path)
+
+    def _write_journal(self):
+        self.journal['updated'] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        _atomic_write_json(self.journal_path, self.journal)
+
+    def add_point(self, row, report=None, report_name=None):
+        """Queue one summary row (dict keyed by SUMMARY_COLUMNS) and its optional text report"""
+        frequency = float(row['Frequency'])
+        self.rows.append(row)
+        self._pending_reports.append((report_name or f"measurement_f_{frequency:.2f}.txt", report, frequency))
+        if self._csv.write_row(row):
+            self._flush_reports()
+
+    def add_quality(self, row):
+        """Append one row (dict keyed by QUALITY_COLUMNS) to point_quality.csv"""
+        if self._quality is None:
+            self._quality = BufferedCsvWriter(os.path.join(self.run_dir, QUALITY_FILENAME), QUALITY_COLUMNS, append=True, flush_rows=self._csv.flush_rows, flush_interval=self._csv.flush_interval)
+        self._quality.write_row(row)
+
+    def replace_point(self, row, report=None, report_name=None):
+        """
+        Replace the summary row at the same frequency (e.g. after a re-measure)
+
+        The report is written at once; summary_results.csv is rewritten with the
+        new row when the writer closes.
+        """
+        frequency = float(row['Frequency'])
+        for n, old in enumerate(self.rows):
+            if np.isclose(float(old['Frequency']), frequency):
+                self.rows[n] = row
+                break
+        else:
+            raise KeyError(f"No summary row at {frequency} Hz")
+        self._replaced = True
+        # Queued reports go first so the old report cannot overwrite the new one
+        self.flush()
+        if report is not None:
+            with open(os.path.join(self.raw_freq_data_dir, report_name or f"measurement_f_{frequency:.2f}.txt"), 'w', encoding='utf-8') as fp:
+                fp.write(report)
+
+    def _flush_reports(self):
+        for name, report, frequency in self._pending_reports:
+            if report is not None:
+                with open(os.path.join(self.raw_freq_data_dir, name), 'w', encoding='utf-8') as fp:
+                    fp.write(report)
+            self.journal['completed'].append(frequency)
+        self._pending_reports = []
+        self._write_journal()
+
+    def flush(self):
+        self._csv.flush()
+        self._flush_reports()
+
+    def close(self, status='complete'):
+        """
+        Flush everything, record the final status and write the columnar copy if requested
+
+        Pass status='complete' only when every planned frequency is on disk; any
+        other status ('incomplete', 'interrupted', 'cancelled') leaves the run
+        resumable and skips the columnar export.
+        """
+        if self._csv is None:
+            return
+        self._csv.flush()
+        self._flush_reports()
+        self._csv.close(); self._csv = None
+        if self._quality is not None:
+            self._quality.close(); self._quality = None
+        if self.resumed and status == 'complete':
+            # Merge the resumed points into frequency order
+            self.rows = sorted(self.rows, key=lambda row: float(row['Frequency']))
+            self._rewrite_summary(self.rows)
+        elif self._replaced:
+            self._rewrite_summary(self.rows)
+        if self.columnar and status == 'complete':
+            self.write_columnar()
+        self.journal['status'] = status
+        self._write_journal()
+
+    def write_columnar(self, path=None):
+        """Write every row of this sweep as a NumPy structured array (summary_results.npy)"""
+        path = path or os.path.join(self.run_dir, "summary_results.npy")
+        dtype = [('Timestamp', 'U19')] + [(col, 'f8') for col in SUMMARY_COLUMNS[1:]]
+        table = np.array([tuple(row[col] for col in SUMMARY_COLUMNS) for row in self.rows], dtype=dtype)
+        np.save(path, table)
+        return path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(status='complete' if exc_type is None else 'interrupted')
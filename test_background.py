@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+import Background as background_module
+from Background import Background
+
+GENERATOR_PREFIXES = ('SOUR1:', 'GEN:', 'OUTPUT1:')
+
+
+@pytest.fixture
+def analyzer(fake_rp, monkeypatch):
+    monkeypatch.setattr(background_module, 'print', lambda *a, **k: None, raising=False)
+    bg = Background()
+    bg.amplitude = 0.5
+    bg.post_trigger_delay = 0
+    return bg
+
+
+def generator_commands(log):
+    return [c for c in log if c.startswith(GENERATOR_PREFIXES)]
+
+
+def test_hot_switch_only_retunes_between_points(analyzer):
+    rp = analyzer.rp
+    analyzer.measure_impedance(500.0, 2, hot_switch=True)
+    start = len(rp.log)
+    analyzer.measure_impedance(2000.0, 3, hot_switch=True)
+    between = rp.log[start:]
+    assert generator_commands(between) == ['SOUR1:FREQ:FIX 2000.0']
+    assert all(c == 'ACQ:TRig NOW' for c in between if c.startswith('ACQ:TRig ') and not c.endswith('?'))
+
+
+def test_hot_switch_starts_generator_once(analyzer):
+    analyzer.measure_impedance(500.0, 3, hot_switch=True)
+    assert analyzer.rp.log.count('SOUR1:TRig:INT') == 1
+
+
+def test_cold_measurement_retriggers_each_capture(analyzer):
+    analyzer.measure_impedance(500.0, 3)
+    log = analyzer.rp.log
+    assert log.count('GEN:RST') == 3
+    assert log.count('SOUR1:TRig:INT') == 3
+    assert log.count('ACQ:TRig AWG_PE') == 3
+
+
+def test_measure_impedance_recovers_ratio(analyzer):
+    z = analyzer.measure_impedance(2000.0, 2, hot_switch=True)[0]
+    rp = analyzer.rp
+    assert abs(z) == pytest.approx(rp.kv / rp.ki, rel=1e-3)
+    assert np.angle(z) == pytest.approx(rp.phase, abs=1e-3)
+
+
+FS = 125e6 / 256
+N = 16384
+
+
+def tone(f0, harmonics=(), mains=None, noise=0.0, seed=0):
+    t = np.arange(N) / FS
+    x = np.sin(2 * np.pi * f0 * t)
+    for h, amplitude in harmonics:
+        x += amplitude * np.sin(2 * np.pi * h * f0 * t + 0.3 * h)
+    if mains is not None:
+        x += 10 ** (mains / 20) * np.sin(2 * np.pi * 50 * t)
+    return x + np.random.default_rng(seed).normal(0, noise, N) if noise else x
+
+
+def fundamental_bin(f0, n=N):
+    return int(np.argmin(np.abs(np.fft.fftfreq(n, 1 / FS) - f0)))
+
+
+@pytest.mark.parametrize('f0', [1000.0, 1234.5, 10000.0, 33333.0])
+def test_spectrum_quality_thd(f0):
+    bg = Background.__new__(Background)
+    x = tone(f0, harmonics=[(2, 0.006), (3, 0.008)])
+    _, thd, _ = bg.spectrum_quality(x, fundamental_bin(f0))
+    assert thd == pytest.approx(0.01, rel=0.01)
+
+
+def test_spectrum_quality_snr_and_spur():
+    bg = Background.__new__(Background)
+    k = fundamental_bin(1000.0)
+    snr_db, _, clean_spur = bg.spectrum_quality(tone(1000.0, noise=1e-4), k)
+    # Hann peak (N/4)^2 over the median of exponential noise bins (ln 2 * 0.375 N sigma^2),
+    # less up to 1.42 dB of scalloping loss for a tone between bins
+    expected = 10 * np.log10((N / 4) ** 2 / (np.log(2) * 0.375 * N * 1e-8))
+    assert expected - 1.6 < snr_db < expected + 0.3
+    assert clean_spur < -60
+    _, _, mains_spur = bg.spectrum_quality(tone(1000.0, mains=-34, noise=1e-4), k)
+    assert mains_spur == pytest.approx(-34, abs=2)
+
+
+def test_chirp_recovers_a_series_rl_load():
+    # i(t) is a log chirp from 150 Hz to 14 kHz; v = R i + L di/dt is computed exactly from its phase
+    fs, duration, f0, f1, R, L = 125e6 / 1024, 2.0, 150.0, 14000.0, 2.0, 1e-4
+    t = np.arange(int(fs * duration)) / fs
+    k = np.log(f1 / f0) / (0.9 * duration)
+    phase = 2 * np.pi * f0 * np.expm1(k * t) / k
+    inst_f = np.minimum(f0 * np.exp(k * t), f1)
+    current = np.where(t < 0.9 * duration, 0.01 * np.sin(phase), 0.0)
+    voltage = np.where(t < 0.9 * duration, R * current + L * 0.01 * 2 * np.pi * inst_f * np.cos(phase), 0.0)
+    voltage += np.random.default_rng(0).normal(0, 1e-5, len(t))
+    frequencies = np.logspace(np.log10(200), 4, 15)
+    bg = Background.__new__(Background)
+    result = bg.process_chirp_capture(np.vstack([voltage, current]), frequencies, sample_rate=fs)
+    expected = R + 2j * np.pi * frequencies * L
+    assert np.allclose(result['z'], expected, rtol=0.01)
+    assert np.all(result['coherence'] > 0.99)
+    swept = np.isfinite(result['z_inst']) & (result['time'] < 0.85 * duration) & (result['time'] > 0.1)
+    assert np.allclose(result['f_inst'][swept], f0 * np.exp(k * result['time'][swept]), rtol=0.05, atol=2 * fs / 4096)
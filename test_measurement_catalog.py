@@ -0,0 +1,113 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from measurement_catalog import MeasurementCatalog, TimestampIndex, timestamp_seconds
+
+
+def write_csv(path, rows=3):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fp:
+        fp.write("Frequency,Z_Real\n" + "".join(f"{100 * (i + 1)},1.0\n" for i in range(rows)))
+
+
+def walk_summaries(folder):
+    return sorted(os.path.join(r, "summary_results.csv") for r, _, fs in os.walk(folder) if "summary_results.csv" in fs)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = str(tmp_path / "Measurement_Data")
+    sample = os.path.join(root, "metal", "aluminum", "Sample_1")
+    write_csv(os.path.join(root, "background", "20240101-110000", "summary_results.csv"))
+    write_csv(os.path.join(sample, "Direction_1", "20240101-120000", "summary_results.csv"))
+    write_csv(os.path.join(sample, "Direction_1", "20240101-120000", "Aluminum_S1_D1_CALIBRATED.csv"))
+    write_csv(os.path.join(sample, "Direction_1", "old_run", "summary_results.csv"))
+    write_csv(os.path.join(sample, "Direction_2", "Moved_CALIBRATED.csv"))
+    write_csv(os.path.join(sample, "Aluminum_Sample_1_Eigenvalues.csv"))
+    return root
+
+
+def test_find_summaries_matches_walk(tree):
+    catalog = MeasurementCatalog(tree)
+    for folder in (tree, os.path.join(tree, "metal"), os.path.join(tree, "metal", "aluminum", "Sample_1", "Direction_1")):
+        assert sorted(catalog.find_summaries(folder)) == walk_summaries(folder)
+    assert catalog.find_summaries(os.path.dirname(tree)) is None
+
+
+def test_runs_fields_and_calibrated_outside_run_folders(tree):
+    catalog = MeasurementCatalog(tree)
+    calibrated = {run['direction']: os.path.basename(run['calibrated_path']) for run in catalog.runs(type='metal', calibrated_only=True)}
+    assert calibrated == {1: "Aluminum_S1_D1_CALIBRATED.csv", 2: "Moved_CALIBRATED.csv"}
+    timed = catalog.runs(type='metal', summary_only=True, timestamped_only=True)
+    assert [(run['metal'], run['sample'], run['direction'], run['point_count']) for run in timed] == [('aluminum', 1, 1, 3)]
+    assert [run['type'] for run in catalog.runs(type='background')] == ['background']
+
+
+def test_refresh_tracks_appends_new_runs_and_deletions(tree):
+    catalog = MeasurementCatalog(tree, min_refresh_interval=3600)
+    summary = os.path.join(tree, "background", "20240101-110000", "summary_results.csv")
+    assert catalog.runs(type='background')[0]['point_count'] == 3
+    with open(summary, 'a') as fp:
+        fp.write("400,1.0\n500,1.0\n")
+    os.utime(summary, ns=(os.stat(summary).st_atime_ns, os.stat(summary).st_mtime_ns + 10 ** 9))
+    write_csv(os.path.join(tree, "background", "20240101-130000", "summary_results.csv"))
+    # throttled: still the cached view until invalidated
+    assert len(catalog.runs(type='background')) == 1
+    catalog.invalidate()
+    runs = catalog.runs(type='background')
+    assert [run['point_count'] for run in runs] == [5, 3]
+    os.remove(os.path.join(tree, "background", "20240101-130000", "summary_results.csv"))
+    catalog.refresh(force=True)
+    assert len(catalog.runs(type='background')) == 1
+
+
+def test_catalog_survives_reopen(tree):
+    first = MeasurementCatalog(tree)
+    assert first.refresh(force=True) > 0
+    first.close()
+    catalog = MeasurementCatalog(tree)
+    # only the root is re-listed: the database's own journal file touches its mtime
+    assert catalog.refresh(force=True) <= 1
+    assert sorted(catalog.find_summaries(tree)) == walk_summaries(tree)
+
+
+def test_eigenvalue_files(tree):
+    catalog = MeasurementCatalog(tree)
+    expected = [os.path.join(tree, "metal", "aluminum", "Sample_1", "Aluminum_Sample_1_Eigenvalues.csv")]
+    assert catalog.eigenvalue_files() == expected
+    assert catalog.eigenvalue_files(os.path.join(tree, "metal")) == expected
+    assert catalog.eigenvalue_files(os.path.join(tree, "background")) == []
+
+
+def test_timestamp_index_nearest_many_matches_nearest(tmp_path):
+    root = str(tmp_path)
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    for minutes in (0, 7, 30, 31, 95):
+        write_csv(os.path.join(root, "background", (start + timedelta(minutes=minutes)).strftime("%Y%m%d-%H%M%S"), "summary_results.csv"))
+    os.makedirs(os.path.join(root, "background", "notes"))
+    index = TimestampIndex(root)
+    targets = [start + timedelta(minutes=m, seconds=s) for m in range(-20, 130, 3) for s in (0, 29)]
+    for before_only in (False, True):
+        for within in (None, 600):
+            paths, deltas = index.nearest_many('background', targets, before_only=before_only, within=within)
+            for target, path, delta in zip(targets, paths, deltas):
+                expected_path, expected_delta = index.nearest('background', target, before_only=before_only, within=within)
+                assert path == expected_path
+                assert (np.isnan(delta) and expected_delta is None) or delta == pytest.approx(expected_delta)
+    assert index.nearest_many('calibration', targets[:3]) == ([None] * 3, pytest.approx([np.nan] * 3, nan_ok=True))
+
+
+def test_timestamp_index_picks_up_new_runs(tmp_path):
+    root = str(tmp_path)
+    write_csv(os.path.join(root, "background", "20240101-120000", "summary_results.csv"))
+    index = TimestampIndex(root)
+    target = timestamp_seconds(datetime(2024, 1, 1, 13, 0, 0))
+    assert index.nearest('background', target)[1] == 3600
+    # a run folder created before its summary is written is re-checked on the next lookup
+    os.makedirs(os.path.join(root, "background", "20240101-125900"))
+    assert index.nearest('background', target)[1] == 3600
+    write_csv(os.path.join(root, "background", "20240101-125900", "summary_results.csv"))
+    assert index.nearest('background', target)[1] == 60
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from monitoring import MonitorBuffer
+
+
+def test_series_keeps_the_newest_capacity_samples_in_order():
+    buffer = MonitorBuffer([1000.0, 5000.0], capacity=8, window=4)
+    for n in range(21):
+        buffer.append(0, float(n), complex(n, -n))
+    buffer.append(1, 0.5, 2 + 1j)
+    t, z = buffer.series(0)
+    assert list(t) == list(range(13, 21)) and np.array_equal(z, np.arange(13, 21) * (1 - 1j))
+    assert list(buffer.series(1)[1]) == [2 + 1j]
+    assert len(buffer) == 22
+
+
+def test_rolling_stats_match_numpy():
+    rng = np.random.default_rng(0)
+    z = rng.normal(1.0, 0.1, 137) + 1j * rng.normal(-0.5, 0.02, 137)
+    buffer = MonitorBuffer([1000.0], capacity=50, window=20)
+    for n, value in enumerate(z):
+        buffer.append(0, n, value)
+    mean, sd_real, sd_imag, n = buffer.stats(0)
+    assert n == 20 and mean == pytest.approx(z[-20:].mean())
+    assert sd_real == pytest.approx(z[-20:].real.std(ddof=1)) and sd_imag == pytest.approx(z[-20:].imag.std(ddof=1))
+    assert buffer.stats(0, window=500)[3] == 50
+
+
+def test_stats_of_short_and_empty_histories():
+    buffer = MonitorBuffer([1000.0, 2000.0], capacity=4)
+    buffer.append(0, 0.0, 3 + 4j)
+    mean, sd_real, sd_imag, n = buffer.stats(0)
+    assert mean == 3 + 4j and np.isnan(sd_real) and np.isnan(sd_imag) and n == 1
+    mean, _, _, n = buffer.stats(1)
+    assert np.isnan(mean.real) and n == 0
+    t, z = buffer.series(1)
+    assert len(t) == len(z) == 0
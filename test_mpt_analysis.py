@@ -0,0 +1,196 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mpt_analysis import CalibrationCache, CalibrationEngine, MPTCalculator, MPTCubeStore, calibrate, cube_slot, update_cube, write_calibrated_csv
+
+FREQ = np.logspace(2, 4, 20)
+
+
+def calibrated(path, scale):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_calibrated_csv(path, FREQ, scale * (1 + 0.5j) * np.sqrt(FREQ / FREQ[0]))
+    return path
+
+
+@pytest.fixture
+def metal_dir(tmp_path):
+    return str(tmp_path / "Measurement_Data" / "metal" / "aluminum")
+
+
+def run_file(metal_dir, sample, direction, run="20240101-120000"):
+    return os.path.join(metal_dir, f"Sample_{sample}", f"Direction_{direction}", run, f"Aluminum_S{sample}_D{direction}_CALIBRATED.csv")
+
+
+def test_cube_update_is_incremental_and_follows_moves(metal_dir):
+    paths = {d: calibrated(run_file(metal_dir, 1, d), d) for d in (1, 2)}
+    store = MPTCubeStore(metal_dir)
+    assert store.update({'Sample_1': paths}) == 2
+    assert MPTCubeStore(metal_dir).update({'Sample_1': paths}) == 0
+    cube = MPTCubeStore(metal_dir).open()
+    assert cube.shape == (1, 16, len(FREQ))
+    assert np.allclose(cube[0, 1], pd.read_csv(paths[2])['Z_Calibrated_Real'] + 1j * pd.read_csv(paths[2])['Z_Calibrated_Imag'])
+    assert np.isnan(cube[0, 2]).all()
+
+    # the direction 2 file is moved into another run folder: its slot is rewritten, not cleared
+    moved = run_file(metal_dir, 1, 2, run="20240102-120000")
+    os.makedirs(os.path.dirname(moved)); os.replace(paths[2], moved)
+    store = MPTCubeStore(metal_dir)
+    assert store.update({'Sample_1': {1: paths[1], 2: moved}}) == 1
+    assert store.directions('Sample_1') == [1, 2]
+    assert not np.isnan(store.open()[0, 1]).any()
+
+    # a file that disappears without a replacement clears its slot
+    os.remove(paths[1])
+    store = MPTCubeStore(metal_dir)
+    assert store.update({}) == 1
+    assert store.directions('Sample_1') == [2]
+    assert np.isnan(store.open()[0, 0]).all()
+
+
+def test_cube_grows_for_new_samples(metal_dir):
+    for sample in range(1, 11):
+        MPTCubeStore(metal_dir).update({f'Sample_{sample}': {1: calibrated(run_file(metal_dir, sample, 1), sample)}})
+    store = MPTCubeStore(metal_dir)
+    cube = store.open()
+    assert cube.shape[0] == 10 and store.samples[-1] == 'Sample_10'
+    assert np.allclose(cube[:, 0, 0].real, np.arange(1, 11))
+
+
+def test_update_cube_from_a_written_calibrated_file(metal_dir, tmp_path):
+    path = calibrated(run_file(metal_dir, 3, 5), 2.0)
+    assert cube_slot(path) == (metal_dir, 'Sample_3', 5)
+    assert update_cube(path) == 1
+    store = MPTCubeStore(metal_dir)
+    assert store.samples == ['Sample_3'] and store.directions('Sample_3') == [5]
+    assert update_cube(path) == 0
+    elsewhere = calibrated(str(tmp_path / "export" / "Aluminum_S3_D5_CALIBRATED.csv"), 2.0)
+    assert cube_slot(elsewhere) is None and update_cube(elsewhere) is None
+
+
+def test_cube_eigenvalues_match_per_sample_calculation(metal_dir):
+    rng = np.random.default_rng(0)
+    paths = {}
+    for sample in (1, 2):
+        for d in range(1, 8):
+            path = run_file(metal_dir, sample, d); os.makedirs(os.path.dirname(path))
+            write_calibrated_csv(path, FREQ, rng.normal(size=len(FREQ)) + 1j * rng.normal(size=len(FREQ)))
+            paths.setdefault(f'Sample_{sample}', {})[d] = path
+    store = MPTCubeStore(metal_dir); store.update(paths)
+    calculator = MPTCalculator()
+    names, freq, ev = store.eigenvalues(calculator, range(1, 8))
+    assert names == ['Sample_1', 'Sample_2'] and np.allclose(freq, FREQ)
+    for n, name in enumerate(names):
+        expected, _ = calculator.eigenvalues_for_files(paths[name])
+        assert np.allclose(ev[n, :, 0], expected['eig1_real'] + 1j * expected['eig1_imag'])
+        assert np.allclose(ev[n, :, 2], expected['eig3_real'] + 1j * expected['eig3_imag'])
+
+
+def summary(path, z):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame({'Frequency': FREQ, 'Z_Real': np.real(z), 'Z_Imaginary': np.imag(z)}).to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def references(tmp_path):
+    paths = {role: summary(str(tmp_path / role / "summary_results.csv"), z * np.ones(len(FREQ))) for role, z in (('bg_metal', 0.1), ('ferrite', 2.0 + 1j), ('bg_ferrite', 0.0))}
+    paths['metal'] = summary(str(tmp_path / "metal" / "summary_results.csv"), 1.0 + 0.3j * FREQ / FREQ[0])
+    return paths
+
+
+def test_calibration_cache_is_shared_and_keyed_by_contents(tmp_path, references):
+    calls = []
+    def loader(path): calls.append(path); return pd.read_csv(path)
+    first = CalibrationEngine(loader=loader, n_points=32, cache=CalibrationCache(str(tmp_path / "cache")))
+    freq, z = first.calibrate_one(references)
+    assert len(calls) == 4
+    # a new engine (another session or batch_pipeline) reads nothing but the digests
+    second = CalibrationEngine(loader=loader, n_points=32, cache=CalibrationCache(str(tmp_path / "cache")))
+    cached_freq, cached_z = second.calibrate_one(references)
+    assert len(calls) == 4 and np.array_equal(cached_freq, freq) and np.array_equal(cached_z, z)
+    summary(references['ferrite'], (4.0 + 2j) * np.ones(len(FREQ)))
+    assert np.allclose(second.calibrate_one(references)[1], z / 2) and len(calls) > 4
+
+
+def test_calibrated_files_are_read_back_from_the_cache(tmp_path, references):
+    engine = CalibrationEngine(n_points=32, cache=CalibrationCache(str(tmp_path / "cache")))
+    freq, z = engine.calibrate_one(references)
+    path = str(tmp_path / "Aluminum_CALIBRATED.csv")
+    engine.write_calibrated(path, freq, z)
+    reader = CalibrationEngine(loader=lambda p: pytest.fail("parsed a cached calibrated file"), cache=CalibrationCache(str(tmp_path / "cache")))
+    data = reader.read_calibrated(path)
+    assert np.array_equal(data['Frequency'], freq) and np.array_equal(data['Z_Calibrated_Real'] + 1j * data['Z_Calibrated_Imag'], z)
+    # an edited file no longer matches its cached digest and is parsed
+    write_calibrated_csv(path, freq, 2 * z)
+    assert np.allclose(CalibrationEngine(cache=CalibrationCache(str(tmp_path / "cache"))).read_calibrated(path)['Z_Calibrated_Real'], 2 * z.real)
+
+
+def test_calibration_cache_bounds_digests_and_bytes(tmp_path):
+    cache = CalibrationCache(str(tmp_path / "cache"), max_bytes=1, max_digests=3)
+    for n in range(5):
+        path = tmp_path / f"f{n}.csv"; path.write_text(str(n))
+        cache.file_digest(str(path))
+    assert list(cache._digests) == [str(tmp_path / f"f{n}.csv") for n in (2, 3, 4)]
+    cache.put("a", FREQ, FREQ * 1j)
+    cache.put("b", FREQ, FREQ * 1j)
+    assert cache.get("a") is None and os.listdir(tmp_path / "cache") == []
+
+
+def lstsq_eigenvalues(calculator, calibrated_data):
+    """The original per-frequency np.linalg.lstsq loop the vectorised calculator replaced"""
+    selected_dirs = sorted(calibrated_data)
+    h = calculator.H16[[d - 1 for d in selected_dirs]]; h = h / np.linalg.norm(h, axis=1, keepdims=True)
+    A = np.array([[x**2, 2*x*y, 2*x*z, y**2, 2*y*z, z**2] for x, y, z in h])
+    V = np.stack([calibrated_data[d]['Z_Calibrated_Real'] + 1j * calibrated_data[d]['Z_Calibrated_Imag'] for d in selected_dirs], axis=1)
+    ev = []
+    for row in V:
+        m = np.linalg.lstsq(A, row, rcond=None)[0]
+        ev.append(sorted(np.linalg.eigvals(m[[[0, 1, 2], [1, 3, 4], [2, 4, 5]]]), key=lambda x: x.real))
+    return np.array(ev)
+
+
+def random_directions(rng, directions, n=40):
+    return {d: pd.DataFrame({'Frequency': np.logspace(2, 5, n), 'Z_Calibrated_Real': rng.normal(size=n), 'Z_Calibrated_Imag': rng.normal(size=n)}) for d in directions}
+
+
+@pytest.mark.parametrize('directions', [range(1, 7), (1, 3, 5, 8, 11, 13, 16), range(1, 17)])
+def test_vectorised_eigenvalues_match_lstsq_loop(directions):
+    calculator = MPTCalculator()
+    data = random_directions(np.random.default_rng(1), directions)
+    results = calculator.calculate_eigenvalues(data)
+    ev = np.stack([results[f'eig{k}_real'] + 1j * results[f'eig{k}_imag'] for k in (1, 2, 3)], axis=1)
+    assert np.allclose(ev, lstsq_eigenvalues(calculator, data))
+    V = np.stack([np.stack([data[d]['Z_Calibrated_Real'] + 1j * data[d]['Z_Calibrated_Imag'] for d in sorted(data)], axis=-1)] * 2)
+    assert np.allclose(calculator.calculate_eigenvalues_batch(V, sorted(data)), ev[None])
+
+
+def test_eigenvalues_recover_a_known_tensor():
+    calculator = MPTCalculator()
+    rng = np.random.default_rng(2)
+    Q, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+    expected = np.array([1.0 + 0.1j, 2.0 - 0.3j, 5.0 + 0.2j])
+    M = Q @ np.diag(expected) @ Q.T
+    h = calculator.H16 / np.linalg.norm(calculator.H16, axis=1, keepdims=True)
+    z = np.einsum('di,ij,dj->d', h, M, h)
+    data = {d: pd.DataFrame({'Frequency': [1000.0], 'Z_Calibrated_Real': [z[d - 1].real], 'Z_Calibrated_Imag': [z[d - 1].imag]}) for d in range(1, 17)}
+    results = calculator.calculate_eigenvalues(data)
+    assert np.allclose([results[f'eig{k}_real'][0] + 1j * results[f'eig{k}_imag'][0] for k in (1, 2, 3)], expected)
+    with pytest.raises(ValueError):
+        calculator.calculate_eigenvalues({d: data[d] for d in range(1, 6)})
+
+
+def test_grouped_calibration_matches_one_run_at_a_time(tmp_path, references):
+    rng = np.random.default_rng(3)
+    jobs = {}
+    for n in range(6):
+        metal = summary(str(tmp_path / f"metal{n}" / "summary_results.csv"), rng.normal(size=len(FREQ)) + 1j * rng.normal(size=len(FREQ)))
+        # half of the runs share a second set of references
+        refs = references if n % 2 else {**references, 'bg_metal': summary(str(tmp_path / "bg2" / "summary_results.csv"), 0.3 * np.ones(len(FREQ)))}
+        jobs[metal] = {key: value for key, value in refs.items() if key != 'metal'}
+    results = CalibrationEngine(n_points=32).calibrate_many(jobs)
+    for metal, paths in jobs.items():
+        freq, z = calibrate(pd.read_csv(metal), *(pd.read_csv(paths[key]) for key in ('bg_metal', 'ferrite', 'bg_ferrite')), n_points=32)
+        assert np.allclose(results[metal][0], freq) and np.allclose(results[metal][1], z)
@@ -0,0 +1,74 @@
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from plot_lod import LineLOD, minmax_downsample, minmax_envelope
+
+
+@pytest.fixture
+def curve():
+    rng = np.random.default_rng(0)
+    x = np.logspace(1, 6, 200_000)
+    y = np.sin(np.log(x) * 40) + rng.normal(0, 0.1, len(x))
+    y[123_456] = 9.0; y[7] = -9.0
+    return x, y
+
+
+def test_downsample_keeps_bucket_extremes(curve):
+    x, y = curve
+    n_buckets = 500
+    keep = minmax_downsample(x, y, n_buckets)
+    assert len(keep) <= 4 * n_buckets and np.all(np.diff(keep) > 0)
+    assert {0, len(x) - 1, 7, 123_456} <= set(keep)
+    bucket = np.clip(((np.log10(x) - 1) / 5 * n_buckets).astype(int), 0, n_buckets - 1)
+    kept = np.zeros(len(x), dtype=bool); kept[keep] = True
+    for b in range(0, n_buckets, 37):
+        members = np.flatnonzero(bucket == b)
+        assert kept[members[np.argmax(y[members])]] and kept[members[np.argmin(y[members])]]
+
+
+def test_downsample_zoomed_view_keeps_data_limits(curve):
+    x, y = curve
+    keep = minmax_downsample(x, y, 100, x_range=(1e3, 1e4))
+    inside = keep[(x[keep] >= 1e3) & (x[keep] <= 1e4)]
+    assert 200 < len(inside) <= 400
+    assert y[keep].max() == y.max() and y[keep].min() == y.min()
+    assert x[keep][0] == x[0] and x[keep][-1] == x[-1]
+
+
+def test_downsample_skips_non_finite_and_short_curves():
+    x = np.array([0.0, 1.0, 2.0, np.nan, 4.0]); y = np.array([1.0, np.nan, 2.0, 3.0, 4.0])
+    assert list(minmax_downsample(x, y, 10)) == [2, 4]
+    assert list(minmax_downsample(x, y, 10, log_x=False)) == [0, 2, 4]
+
+
+def test_envelope_matches_brute_force_on_a_memmap(tmp_path):
+    y = np.lib.format.open_memmap(str(tmp_path / "capture.npy"), mode='w+', dtype=np.float32, shape=(100_003,))
+    y[:] = np.random.default_rng(1).normal(size=len(y))
+    idx, values = minmax_envelope(y, 64)
+    assert len(idx) == 128 and np.all(np.diff(idx) >= 0) and np.array_equal(values, y[idx])
+    edges = np.linspace(0, len(y), 65).astype(int)
+    for b in range(64):
+        segment = y[edges[b]:edges[b + 1]]
+        assert set(values[2 * b:2 * b + 2]) == {segment.min(), segment.max()}
+    short = np.arange(10.0)
+    assert np.array_equal(minmax_envelope(short, 64)[1], short)
+
+
+def test_line_lod_follows_zoom(curve):
+    x, y = curve
+    fig, ax = plt.subplots(figsize=(4, 3), dpi=100)
+    ax.set_xscale('log')
+    line, = ax.plot([], [])
+    lod = LineLOD(ax)
+    lod.set_data(line, x, y)
+    full_view = len(line.get_xdata())
+    assert full_view < len(x) / 50
+    ax.set_xlim(1e3, 2e3)
+    zoomed = np.asarray(line.get_xdata())
+    assert np.sum((zoomed >= 1e3) & (zoomed <= 2e3)) > full_view / 4
+    lod.set_data(line, x[::-1], y)
+    assert len(line.get_xdata()) == len(x)
+    plt.close(fig)
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from measurement_catalog import MeasurementCatalog
+from mpt_analysis import write_eigenvalue_csv
+from spectral_index import INDEX_FILENAME, SpectralIndex, read_eigenvalue_csv, spectrum_features
+
+FREQ = np.logspace(2, 5, 50)
+
+
+def spectrum(size, corner):
+    """Eigenvalues of a conducting object whose three curves relax around `corner` Hz"""
+    s = 1j * FREQ / corner
+    return size * np.stack([s / (1 + s), 0.6 * s / (1 + 2 * s), 0.3 * s / (1 + 0.5 * s)], axis=1)
+
+
+def write_spectrum(path, eig):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_eigenvalue_csv(path, {'freq': FREQ, **{f'eig{i + 1}_{part}': getattr(eig[:, i], part) for i in range(3) for part in ('real', 'imag')}})
+    return path
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = str(tmp_path / "Measurement_Data")
+    for metal, corner in (('aluminum', 3e3), ('copper', 1e3), ('steel', 3e4)):
+        for sample in (1, 2):
+            write_spectrum(os.path.join(root, "metal", metal, f"Sample_{sample}", f"{metal.capitalize()}_Sample_{sample}_Eigenvalues.csv"), spectrum(sample, corner * (1 + 0.05 * sample)))
+    return root
+
+
+def test_features_ignore_object_size():
+    v = spectrum_features(FREQ, spectrum(1.0, 2e3))
+    assert v.shape == (6 * 64,) and np.linalg.norm(v) == pytest.approx(1.0)
+    assert np.allclose(spectrum_features(FREQ, spectrum(40.0, 2e3)), v)
+    assert not np.allclose(spectrum_features(FREQ, spectrum(1.0, 2e4)), v)
+
+
+def test_query_matches_brute_force_ranking():
+    rng = np.random.default_rng(0)
+    index = SpectralIndex()
+    corners = rng.uniform(3e2, 5e4, 200)
+    for n, corner in enumerate(corners):
+        index.add(f"ref{n}", FREQ, spectrum(rng.uniform(0.5, 5), corner))
+    q = spectrum_features(FREQ, spectrum(1.0, 4e3))
+    expected = np.argsort(np.linalg.norm(index.features - q, axis=1))[:7]
+    matches = index.query(FREQ, spectrum(1.0, 4e3), k=7)
+    assert [label for label, _, _ in matches] == [f"ref{n}" for n in expected]
+    assert [d for _, _, d in matches] == pytest.approx(np.linalg.norm(index.features[expected] - q, axis=1))
+    assert len(index.query(FREQ, spectrum(1.0, 4e3), k=500)) == 200
+
+
+def test_tree_index_is_incremental_and_identifies_materials(tree):
+    catalog = MeasurementCatalog(tree)
+    index = SpectralIndex()
+    assert index.update_from_tree(tree, catalog) == (6, 0)
+    assert index.update_from_tree(tree, catalog) == (0, 0)
+    query_path = os.path.join(tree, "metal", "copper", "Sample_2", "Copper_Sample_2_Eigenvalues.csv")
+    label, _, distance = index.query(*read_eigenvalue_csv(query_path), k=1, exclude=query_path)[0]
+    assert label == "Copper_Sample_1" and distance < 0.1
+
+    write_spectrum(os.path.join(tree, "metal", "brass", "Sample_1", "Brass_Sample_1_Eigenvalues.csv"), spectrum(1.0, 2e3))
+    with open(os.path.join(tree, "metal", "steel", "Sample_1", "Steel_Sample_1_Eigenvalues.csv"), 'w') as fp:
+        fp.write("Frequency,Eig1_Real\n100,1\n")
+    os.remove(os.path.join(tree, "metal", "aluminum", "Sample_2", "Aluminum_Sample_2_Eigenvalues.csv"))
+    catalog.invalidate()
+    assert index.update_from_tree(tree, catalog) == (1, 1)
+    assert sorted(index.labels) == ["Aluminum_Sample_1", "Brass_Sample_1", "Copper_Sample_1", "Copper_Sample_2", "Steel_Sample_2"]
+
+
+def test_load_or_build_round_trip(tree):
+    built = SpectralIndex.load_or_build(tree)
+    assert os.path.exists(os.path.join(tree, INDEX_FILENAME)) and len(built) == 6
+    loaded = SpectralIndex.load(os.path.join(tree, INDEX_FILENAME))
+    assert loaded.labels == built.labels and np.array_equal(loaded.features, built.features)
+    assert loaded.update_from_tree(tree) == (0, 0)
+
+
+def test_root_outside_the_catalog_is_walked(tree, tmp_path):
+    other = str(tmp_path / "library")
+    write_spectrum(os.path.join(other, "Copper_Ref_Eigenvalues.csv"), spectrum(1.0, 1e3))
+    index = SpectralIndex()
+    assert index.update_from_tree(other, MeasurementCatalog(tree)) == (1, 0)
+    assert index.labels == ["Copper_Ref"]
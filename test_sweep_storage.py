@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from sweep_storage import JOURNAL_FILENAME, SUMMARY_COLUMNS, RawWaveformArchive, SweepWriter, find_incomplete_run, missing_frequencies, planned_frequencies, read_run_rows
+
+PARAMS = {'min_freq': 100.0, 'max_freq': 10000.0, 'num_points': 5, 'averages': 3}
+
+
+def make_row(frequency, z=1.0):
+    return dict(zip(SUMMARY_COLUMNS, ["2024-01-01 00:00:00", frequency, z, 0.0, z, 0.0, 1.0, 0.0, 1.0, 0.0]))
+
+
+def journal(run_dir):
+    with open(os.path.join(run_dir, JOURNAL_FILENAME)) as fp:
+        return json.load(fp)
+
+
+def test_interrupted_run_is_resumed_and_merged_in_order(tmp_path):
+    run_dir = str(tmp_path / "20240101-120000")
+    planned = planned_frequencies(PARAMS)
+    writer = SweepWriter(run_dir, params=PARAMS, flush_rows=1)
+    for f in planned[::2]:
+        writer.add_point(make_row(f), report="r", report_name=f"measurement_f_{f:.2f}.txt")
+    writer.close(status='interrupted')
+    assert journal(run_dir)['status'] == 'interrupted'
+
+    assert find_incomplete_run(str(tmp_path), PARAMS) == run_dir
+    writer = SweepWriter(run_dir, params=PARAMS, resume=True)
+    todo = missing_frequencies(planned, [row['Frequency'] for row in writer.rows])
+    assert np.allclose(todo, planned[1::2])
+    for f in todo:
+        writer.add_point(make_row(f))
+    writer.close(status='complete')
+
+    rows = read_run_rows(run_dir)
+    assert np.allclose(sorted(rows), planned)
+    with open(os.path.join(run_dir, "summary_results.csv")) as fp:
+        written = [float(line.split(',')[1]) for line in fp.readlines()[1:]]
+    assert np.allclose(written, planned)
+    assert journal(run_dir)['status'] == 'complete'
+    assert find_incomplete_run(str(tmp_path), PARAMS) is None
+
+
+def test_unflushed_summary_rows_are_rebuilt_from_reports(tmp_path):
+    run_dir = str(tmp_path / "run")
+    writer = SweepWriter(run_dir, params=PARAMS, flush_rows=100, flush_interval=1e9)
+    writer.add_point(make_row(100.0))
+    writer.flush()
+    writer.add_point(make_row(316.23))
+    # simulate a crash: the second row never reached summary_results.csv, only its report exists
+    report = "Timestamp: 2024-01-01 00:00:00\nFrequency: 316.23 Hz\nImpedance Magnitude: 2.0 ohm\nImpedance Phase: 0.0 degrees\nImpedance Real Part: 2.0 ohm\nImpedance Imaginary Part: 0.0 ohm\nAverage Voltage: (1+0j) V\nAverage Current: (0.5+0j) A\n"
+    with open(os.path.join(run_dir, "raw_freq_data", "measurement_f_316.23.txt"), 'w') as fp:
+        fp.write(report)
+    rows = read_run_rows(run_dir)
+    assert sorted(rows) == [100.0, 316.23]
+    assert rows[316.23]['Z_Magnitude'] == pytest.approx(2.0)
+
+
+def test_parameter_mismatch_is_not_resumed(tmp_path):
+    writer = SweepWriter(str(tmp_path / "run"), params=PARAMS)
+    writer.add_point(make_row(100.0))
+    writer.close(status='interrupted')
+    assert find_incomplete_run(str(tmp_path), dict(PARAMS, num_points=6)) is None
+
+
+def test_chirp_run_is_never_resumed(tmp_path):
+    writer = SweepWriter(str(tmp_path / "run"), params=dict(PARAMS, chirp_duration=2.0))
+    writer.add_point(make_row(100.0))
+    writer.close(status='interrupted')
+    assert find_incomplete_run(str(tmp_path), PARAMS) is None
+
+
+def test_replace_point_rewrites_summary(tmp_path):
+    run_dir = str(tmp_path / "run")
+    writer = SweepWriter(run_dir, params=PARAMS)
+    writer.add_point(make_row(100.0, z=1.0), report="old", report_name="m.txt")
+    writer.replace_point(make_row(100.0, z=5.0), report="new", report_name="m.txt")
+    writer.close()
+    assert read_run_rows(run_dir)[100.0]['Z_Magnitude'] == pytest.approx(5.0)
+    with open(os.path.join(run_dir, "raw_freq_data", "m.txt")) as fp:
+        assert fp.read() == "new"
+
+
+def capture(frequency, n=256):
+    t = np.arange(n) / n
+    return np.sin(2 * np.pi * 4 * t + frequency), 0.01 * np.cos(2 * np.pi * 4 * t)
+
+
+def append(archive, frequency, average=0):
+    voltage, current = capture(frequency)
+    archive.append(frequency, average, voltage, current, sample_rate=1e6, decimation=64)
+
+
+def test_archive_round_trip_across_sessions(tmp_path):
+    path = str(tmp_path / "raw_waveforms.npz")
+    with RawWaveformArchive(path, 'a') as archive:
+        append(archive, 100.0); append(archive, 100.0, average=1)
+    with RawWaveformArchive(path, 'a') as archive:
+        append(archive, 200.0)
+    assert not os.path.exists(path + ".parts")
+    with RawWaveformArchive(path) as archive:
+        assert archive.frequencies() == [100.0, 200.0] and len(archive.entries(100.0)) == 2
+        voltage, current, meta = archive.load(200.0)
+        assert np.allclose(voltage, capture(200.0)[0], atol=1 / 32767) and np.allclose(current, capture(200.0)[1], atol=0.01 / 32767)
+        assert meta['decimation'] == 64
+
+
+def test_archive_survives_a_crash_before_close(tmp_path):
+    path = str(tmp_path / "raw_waveforms.npz")
+    with RawWaveformArchive(path, 'a') as archive:
+        append(archive, 100.0)
+    archive = RawWaveformArchive(path, 'a')
+    append(archive, 200.0); append(archive, 300.0)
+    # the process dies here: no close(), and the next capture got no further than its data file
+    open(os.path.join(path + ".parts", "c000003.npy"), 'wb').write(b"\x93NUMPY")
+    open(os.path.join(path + ".parts", "c000004.npy.tmp"), 'wb').write(b"\x93")
+    with RawWaveformArchive(path) as reader:
+        assert reader.frequencies() == [100.0, 200.0, 300.0]
+        assert np.allclose(reader.load(300.0)[0], capture(300.0)[0], atol=1 / 32767)
+    with RawWaveformArchive(path, 'a') as archive:
+        append(archive, 400.0)
+    assert not os.path.exists(path + ".parts")
+    with RawWaveformArchive(path) as reader:
+        assert reader.frequencies() == [100.0, 200.0, 300.0, 400.0]
+        assert np.allclose(reader.load(400.0)[0], capture(400.0)[0], atol=1 / 32767)
+
+
+def test_archive_ignores_parts_already_merged(tmp_path):
+    path = str(tmp_path / "raw_waveforms.npz")
+    archive = RawWaveformArchive(path, 'a')
+    append(archive, 100.0)
+    shutil.copytree(path + ".parts", str(tmp_path / "kept"))
+    archive.close()
+    # a crash between swapping in the merged container and deleting the parts
+    shutil.copytree(str(tmp_path / "kept"), path + ".parts")
+    with RawWaveformArchive(path, 'a') as archive:
+        assert len(archive.entries()) == 1
+        append(archive, 200.0)
+    with RawWaveformArchive(path) as reader:
+        assert [meta['frequency'] for meta in reader.entries()] == [100.0, 200.0]
+    assert not os.path.exists(path + ".parts")